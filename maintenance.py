@@ -4,14 +4,18 @@ This script will create all necessary stuff for the app to work.
 Including: - Generating a settings.yaml file with a random SECRET_KEY if this file does not exist,
            - Reset, backup, restore the database to fixtures or to sql dump
 """
+import gzip
 import os
+import shutil
+import sqlite3
+import subprocess
 import time
 from contextlib import contextmanager
-from shutil import copyfile
 from colorama import Fore, Back, Style, init as colorama_init
 
 import pureyaml
 from django.core.files.temp import NamedTemporaryFile
+from tempfile import TemporaryFile
 
 try:
     from collections.abc import Callable  # noqa
@@ -22,6 +26,17 @@ colorama_init()
 
 CONF = {}
 
+# Size of the chunks in which dumps are streamed through (de)compression
+stream_chunk_size = 1024 * 1024
+
+# Seconds SQLite's online backup waits for other connections to release their locks on the database
+backup_lock_timeout = 60
+
+# Number of parallel jobs for Postgres dump and restore, and gzip compression level. Overridden by --jobs and
+# --compress-level
+jobs = os.cpu_count()
+compress_level = 6
+
 
 def get_config():
     """
@@ -91,6 +106,102 @@ def talk_to_user(message):
     print(Back.BLUE + Fore.WHITE + message + Style.RESET_ALL)
 
 
+def is_compressed(file_path):
+    return file_path.endswith('.gz')
+
+
+def path_size(path):
+    """
+    :return: size in bytes of a file, or of all files in a directory
+    """
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+def report_throughput(action, path, seconds):
+    """
+    Tell the user how big the backup is and how fast it was written or read
+
+    :param action: e.g. 'Backed up'
+    :param path: the backup file or directory
+    :param seconds: time taken
+    :return: None
+    """
+    megabytes = path_size(path) / 1024 / 1024
+    talk_to_user('{} {:.1f} MB in {:.1f} seconds ({:.1f} MB/s)'.format(action, megabytes, seconds,
+                                                                     megabytes / max(seconds, 1e-6)))
+
+
+def remove_backup(path):
+    """
+    Remove a previous backup so that it can be overwritten, whether it is a file or a directory-format dump
+    """
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+def stream_command_to_file(cmd, file_path):
+    """
+    Run a command and write its output to a file, gzip compressed if the file name ends with .gz, without holding
+    the output in memory.
+
+    :return: (True if the command succeeded, error message)
+    """
+    if is_compressed(file_path):
+        output = gzip.open(file_path, 'wb', compresslevel=compress_level)
+    else:
+        output = open(file_path, 'wb')
+
+    with TemporaryFile() as err_file, output as f:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err_file)
+        shutil.copyfileobj(p.stdout, f, stream_chunk_size)
+        p.stdout.close()
+        returncode = p.wait()
+        err_file.seek(0)
+        err = err_file.read().decode('utf-8')
+    return returncode == 0, err
+
+
+def stream_file_to_command(cmd, file_path):
+    """
+    Run a command with the content of a file as its input, decompressed if the file name ends with .gz
+
+    :return: (True if the command succeeded, error message)
+    """
+    opener = gzip.open if is_compressed(file_path) else open
+    with TemporaryFile() as err_file, opener(file_path, 'rb') as f:
+        p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=err_file)
+        try:
+            shutil.copyfileobj(f, p.stdin, stream_chunk_size)
+        except BrokenPipeError:
+            # The command has exited, its error output says why
+            pass
+        finally:
+            p.stdin.close()
+        returncode = p.wait()
+        err_file.seek(0)
+        err = err_file.read().decode('utf-8')
+    return returncode == 0, err
+
+
+def run_command_status(cmd):
+    """
+    Run a command and tell whether it succeeded by its exit status: tools like pg_dump and pg_restore write warnings and
+    notices to stderr even when they succeed.
+
+    :return: (True if the command succeeded, output, error message)
+    """
+    p = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return p.returncode == 0, p.stdout.decode('utf-8'), p.stderr.decode('utf-8')
+
+
 @contextmanager
 def create_tmp_mysql_conf():
     """
@@ -147,21 +258,26 @@ def reset_mysql():
 
 def backup_mysql():
     """
-    Reset Mysql database to empty.
+    Make a dump from Mysql database. The dump is read in a single transaction, so tables are not locked, and streamed
+    row by row. If the backup file ends with .gz the dump is compressed as it is written.
 
     :param filename: path to the backup file. If exists it will be overwritten
     :return: None
     """
     with create_tmp_mysql_conf() as temp_conf:
-        cmd = [path_to_mysqldump, '--defaults-extra-file={}'.format(temp_conf.name), db_name, '--result-file', backup_file, '--no-tablespaces']
-        out, err = run_command(cmd, suppress_output=True)
+        cmd = [path_to_mysqldump, '--defaults-extra-file={}'.format(temp_conf.name), db_name, '--no-tablespaces',
+               '--single-transaction', '--quick']
+        if is_compressed(backup_file):
+            return stream_command_to_file(cmd, backup_file)
+
+        out, err = run_command(cmd + ['--result-file', backup_file], suppress_output=True)
 
         return err == b'', err.decode('utf-8')
 
 
 def restore_mysql():
     """
-    Reset Mysql database to empty.
+    Restore Mysql database from a dump, decompressed on the fly if the backup file ends with .gz
 
     :return: None
     """
@@ -173,38 +289,80 @@ def restore_mysql():
             '--init-command', 'SET FOREIGN_KEY_CHECKS=0;',
             '--database', db_name
         ]
+        if is_compressed(backup_file):
+            return stream_file_to_command(cmd, backup_file)
+
         out, err = run_command(cmd + ['--execute', 'source {}'.format(backup_file)], suppress_output=True)
 
         return err == b'', err.decode('utf-8')
 
 
+def copy_sqlite(source_file, destination_file):
+    """
+    Copy a sqlite3 database with SQLite's online backup API, which gives a consistent copy even if the source is being
+    written to, and can write into a database that is in use. All pages are copied in one step: when they are copied
+    in several steps, any write to the source between two steps restarts the backup, which never finishes if the
+    source is written to constantly.
+    """
+    source = sqlite3.connect(source_file, timeout=backup_lock_timeout)
+    destination = sqlite3.connect(destination_file, timeout=backup_lock_timeout)
+    try:
+        source.backup(destination)
+    finally:
+        destination.close()
+        source.close()
+
+
 def backup_sqlite():
     """
-    Remove the sqlite3 data file.
+    Make a hot copy of the sqlite3 data file, compressed if the backup file ends with .gz
 
     :return:
     """
-    try:
-        copyfile(db_name, backup_file)
-        return True, ''
-    except FileNotFoundError:
+    if not os.path.isfile(db_name):
         talk_to_user('File {} not found - no backup created.'.format(db_name))
-        return False, 'File {} not found'.format(backup_file)
+        return False, 'File {} not found'.format(db_name)
+
+    remove_backup(backup_file)
+    if not is_compressed(backup_file):
+        copy_sqlite(db_name, backup_file)
+        return True, ''
+
+    tmp_file = backup_file + '.tmp'
+    try:
+        copy_sqlite(db_name, tmp_file)
+        with open(tmp_file, 'rb') as f, gzip.open(backup_file, 'wb', compresslevel=compress_level) as gz:
+            shutil.copyfileobj(f, gz, stream_chunk_size)
+    finally:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+    return True, ''
 
 
 def restore_sqlite():
     """
-    Restore the sqlite3 data file - simply by copying the backup over
+    Restore the sqlite3 data file from the backup, decompressing it first if it ends with .gz
 
     :return:
     """
-    try:
-        copyfile(backup_file, db_name)
-        return True, ''
-    except FileNotFoundError:
-        talk_to_user('File {} not found - no backup created.'.format(db_name))
+    if not os.path.isfile(backup_file):
+        talk_to_user('File {} not found - database not restored.'.format(backup_file))
         return False, 'File {} not found'.format(backup_file)
 
+    if not is_compressed(backup_file):
+        copy_sqlite(backup_file, db_name)
+        return True, ''
+
+    tmp_file = db_name + '.restore'
+    try:
+        with gzip.open(backup_file, 'rb') as gz, open(tmp_file, 'wb') as f:
+            shutil.copyfileobj(gz, f, stream_chunk_size)
+        copy_sqlite(tmp_file, db_name)
+    finally:
+        if os.path.isfile(tmp_file):
+            os.remove(tmp_file)
+    return True, ''
+
 
 def reset_sqlite():
     """
@@ -264,16 +422,18 @@ def reset_postgres():
     ]
 
     with create_tmp_postgre_conf():
-        # Now run query DROP SCHEMA public CASCADE; CREATE SCHEMA public; to empty the database
-        out, err = run_command(cmd + ['-c', 'DROP SCHEMA public CASCADE; CREATE SCHEMA public;'], suppress_output=True)
-        return err == b'', err.decode('utf-8')
+        # Now run query DROP SCHEMA public CASCADE; CREATE SCHEMA public; to empty the database. It writes a notice of
+        # what the drop cascades to on stderr
+        success, out, err = run_command_status(cmd + ['-c', 'DROP SCHEMA public CASCADE; CREATE SCHEMA public;'])
+        return success, err
 
 
 def backup_postgres():
     """
-    Make a dump from Postgres database
+    Make a dump from Postgres database, in directory format: one compressed file per table, dumped by `jobs` parallel
+    connections in a single snapshot.
 
-    :param filename: path to the backup file. If exists it will be overwritten
+    :param filename: path to the backup directory. If exists it will be overwritten
     :return: None
     """
     cmd = [
@@ -283,37 +443,44 @@ def backup_postgres():
         '--port', str(db_port),
         '--dbname', db_name,
         '--file', backup_file,
-        '--format', 'plain'
+        '--format', 'directory',
+        '--jobs', str(jobs),
+        '--compress', str(compress_level)
     ]
 
+    remove_backup(backup_file)
     with create_tmp_postgre_conf():
-        message, err = run_command(cmd, suppress_output=True)
+        success, message, err = run_command_status(cmd)
 
-    talk_to_user(message.decode('utf-8'))
-    return err == b'', err.decode('utf-8')
+    talk_to_user(message)
+    return success, err
 
 
 def restore_postgres():
     """
-    Reset Postgres database to empty.
+    Restore Postgres database. A directory-format dump is restored by `jobs` parallel connections with pg_restore, a
+    plain SQL dump (from an older backup) is replayed with psql.
 
-    :param filename: path to the backup file. If exists it will be overwritten
+    :param filename: path to the backup directory or file
     :return: None
     """
-    cmd = [
-        'psql',
+    connection_args = [
         '--username', db_user,
         '--host', db_host,
         '--port', str(db_port),
         '--dbname', db_name,
-        '--file', backup_file
     ]
 
+    if os.path.isdir(backup_file):
+        cmd = ['pg_restore'] + connection_args + ['--jobs', str(jobs), '--no-owner', backup_file]
+    else:
+        cmd = ['psql'] + connection_args + ['--file', backup_file]
+
     with create_tmp_postgre_conf():
-        message, err = run_command(cmd, suppress_output=True)
+        success, message, err = run_command_status(cmd)
 
-    talk_to_user(message.decode('utf-8'))
-    return True, ''
+    talk_to_user(message)
+    return success, err
 
 
 def run_command(cmd, suppress_output=False, suppress_error=False):
@@ -364,35 +531,31 @@ def run_command(cmd, suppress_output=False, suppress_error=False):
 
 def run_loaddata(fixture_dir, fixture_name):
     """
-    Import fixtures.
+    Import fixtures dumped by run_dumpdata(), one chunk at a time.
 
     :param fixture_dir: directory of the fixtures
     :param fixture_name: name of the fixtures (django qualified name)
     :return:
     """
-    fixture_file = os.path.join(fixture_dir, '{}.json'.format(fixture_name))
-    talk_to_user('Loading {} from {}'.format(fixture_name, fixture_file))
-    command = 'python manage.py loaddata {}'.format(fixture_file)
+    fixture_path = os.path.join(fixture_dir, fixture_name)
+    talk_to_user('Loading {} from {}'.format(fixture_name, fixture_path))
+    command = 'python manage.py load_tables --dir {}'.format(fixture_path)
     run_command(command)
 
 
 def run_dumpdata(fixture_dir, fixture_name):
     """
-    Export fixtures.
+    Export fixtures as chunk files of each table, streamed from the database instead of serialized in memory.
 
     :param fixture_dir: directory of the fixtures
     :param fixture_name: name of the fixtures (django qualified name)
     :return:
     """
-    fixture_file = os.path.join(fixture_dir, '{}.json'.format(fixture_name))
-    talk_to_user('Dumping {} to {}'.format(fixture_name, fixture_file))
-    command = 'python manage.py dumpdata {} --natural-foreign --indent=2'.format(fixture_name)
-    out, err = run_command(command, suppress_output=True)
-
-    print(out.decode('utf-8'))
-
-    with open(fixture_file, 'wb') as f:
-        f.write(out)
+    fixture_path = os.path.join(fixture_dir, fixture_name)
+    talk_to_user('Dumping {} to {}'.format(fixture_name, fixture_path))
+    command = 'python manage.py dump_tables {} --dir {} --compress-level {}'.format(fixture_name, fixture_path,
+                                                                                    compress_level)
+    run_command(command)
 
 
 def probe_sqlite():
@@ -500,10 +663,12 @@ def backup_database_using_sql():
     talk_to_user('Backing up database...'.format(db_engine))
 
     backup_db_function = backup_db_functions[db_engine_short_name]
+    start = time.time()
     success, err = backup_db_function()
 
     if success:
         talk_to_user('Successfully backed up database to {}'.format(backup_file))
+        report_throughput('Backed up', backup_file, time.time() - start)
 
     return success, err
 
@@ -511,10 +676,12 @@ def backup_database_using_sql():
 def restore_database_using_sql():
     talk_to_user('Restoring database from {}'.format(backup_file))
     restore_db_function = restore_db_functions[db_engine_short_name]
+    start = time.time()
     success, err = restore_db_function()
 
     if success:
         talk_to_user('Successfully restored database')
+        report_throughput('Restored', backup_file, time.time() - start)
 
     return success, err
 
@@ -555,7 +722,12 @@ if __name__ == '__main__':
                         help='Dump current data to fixtures or sql dump')
 
     parser.add_argument('--file', dest='backup_file', action='store',
-                        help='path to the file to restore from or backup to.')
+                        help='path to the file to restore from or backup to. For Postgres this is a directory. For '
+                             'Mysql and Sqlite, a file name ending with .gz is compressed.')
+    parser.add_argument('--jobs', dest='jobs', action='store', type=int, default=os.cpu_count(),
+                        help='number of parallel jobs to dump and restore Postgres databases')
+    parser.add_argument('--compress-level', dest='compress_level', action='store', type=int, default=6,
+                        help='compression level of the backup, 0-9')
 
     parser.add_argument('--generate-config', dest='generate_config', action='store_true', default=False,
                         help='path to the file to restore from or backup to.')
@@ -565,6 +737,8 @@ if __name__ == '__main__':
     restore_db = args.restore_db
     backup_db = args.backup_db
     backup_file = args.backup_file
+    jobs = args.jobs
+    compress_level = args.compress_level
     empty_db = args.empty_db
     wait_db = args.wait_db
     generate_config = args.generate_config
@@ -581,7 +755,7 @@ if __name__ == '__main__':
     if restore_db:
         if not backup_file:
             raise Exception('To restore data, parameter --file is required')
-        if not os.path.isfile(backup_file):
+        if not os.path.exists(backup_file):
             raise Exception('File {} doesn\'t exist'.format(backup_file))
 
     if backup_db:
@@ -0,0 +1,85 @@
+import numpy as np
+
+
+def linear_interpolate(x, y, grid):
+    """
+    Same result as scipy's interp1d(x, y, fill_value='extrapolate')(grid) on x sorted ascending: linear within the
+    data, extrapolated from the first two and last two points outside. Where two points share the same x, the segment
+    between them has no slope and gives NaN or inf.
+    """
+    indices = np.searchsorted(x, grid, side='left').clip(1, len(x) - 1)
+    lo = indices - 1
+    hi = indices
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (y[hi] - y[lo]) / (x[hi] - x[lo])
+        return slope * (grid - x[lo]) + y[lo]
+
+
+def is_member(sorted_values, values):
+    """
+    :return: boolean array, True where values[i] is in sorted_values
+    """
+    positions = np.searchsorted(sorted_values, values)
+    found = positions < len(sorted_values)
+    found[found] = sorted_values[positions[found]] == values[found]
+    return found
+
+
+def stacked_cumulative_curves(subcategories, datapoint_column_name, value_column_name, trim=False):
+    """
+    Compute the cumulative frequency curves of all subcategories on one shared grid (every distinct x of any
+    subcategory), each stacked on top of the ones before it. Subcategories are stacked in order of their smallest x.
+
+    :param subcategories: list of dict(subcategory=name, df=DataFrame), as returned by get_categories_details()
+    :param trim: if True, points outside the x range of a subcategory are not part of its curve (they still count in
+                 the stacking)
+    :return: list of dict(subcategory=name, x=..., y=..., interpolated=boolean array, True for the points that are not
+             actual data points), in stacking order. Points where the curve is zero are left out.
+    """
+    subcategories = list(subcategories)
+    xs = []
+    ys = []
+    for subcategory_data in subcategories:
+        df = subcategory_data['df']
+        x_data = np.asarray(df[datapoint_column_name], dtype=np.float64)
+        y_data = np.asarray(df[value_column_name], dtype=np.float64)
+
+        # Sort along x first then y, as x values might not be unique
+        sort_order = np.lexsort((y_data, x_data))
+        xs.append(x_data[sort_order])
+        ys.append(y_data[sort_order])
+
+    if len(xs) == 0:
+        return []
+
+    grid = np.unique(np.concatenate(xs))
+    stacking_order = np.argsort([x[0] for x in xs], kind='stable')
+    y_stacked = np.zeros(grid.shape)
+
+    curves = []
+    for ind in stacking_order:
+        x_data = xs[ind]
+        y_data_accum = np.cumsum(ys[ind])
+
+        if len(x_data) == 1:
+            # A single point is a step from zero to its value
+            y_interpolated = np.where(grid >= x_data[0], y_data_accum[0], 0.)
+        else:
+            y_interpolated = linear_interpolate(x_data, y_data_accum, grid)
+            # Points that cannot be interpolated, and negative extrapolated values, are zeroed so that they are dropped
+            y_interpolated[np.isnan(y_interpolated) | (y_interpolated < 0)] = 0
+
+        y_stacked = y_stacked + y_interpolated
+
+        if trim:
+            y_interpolated[(grid < x_data[0]) | (grid > x_data[-1])] = 0
+
+        points_to_keep = y_interpolated > 0
+        x_to_plot = grid[points_to_keep]
+        curves.append(dict(
+            subcategory=subcategories[ind]['subcategory'],
+            x=x_to_plot,
+            y=y_stacked[points_to_keep],
+            interpolated=~is_member(x_data, x_to_plot),
+        ))
+    return curves
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+
+
+class DistanceDataset:
+    """
+    Column store of (preposition, relatum, locatum, distance..., frequency) rows.
+
+    The first three columns are categorical: each is kept as integer codes into its sorted unique values. The other
+    columns are float64. Rows are added a sheet at a time and the columns are built once by finalise().
+    """
+
+    def __init__(self, column_names, num_category_columns=3):
+        self.column_names = column_names
+        self.category_column_names = column_names[:num_category_columns]
+        self.value_column_names = column_names[num_category_columns:]
+        self.frames = []
+        self.rows = []
+
+        self.codes = {}
+        self.categories = {}
+        self.values = {}
+        self.size = 0
+
+    def add_frame(self, df):
+        """
+        :param df: a DataFrame with (at least) the columns of this dataset
+        """
+        self.frames.append(df[self.column_names])
+
+    def add_row(self, row):
+        self.rows.append([row[x] for x in self.column_names])
+
+    def finalise(self):
+        frames = self.frames
+        if self.rows:
+            frames = frames + [pd.DataFrame(self.rows, columns=self.column_names)]
+        if frames:
+            frame = pd.concat(frames, ignore_index=True)
+        else:
+            frame = pd.DataFrame(columns=self.column_names)
+
+        for name in self.category_column_names:
+            self.categories[name], self.codes[name] = np.unique(frame[name].astype(str).values, return_inverse=True)
+        for name in self.value_column_names:
+            self.values[name] = frame[name].values.astype(np.float64)
+        self.size = len(frame)
+
+    def get_categories_details(self, category, subcategory_name, datapoint_column_name, value_column_name):
+        """
+        Split the rows by category then subcategory, both in sorted order, with one stable sort. Rows keep the order
+        they were added in within a subcategory.
+        :return: [dict(category=..., subcategories=[dict(subcategory=..., df=DataFrame of the two columns), ...]), ...]
+        """
+        category_codes = self.codes[category]
+        subcategory_codes = self.codes[subcategory_name]
+        categories = self.categories[category]
+        subcategories = self.categories[subcategory_name]
+
+        order = np.lexsort((subcategory_codes, category_codes))
+        category_codes = category_codes[order]
+        subcategory_codes = subcategory_codes[order]
+        datapoints = self.values[datapoint_column_name][order]
+        values = self.values[value_column_name][order]
+
+        # Starts of each (category, subcategory) group, and of each category
+        group_starts = np.flatnonzero(np.diff(category_codes, prepend=-1) | np.diff(subcategory_codes, prepend=-1))
+        group_ends = np.append(group_starts[1:], len(order))
+
+        categories_details = []
+        last_category_code = None
+        for start, end in zip(group_starts, group_ends):
+            category_code = category_codes[start]
+            if category_code != last_category_code:
+                subcategories_data = []
+                categories_details.append(dict(category=categories[category_code], subcategories=subcategories_data))
+                last_category_code = category_code
+
+            df = pd.DataFrame({datapoint_column_name: datapoints[start:end], value_column_name: values[start:end]},
+                              columns=[datapoint_column_name, value_column_name])
+            subcategories_data.append(dict(df=df, subcategory=subcategories[subcategory_codes[start]]))
+
+        return categories_details
@@ -1,21 +1,20 @@
 import os
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 from matplotlib.ticker import MultipleLocator
 from matplotlib.transforms import Bbox
-from scipy.interpolate import interp1d
+from mpl_toolkits.axes_grid1.inset_locator import mark_inset
 
-from zoomaxes import ZoomViewAxes
+from osm_database.jupyter_django_commons.distance_curves import stacked_cumulative_curves
+from osm_database.jupyter_django_commons.distance_dataset import DistanceDataset
+from osm_database.jupyter_django_commons.figure_rendering import FigureSpec, make_figure
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.split(__file__)[1][0:-3]
 dir_parts = current_dir.split(os.path.sep)
 root_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('osm_database')]))
 
-from mpl_toolkits.axes_grid.inset_locator import mark_inset
-
 
 #######################################################################################
 ###################################  CONSTANTS  #######################################
@@ -114,64 +113,224 @@ def bbox_from_abs(rect_x0, rect_y0, rect_width, rect_height, ax):
     return Bbox.from_bounds(bbox_x0, bbox_y0, bbox_x1 - bbox_x0, bbox_y1 - bbox_y0)
 
 
-class Database:
+title_fontdict = {'family': 'serif', 'color': 'darkblue', 'weight': 'bold', 'size': 18}
+
+
+def sorted_columns(df, datapoint_column_name, value_column_name):
     """
-    A database contains a map from preposition -> preposition data
+    :return: x and y of the dataframe as float arrays, sorted along x first then y, as x values might not be unique
     """
-    def __init__(self, column_names):
-        self.data = []
-        self.npdata = None
-        self.column_names = column_names
-        self.fre_col_header = column_names[-1]
+    x_data = np.array(df[datapoint_column_name]).astype(np.float64)
+    y_data = np.array(df[value_column_name]).astype(np.float64)
+    sort_order = np.lexsort((y_data, x_data))
+    return x_data[sort_order], y_data[sort_order]
 
-    def add_row(self, row, for_rels):
-        preposition = row['Preposition'].lower()
-        relatum = row['Relatum']
 
-        if relatum not in for_rels:
-            return
+def set_labels(ax, options):
+    if options['xlabel'] is not None:
+        ax.set_xlabel(options['xlabel'])
+    ax.set_ylabel(options['ylabel'])
+    if options['title'] is not None:
+        ax.set_title(options['title'], fontdict=title_fontdict)
+
+
+def draw_stacked(fig, data, options):
+    ax = fig.add_subplot(111)
+
+    import itertools
+    colours = itertools.cycle(('blue', 'pink', 'yellow', 'orange', 'black', 'gray', 'purple', 'lime', 'brown', 1))
 
-        locatum = row['Locatum']
-        b2b = row['Distance (b2b)']
-        c2b = row['Distance (c2b)']
-        fre = row[self.fre_col_header]
+    for curve in data['curves']:
+        x_to_plot = curve['x']
+        y_to_plot = curve['y']
+        interpolated_indx = curve['interpolated']
+        real_point_indx = np.logical_not(interpolated_indx)
 
-        self.data.append((preposition, relatum, locatum, b2b, c2b, fre))
+        # First, plot the line
+        color = next(colours)
+        ax.plot(x_to_plot, y_to_plot, label=curve['subcategory'], marker='.', color=color, markersize=15)
 
-    def finalise(self):
-        self.npdata = np.array(self.data)
+        # Then, plot the interpolated points on top with red border
+        ax.scatter(x=x_to_plot[interpolated_indx], y=y_to_plot[interpolated_indx], s=150, c='red')
 
-    def get_categories_details(self, category, subcategory_name, datapoint_column_name, value_column_name):
-        categories_details = []
+        # Finally, plot the real points with green border
+        ax.scatter(x=x_to_plot[real_point_indx], y=y_to_plot[real_point_indx], s=150, c='green')
 
-        category_column_ind = self.column_names.index(category)
-        subcategory_column_ind = self.column_names.index(subcategory_name)
-        datapoint_column_ind = self.column_names.index(datapoint_column_name)
-        value_column_ind = self.column_names.index(value_column_name)
+    ax.legend(fontsize=10)
+    set_labels(ax, options)
 
-        unique_categories = np.unique(self.npdata[:, category_column_ind])
 
-        for category in unique_categories:
-            indices = np.where(self.npdata[:, category_column_ind] == category)
-            category_data = self.npdata[indices]
-            unique_subcategories = np.unique(category_data[:, subcategory_column_ind])
+def draw_series(ax, series, colours=None):
+    """
+    Plot the lines of a gigigi figure and their point of flatting
+    :return: the lines
+    """
+    lines = []
+    for ind, subcategory_data in enumerate(series):
+        x_data = subcategory_data['x']
+        y_data = subcategory_data['y']
+        kwargs = dict(label=subcategory_data['subcategory'], marker='o')
+        if colours is not None:
+            kwargs['color'] = colours[ind]
+        line, = ax.plot(x_data, y_data, **kwargs)
+        lines.append(line)
+
+        flatting_point = subcategory_data['flatting_point']
+        if flatting_point is not None:
+            flatting_point_x, flatting_point_y = flatting_point
+            ax.scatter(x=flatting_point_x, y=flatting_point_y, s=150, c='red')
+            ax.text(flatting_point_x + 20, flatting_point_y + 10, str(int(flatting_point_x)), clip_on=True)
+    return lines
+
+
+def draw_gigigi(fig, data, options):
+    ax1 = fig.add_subplot(111)
+    fig.subplots_adjust(bottom=0.1, top=0.9)
+
+    lines = draw_series(ax1, data['series'])
+
+    legend = ax1.legend(fontsize=10)
+    if not options['legend_on']:
+        legend.remove()
+
+    set_labels(ax1, options)
+
+    new_xticks = options['xticks']
+    if new_xticks is None:
+        xticks = ax1.get_xticks()
+        new_xticks = np.arange(max(0, min(xticks)) - 100, max(xticks), 100)
+
+    ax1.set_xticks(new_xticks)
+    for label in ax1.get_xticklabels():
+        label.set_rotation(90)
+        label.set_horizontalalignment('center')
+    ml = MultipleLocator(20)
+    ax1.xaxis.set_minor_locator(ml)
+    ax1.tick_params('x', length=20, width=2, which='major')
+    ax1.tick_params('x', length=10, width=1, which='minor')
+
+    ############################################################################################
+    ##################### Plot a sub region of the original image ##############################
+
+    if data['inset'] is not None:
+        inset_x0, inset_x1, inset_y0, inset_y1, zoom_x0, zoom_y0, zoom_width = data['inset']
+
+        inset_width = inset_x1 - inset_x0
+        inset_height = inset_y1 - inset_y0
+        zoom_height = zoom_width * (inset_height / inset_width)
+
+        # Bring the view limits up to date before converting data units to axes units
+        ax1.get_xlim()
+        zoom_bbox = bbox_from_abs(zoom_x0, zoom_y0, zoom_width, zoom_height, ax1)
+
+        # The inset is an ordinary axes with the same lines drawn again, in the same colours
+        axins = ax1.inset_axes(zoom_bbox.bounds)
+        draw_series(axins, data['series'], [line.get_color() for line in lines])
+
+        axins.set_xlim(inset_x0, inset_x1)
+        axins.set_ylim(inset_y0, inset_y1)
+
+        # draw a bbox of the region of the inset axes in the parent axes and
+        # connecting lines between the bbox and the inset axes area
+        mark_inset(ax1, axins, loc1=2, loc2=4, fc="none", ec="0.5")
+
+    ############################################################################################
+
+
+def draw_scatter(fig, data, options):
+    ax = fig.add_subplot(111)
+
+    import itertools
+    colours = itertools.cycle(('red', 'blue', 'black', 'orange', 'purple', 'brown'))
+
+    same_size = options['same_size']
+    hyperbola = options['hyperbola']
+    yaxis_is_frequency = options['yaxis_is_frequency']
+    x_data_min = data['x_min']
+    x_data_max = data['x_max']
+    y_data_max = data['y_max']
+
+    subcategories_names = []
+    subcategories_indx = []
+
+    for ind, subcategory_data in enumerate(data['series'], 1):
+        subcategory = subcategory_data['subcategory']
+        x_data = np.array(subcategory_data['x'], copy=True)
+        raw_y_data = subcategory_data['y']
+        y_data = np.array(raw_y_data, copy=True)
+        if same_size:
+            s = 50
+            alpha = 1
+        else:
+            s = y_data * 20
+            alpha = 0.5
+        if not yaxis_is_frequency:
+            y_data.fill(ind)
+        colour = next(colours)
+        ax.scatter(x=x_data, y=y_data, s=s, c=colour, label=subcategory, alpha=alpha, edgecolor='black', linewidth=1)
+        num_data_point = len(x_data)
+        if num_data_point > 1:
+            if hyperbola:
+                # We need to add a small value to all x data to avoid 1/0
+                x_epsilon = 5
+                x_data += x_epsilon
+                one_over_x = 1 / x_data
+                try:
+                    poly1d = np.poly1d(np.polyfit(one_over_x, raw_y_data, 1))
+                except np.linalg.LinAlgError:
+                    poly1d = None
+                if poly1d is not None:
+                    poly_one_over_x = 1 / np.linspace(x_data_min + x_epsilon, x_data_max + x_epsilon, 300)
+                    poly_y = poly1d(poly_one_over_x)
+                    ax.plot(1 / poly_one_over_x - x_epsilon, poly_y, c=colour, linestyle='dashed')
+            else:
+                poly1d = np.poly1d(np.polyfit(x_data, raw_y_data, 1))
+                poly_x = np.linspace(x_data_min, x_data_max, 300)
+                poly_y = poly1d(poly_x)
+                ax.plot(poly_x, poly_y, c=colour, linestyle='dashed')
+        subcategories_names.append(subcategory)
+        subcategories_indx.append(ind)
+    if yaxis_is_frequency:
+        legend = ax.legend(fontsize=10)
+        for legend_handler in legend.legendHandles:
+            legend_handler._sizes = [50]
+    else:
+        ax.set_yticks(subcategories_indx)
+        ax.set_yticklabels(subcategories_names)
+
+    set_labels(ax, options)
 
-            subcategories_data = []
-            for subcategory in unique_subcategories:
-                indices_ = np.where(category_data[:, subcategory_column_ind] == subcategory)
-                df_data = category_data[indices_][:, (datapoint_column_ind, value_column_ind)]
-                df = pd.DataFrame(columns=[datapoint_column_name, value_column_name], data=df_data)
-                subcategories_data.append(dict(df=df, subcategory=subcategory))
+    ax.set_ylim((-5, y_data_max + 5))
+    if options['xticks'] is not None:
+        ax.set_xticks(options['xticks'])
 
-            categories_details.append(dict(category=category, subcategories=subcategories_data))
 
-        return categories_details
+class Database(DistanceDataset):
+    """
+    A database contains a map from preposition -> preposition data
+    """
+    def __init__(self, column_names):
+        super().__init__(column_names)
+        self.fre_col_header = column_names[-1]
+
+    def add_frame(self, df, for_rels):
+        df = df[df['Relatum'].isin(for_rels)].copy()
+        df['Preposition'] = df['Preposition'].str.lower()
+        super().add_frame(df)
+
+    def add_row(self, row, for_rels):
+        if row['Relatum'] not in for_rels:
+            return
+        row = row.copy()
+        row['Preposition'] = row['Preposition'].lower()
+        super().add_row(row)
 
 
 class Plotter:
     def __init__(self, column_names, full_labels):
         self.database = Database(column_names)
         self.full_labels = full_labels
+        self.legend_on = True
 
     def merge_categories(self, categories_details):
         all_subcategories = {}
@@ -198,15 +357,31 @@ class Plotter:
         }]
 
     def plot(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix, type='gigigi'):
+        """
+        Same as figure_specs() but the figures are drawn, in this process
+        :return: (dict of figure name -> Figure, 'figure') or (dict of category -> DataFrame, 'table')
+        """
+        results, result_type = self.figure_specs(categories_details, datapoint_column_name, value_column_name,
+                                                 image_name_prefix, type)
+        if result_type == 'figure':
+            results = {spec.name: make_figure(spec) for spec in results}
+        return results, result_type
+
+    def figure_specs(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix,
+                     type='gigigi'):
+        """
+        :return: (list of FigureSpec, 'figure') to be rendered with figure_rendering.render_figures(),
+                 or (dict of category -> DataFrame, 'table')
+        """
         image_name_prefix += '_' + type
         result_type = 'figure'
         if type.startswith('gigigi'):
             accum = '-accum' in type
             highlight = '-highlight' in type
-            results = self._plot_gigigi(categories_details, datapoint_column_name, value_column_name, image_name_prefix, accum, highlight)
+            results = self._gigigi_specs(categories_details, datapoint_column_name, value_column_name, image_name_prefix, accum, highlight)
         elif type.startswith('stacked'):
             trim = '-trim' in type
-            results = self._plot_interpolated(categories_details, datapoint_column_name, value_column_name, image_name_prefix, trim)
+            results = self._interpolated_specs(categories_details, datapoint_column_name, value_column_name, image_name_prefix, trim)
         elif type.startswith('table'):
             accum = '-accum' in type
             results =self._plot_table(categories_details, datapoint_column_name, value_column_name, accum)
@@ -214,145 +389,43 @@ class Plotter:
         elif type.startswith('normal'):
             same_size = '-samesize' in type
             hyperbola = '-hyperbola' in type
-            results = self._plot_scatter(categories_details, datapoint_column_name, value_column_name, image_name_prefix,
-                               same_size, hyperbola, yaxis_is_frequency=True)
+            results = self._scatter_specs(categories_details, datapoint_column_name, value_column_name, image_name_prefix,
+                                          same_size, hyperbola, yaxis_is_frequency=True)
         else:
             same_size = False
             hyperbola = False
-            results = self._plot_scatter(categories_details, datapoint_column_name, value_column_name, image_name_prefix,
-                               same_size, hyperbola, yaxis_is_frequency=False)
+            results = self._scatter_specs(categories_details, datapoint_column_name, value_column_name, image_name_prefix,
+                                          same_size, hyperbola, yaxis_is_frequency=False)
 
         return results, result_type
 
-    def _plot_interpolated(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix, trim):
-        retval = {}
+    def _options(self, file_name, datapoint_column_name, value_column_name, **kwargs):
+        options = dict(
+            figsize=(10, 7),
+            xlabel=self.full_labels.get(datapoint_column_name, datapoint_column_name),
+            ylabel=self.full_labels.get(value_column_name, value_column_name),
+            title=file_name.replace('_', ' ') if show_plot_title else None,
+        )
+        options.update(kwargs)
+        return options
+
+    def _interpolated_specs(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix, trim):
+        retval = []
         for category_details in categories_details:
             category = category_details['category']
 
             file_name = image_name_prefix + '-' + category.replace(' ', '_')
-            file_path = os.path.join(file_name)
 
             subcategories = category_details['subcategories']
+            curves = stacked_cumulative_curves(subcategories, datapoint_column_name, value_column_name, trim)
 
-            fig = plt.figure(figsize=(10, 7))
-            retval[file_name] = fig
-
-            import itertools
-            colours = itertools.cycle(('blue', 'pink', 'yellow', 'orange', 'black', 'gray', 'purple', 'lime', 'brown', 1))
-
-            # Interpolate data here
-            all_x_data = np.array([])
-            subcategory_first_xs = []
-
-            for ind, subcategory_data in enumerate(subcategories, 1):
-                df = subcategory_data['df']
-                x_data = np.array(df[datapoint_column_name]).astype(np.float)
-                all_x_data = np.concatenate((all_x_data, x_data))
-                x_data_min = np.min(x_data)
-                subcategory_first_xs.append(x_data_min)
-
-            all_x_data.sort()
-            all_x_data = np.unique(all_x_data)
-
-            subcategory_order_by_min_x = np.argsort(subcategory_first_xs)
-            y_data_interpolated_accum = np.zeros(all_x_data.shape)
-
-            for ind in subcategory_order_by_min_x:
-                subcategory_data = subcategories[ind]
-
-            # for ind, subcategory_data in enumerate(subcategories, 1):
-                subcategory = subcategory_data['subcategory']
-                df = subcategory_data['df']
-                x_data = np.array(df[datapoint_column_name]).astype(np.float)
-                y_data = np.array(df[value_column_name]).astype(np.float)
-
-                # We need to sort - along x-axis first and then y-axis, this is because there values of x_data
-                # might not be all unique
-                sort_order = np.lexsort((y_data, x_data))
-                x_data = x_data[sort_order]
-                y_data = y_data[sort_order]
-
-                # First accumulate frequency data
-                y_data_accum = np.add.accumulate(y_data)
-
-                # Now linear interpolate. In case there's only one data point, the interpolation
-                # will simply be filled with that one value
-                if len(x_data) == 1:
-                    y_data_interpolated = np.zeros(all_x_data.shape)
-                    y_data_interpolated[np.where(all_x_data == x_data[0])] = y_data_accum[0]
-                    y_data_interpolated = np.add.accumulate(y_data_interpolated)
-                else:
-                    y_interp = interp1d(x_data, y_data_accum, fill_value="extrapolate")
-                    y_data_interpolated = y_interp(all_x_data)
-                    nan_inds = np.where(np.isnan(y_data_interpolated))
-
-                    # Data cannot be interpolated between two datapoints that have the same x values.
-                    # In this case we need to interpolate the point based on differential equation -
-                    # which for linear interpolation is simply to take the average of y values
-                    for ind in nan_inds:
-                        x = all_x_data[ind]
-                        replacement = np.mean(y_data[np.where(x_data == x)])
-                        y_data_interpolated[ind] = replacement
-
-                    # Extrapolation can produce negative value, so we simply set them to zero
-                    # marked for removal later. This might not be the best way
-                    y_data_interpolated[np.where(y_data_interpolated < 0)] = 0
-                    y_data_interpolated[np.where(np.isnan(y_data_interpolated))] = 0
-                    # y_data_interpolated[np.where(all_x_data < x_data[0])] = 0
-                    # y_data_interpolated[np.where(all_x_data > x_data[-1])] = 0
-
-                # This is for stacking the next line on top of the previous line
-                # e.g. value to plot is current value plus accumulative prior values
-                y_data_interpolated_accum = y_data_interpolated_accum + y_data_interpolated
-
-                if trim:
-                    # Remove the interpolated points prior to the beginning of the actual array,
-                    # and after the end of the actual array. We do this by marking these point zeros
-                    y_data_interpolated[np.where(all_x_data < x_data[0])] = 0
-                    y_data_interpolated[np.where(all_x_data > x_data[-1])] = 0
-
-                # Mark all the non-zero points to keep, all the rest will be removed
-                points_to_keep = np.where(y_data_interpolated > 0)
-
-                # Actual points to be plotted, after removing zero points
-                x_to_plot = all_x_data[points_to_keep]
-                y_to_plot = y_data_interpolated_accum[points_to_keep]
-
-                # We find out which points are interpolated, which one are real
-                # So that we can draw a circle around them with different colours
-                interpolated_indx = np.empty(x_to_plot.shape, dtype=np.bool)
-                interpolated_indx.fill(False)
-                for i, x in enumerate(x_to_plot):
-                    interpolated_indx[i] = len(np.where(x_data == x)[0]) == 0
-
-                real_point_indx = np.logical_not(interpolated_indx)
-
-                # First, plot the line
-                color = next(colours)
-                plt.plot(x_to_plot, y_to_plot, label=subcategory, marker='.', color=color, markersize=15)
-
-                # Then, plot the interpolated points on top with red border
-                plt.scatter(x=x_to_plot[interpolated_indx], y=y_to_plot[interpolated_indx], s=150, c='red')
-
-                # Finally, plot the real points with green border
-                plt.scatter(x=x_to_plot[real_point_indx], y=y_to_plot[real_point_indx], s=150, c='green')
-
-            plt.legend(fontsize=10)
-
-            plt.xlabel(self.full_labels.get(datapoint_column_name, datapoint_column_name))
-            plt.ylabel(self.full_labels.get(value_column_name, value_column_name))
-
-            if show_plot_title:
-                plt.title(file_name.replace('_', ' '),
-                          fontdict={'family': 'serif',
-                                    'color': 'darkblue',
-                                    'weight': 'bold',
-                                    'size': 18})
+            options = self._options(file_name, datapoint_column_name, value_column_name)
+            retval.append(FigureSpec(file_name, draw_stacked, dict(curves=curves), options))
 
         return retval
 
-    def _plot_gigigi(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix, accum=False, highlight=False):
-        retval = {}
+    def _gigigi_specs(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix, accum=False, highlight=False):
+        retval = []
         for category_details in categories_details:
             category = category_details['category']
 
@@ -360,92 +433,26 @@ class Plotter:
 
             subcategories = category_details['subcategories']
 
-            fig, ax1 = plt.subplots(figsize=(10, 7))
-
-            plt.subplots_adjust(bottom=0.1, top=0.9)
-
-            retval[file_name] = fig
-
+            series = []
             for ind, subcategory_data in enumerate(subcategories, 1):
-                subcategory = subcategory_data['subcategory']
-                df = subcategory_data['df']
-                x_data = np.array(df[datapoint_column_name]).astype(np.float)
-                y_data = np.array(df[value_column_name]).astype(np.float)
-
-                sort_order = np.lexsort((y_data, x_data))
-                x_data = x_data[sort_order]
-                y_data = y_data[sort_order]
+                x_data, y_data = sorted_columns(subcategory_data['df'], datapoint_column_name, value_column_name)
 
                 if accum:
                     y_data = np.add.accumulate(y_data)
 
-                plt.plot(x_data, y_data, label=subcategory, marker='o')
-
+                flatting_point = None
                 if highlight:
                     flatting_point_ind = detect_point_of_flatting(x_data, y_data, cutoff_angle)
                     if flatting_point_ind is not None:
-                        flatting_point_x = x_data[flatting_point_ind]
-                        flatting_point_y = y_data[flatting_point_ind]
-                        plt.scatter(x=flatting_point_x, y=flatting_point_y, s=150, c='red')
-                        plt.text(flatting_point_x + 20, flatting_point_y + 10, str(int(flatting_point_x)))
-
-                        # plt.annotate(str(int(flatting_point_x)),
-                        #              xy=(flatting_point_x, flatting_point_y),
-                        #              xytext=(20, 10), textcoords='offset pixels',
-                        #              horizontalalignment='right',
-                        #              verticalalignment='bottom',
-                        #              arrowprops=dict(arrowstyle="-|>"))
-
-            legend = plt.legend(fontsize=10)
-            if not self.legend_on:
-                legend.remove()
-
-            plt.xlabel(self.full_labels.get(datapoint_column_name, datapoint_column_name))
-            plt.ylabel(self.full_labels.get(value_column_name, value_column_name))
-
-            if use_global_xticks:
-                new_xticks = global_xticks
-            else:
-                xticks = plt.xticks()[0]
-                new_xticks = np.arange(max(0, min(xticks)) - 100, max(xticks), 100)
-
-            plt.xticks(new_xticks, rotation=90, ha='center')
-            ml = MultipleLocator(20)
-            ax1.xaxis.set_minor_locator(ml)
-            ax1.tick_params('x', length=20, width=2, which='major')
-            ax1.tick_params('x', length=10, width=1, which='minor')
+                        flatting_point = (x_data[flatting_point_ind], y_data[flatting_point_ind])
 
-            ############################################################################################
-            ##################### Plot a sub region of the original image ##############################
-
-            if category in inset_config:
-                inset_x0, inset_x1, inset_y0, inset_y1, zoom_x0, zoom_y0, zoom_width = inset_config[category]
-
-                inset_width = inset_x1 - inset_x0
-                inset_height = inset_y1 - inset_y0
-                zoom_height = zoom_width * (inset_height / inset_width)
-                zoom_bbox = bbox_from_abs(zoom_x0, zoom_y0, zoom_width, zoom_height, ax1)
-
-                zoom_ratio = zoom_width / (inset_x1 - inset_x0)
-
-                axins = ZoomViewAxes(zoom_ratio, ax1, zoom_bbox, ax1.transAxes)
-
-                axins.set_xlim(inset_x0, inset_x1)
-                axins.set_ylim(inset_y0, inset_y1)
-
-                # draw a bbox of the region of the inset axes in the parent axes and
-                # connecting lines between the bbox and the inset axes area
-                mark_inset(ax1, axins, loc1=2, loc2=4, fc="none", ec="0.5")
-
-            ############################################################################################
-
-            if show_plot_title:
-                plt.title(file_name.replace('_', ' '),
-                          fontdict={'family': 'serif',
-                                    'color': 'darkblue',
-                                    'weight': 'bold',
-                                    'size': 18})
+                series.append(dict(subcategory=subcategory_data['subcategory'], x=x_data, y=y_data,
+                                   flatting_point=flatting_point))
 
+            data = dict(series=series, inset=inset_config.get(category, None))
+            options = self._options(file_name, datapoint_column_name, value_column_name, legend_on=self.legend_on,
+                                    xticks=global_xticks if use_global_xticks else None)
+            retval.append(FigureSpec(file_name, draw_gigigi, data, options))
 
         return retval
 
@@ -524,103 +531,39 @@ class Plotter:
             retval[category] = df
         return retval
 
-    def _plot_scatter(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix,
-                      same_size, hyperbola, yaxis_is_frequency=True):
-        retval = {}
+    def _scatter_specs(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix,
+                       same_size, hyperbola, yaxis_is_frequency=True):
+        retval = []
         for category_details in categories_details:
             category = category_details['category']
 
             file_name = image_name_prefix + '-' + category.replace(' ', '_')
 
             subcategories = category_details['subcategories']
-            fig = plt.figure(figsize=(10, 7))
-            retval[file_name] = fig
 
-            import itertools
-            colours = itertools.cycle(('red', 'blue', 'black', 'orange', 'purple', 'brown'))
+            series = []
+            for subcategory_data in subcategories:
+                x_data, y_data = sorted_columns(subcategory_data['df'], datapoint_column_name, value_column_name)
+                series.append(dict(subcategory=subcategory_data['subcategory'], x=x_data, y=y_data))
 
-            subcategories_names = []
-            subcategories_indx = []
+            data = dict(
+                series=series,
+                x_min=min(x['x'].min() for x in series),
+                x_max=max(x['x'].max() for x in series),
+                y_max=max(x['y'].max() for x in series),
+            )
 
-            x_data_min = None
-            x_data_max = None
-            y_data_max = None
-            for ind, subcategory_data in enumerate(subcategories, 1):
-                df = subcategory_data['df']
-                x_data = np.array(df[datapoint_column_name]).astype(np.float)
-                raw_y_data = np.array(df[value_column_name]).astype(np.float)
-                x_data_min = x_data.min() if x_data_min is None else min(x_data_min, x_data.min())
-                x_data_max = x_data.max() if x_data_max is None else max(x_data_max, x_data.max())
-                y_data_max = raw_y_data.max() if y_data_max is None else max(y_data_max, raw_y_data.max())
-            for ind, subcategory_data in enumerate(subcategories, 1):
-                subcategory = subcategory_data['subcategory']
-                df = subcategory_data['df']
-                x_data = np.array(df[datapoint_column_name]).astype(np.float)
-                raw_y_data = np.array(df[value_column_name]).astype(np.float)
-                sort_order = np.lexsort((raw_y_data, x_data))
-                x_data = x_data[sort_order]
-                raw_y_data = raw_y_data[sort_order]
-                y_data = np.array(raw_y_data, copy=True)
-                if same_size:
-                    s = 50
-                    alpha = 1
-                else:
-                    s = y_data * 20
-                    alpha = 0.5
-                if not yaxis_is_frequency:
-                    y_data.fill(ind)
-                colour = next(colours)
-                plt.scatter(x=x_data, y=y_data, s=s, c=colour, label=subcategory, alpha=alpha, edgecolor='black',
-                            linewidth=1)
-                num_data_point = len(x_data)
-                if num_data_point > 1:
-                    if hyperbola:
-                        # We need to add a small value to all x data to avoid 1/0
-                        x_epsilon = 5
-                        x_data += x_epsilon
-                        one_over_x = 1 / x_data
-                        try:
-                            poly1d = np.poly1d(np.polyfit(one_over_x, raw_y_data, 1))
-                        except:
-                            x = 0
-                        poly_one_over_x = 1 / np.linspace(x_data_min + x_epsilon, x_data_max + x_epsilon, 300)
-                        poly_y = poly1d(poly_one_over_x)
-                        plt.plot(1 / poly_one_over_x - x_epsilon, poly_y, c=colour, linestyle='dashed')
-                    else:
-                        poly1d = np.poly1d(np.polyfit(x_data, raw_y_data, 1))
-                        poly_x = np.linspace(x_data_min, x_data_max, 300)
-                        poly_y = poly1d(poly_x)
-                        plt.plot(poly_x, poly_y, c=colour, linestyle='dashed')
-                subcategories_names.append(subcategory)
-                subcategories_indx.append(ind)
             if yaxis_is_frequency:
-                legend = plt.legend(fontsize=10)
-                for legend_handler in legend.legendHandles:
-                    legend_handler._sizes = [50]
-                plt.xlabel(self.full_labels.get(datapoint_column_name, datapoint_column_name))
-            else:
-                plt.yticks(subcategories_indx, labels=subcategories_names)
-                plt.ylim([subcategories_indx[0] - 1, subcategories_indx[-1] + 1])
-            if not yaxis_is_frequency:
-                y_label = 'Preposition'
+                xlabel = self.full_labels.get(datapoint_column_name, datapoint_column_name)
+                ylabel = self.full_labels.get(value_column_name, value_column_name)
             else:
-                y_label = self.full_labels.get(value_column_name, value_column_name)
-            plt.ylabel(y_label)
-
-            if show_plot_title:
-                plt.title(file_name.replace('_', ' '),
-                          fontdict={'family': 'serif',
-                                    'color': 'darkblue',
-                                    'weight': 'bold',
-                                    'size': 18})
-
-            plt.ylim((-5, y_data_max + 5))
-            if use_global_xticks:
-                new_xticks = global_xticks
-            else:
-                new_xticks = plt.xticks()[0]
+                xlabel = None
+                ylabel = 'Preposition'
 
-            plt.xticks(new_xticks)
+            options = self._options(file_name, datapoint_column_name, value_column_name, xlabel=xlabel, ylabel=ylabel,
+                                    same_size=same_size, hyperbola=hyperbola, yaxis_is_frequency=yaxis_is_frequency,
+                                    xticks=global_xticks if use_global_xticks else None)
+            retval.append(FigureSpec(file_name, draw_scatter, data, options))
 
         return retval
 
@@ -630,9 +573,7 @@ class Plotter:
         for sheet_name in xl.sheet_names:
             df = xl.parse(sheet_name, keep_default_na=False)
             df = df.fillna('')
-
-            for row_num, row in df.iterrows():
-                self.database.add_row(row, for_rels)
+            self.database.add_frame(df, for_rels)
 
     def get_database(self, files):
         for_rels = ['Buckingham Palace', 'Hyde Park', 'Trafalgar Square']
@@ -0,0 +1,120 @@
+"""
+A figure is described by a FigureSpec: its name (the file name without extension), a module-level function that draws
+it, and the data and options that function needs. Specs are cheap to build and to pickle, so they can be hashed to find
+out which figures changed, and rendered in worker processes. Rendering uses the object-oriented Agg API only, no pyplot
+state is shared between figures.
+"""
+
+import hashlib
+import json
+import os
+import pickle
+import types
+from collections import namedtuple
+from multiprocessing import Pool
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from progress.bar import Bar
+
+FigureSpec = namedtuple('FigureSpec', ['name', 'draw', 'data', 'options'])
+
+digests_file_name = 'figure-digests.json'
+
+
+def iter_code(code):
+    """
+    Yield a code object and those of the functions defined in it
+    """
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from iter_code(const)
+
+
+def draw_code(draw):
+    """
+    :return: the bytecode and constants of the draw function and of the functions of its module that it calls, directly
+             or not. Functions of other modules are not followed.
+    """
+    contents = []
+    seen = set()
+    functions = [draw]
+    while len(functions) > 0:
+        function = functions.pop()
+        if function in seen:
+            continue
+        seen.add(function)
+        for code in iter_code(function.__code__):
+            # Sets of constants (`x in {...}`) are sorted, their order changes from one run to the next
+            consts = tuple(sorted(x, key=repr) if isinstance(x, frozenset) else x
+                           for x in code.co_consts if not isinstance(x, types.CodeType))
+            contents.append((function.__qualname__, code.co_code, consts))
+            for name in code.co_names:
+                value = function.__globals__.get(name)
+                if isinstance(value, types.FunctionType) and value.__module__ == draw.__module__:
+                    functions.append(value)
+    return contents
+
+
+def spec_digest(spec):
+    """
+    :return: a hash of the data and options of the figure and of the code that draws it (see draw_code). A change in
+             a function of another module, e.g. matplotlib, is not seen; such figures must be rendered again by force.
+    """
+    content = pickle.dumps((spec.draw.__module__, spec.draw.__qualname__, draw_code(spec.draw), spec.data,
+                            spec.options), protocol=4)
+    return hashlib.sha1(content).hexdigest()
+
+
+def make_figure(spec):
+    """
+    Draw a spec on a new Figure attached to an Agg canvas
+    """
+    fig = Figure(figsize=spec.options.get('figsize', (10, 7)))
+    FigureCanvasAgg(fig)
+    spec.draw(fig, spec.data, spec.options)
+    return fig
+
+
+def render_to_file(args):
+    spec, file_path = args
+    fig = make_figure(spec)
+    fig.savefig(file_path)
+    return spec.name
+
+
+def render_figures(specs, img_dir, processes=None, skip_unchanged=True, file_format='png'):
+    """
+    Render the figures to `img_dir`/<name>.<file_format> in a process pool.
+    The digest of every rendered spec is kept in img_dir, so with skip_unchanged, a figure whose file exists and whose
+    spec has not changed since it was rendered is not drawn again.
+    """
+    digests_file = os.path.join(img_dir, digests_file_name)
+    digests = {}
+    if os.path.isfile(digests_file):
+        with open(digests_file, 'r') as f:
+            digests = json.load(f)
+
+    todo = []
+    new_digests = {}
+    for spec in specs:
+        file_path = os.path.join(img_dir, '{}.{}'.format(spec.name, file_format))
+        digest = spec_digest(spec)
+        new_digests[spec.name] = digest
+        if skip_unchanged and digests.get(spec.name, None) == digest and os.path.isfile(file_path):
+            continue
+        todo.append((spec, file_path))
+
+    print('Rendering {} figures, {} unchanged'.format(len(todo), len(specs) - len(todo)))
+    if len(todo) > 0:
+        bar = Bar('Rendering', max=len(todo))
+        try:
+            with Pool(processes) as pool:
+                for name in pool.imap_unordered(render_to_file, todo):
+                    digests[name] = new_digests[name]
+                    bar.next()
+        finally:
+            bar.finish()
+            with open(digests_file, 'w') as f:
+                json.dump(digests, f, indent=2, sort_keys=True)
@@ -10,6 +10,8 @@ from progress.bar import Bar
 from shapely.geometry import Point, Polygon
 from shapely.ops import nearest_points
 
+from osm_database.management.util.instrumentation import add_stats_argument, instrument, stage
+
 pattern = re.compile(r'([\d\-.]+ [\d\-.]+)', re.I | re.U)
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -105,6 +107,7 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--file', action='store', dest='file', required=True, type=str)
+        add_stats_argument(parser)
 
     def populate_objects_from_excel(self, file):
         xl = pd.ExcelFile(file)
@@ -213,19 +216,32 @@ class Command(BaseCommand):
 
     def handle(self, *args, **options):
         file = options['file']
-        self.populate_objects_from_excel(file)
-
-        self.calculate_loc_boundary_to_ref_boundary()
-        self.calculate_loc_centroid_to_ref_boundary()
-        self.calculate_loc_centroid_to_ref_centroid()
-
-        file_name = os.path.splitext(os.path.split(file)[1])[0]
-        xlsx_dir = os.path.join(cache_dir, 'xlsx')
-        pathlib.Path(xlsx_dir).mkdir(parents=True, exist_ok=True)
-        export_file_name = '{}-calculated.xlsx'.format(file_name)
-        export_file_path = os.path.join(xlsx_dir, export_file_name)
 
-        self.export_excel(export_file_path)
+        with instrument('calculate_nearest_points', options['stats_file']):
+            with stage('read excel') as s:
+                self.populate_objects_from_excel(file)
+                num_rows = sum(len(excel_rows) for excel_rows in self.sheets.values())
+                s.add(num_rows)
+
+            with stage('boundary to boundary') as s:
+                self.calculate_loc_boundary_to_ref_boundary()
+                s.add(num_rows)
+            with stage('centroid to boundary') as s:
+                self.calculate_loc_centroid_to_ref_boundary()
+                s.add(num_rows)
+            with stage('centroid to centroid') as s:
+                self.calculate_loc_centroid_to_ref_centroid()
+                s.add(num_rows)
+
+            file_name = os.path.splitext(os.path.split(file)[1])[0]
+            xlsx_dir = os.path.join(cache_dir, 'xlsx')
+            pathlib.Path(xlsx_dir).mkdir(parents=True, exist_ok=True)
+            export_file_name = '{}-calculated.xlsx'.format(file_name)
+            export_file_path = os.path.join(xlsx_dir, export_file_name)
+
+            with stage('export excel') as s:
+                self.export_excel(export_file_path)
+                s.add(num_rows)
 
         # print(self.sheets)
 
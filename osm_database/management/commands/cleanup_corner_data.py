@@ -17,6 +17,7 @@ from min_bounding_rect import *
 from osm_database.management.commands.calculate_nearest_points import fix_wkt_str_if_necessary
 from osm_database.management.commands.util import extract_points_for_polygons, extract_points_for_multipolygons, \
     extract_points_for_point, extract_points_for_multilinestrings, extract_points_for_linestrings
+from osm_database.management.util.instrumentation import add_stats_argument, current_stage, instrument, stage
 from osm_database.models import OsmEntity
 from qhull_2d import *
 
@@ -132,6 +133,9 @@ class Command(BaseCommand):
         self.input_csv = None
         self.caches = {}
 
+    def add_arguments(self, parser):
+        add_stats_argument(parser)
+
     def set_input(self, filepath):
         self.input_csv = filepath
         file_name = os.path.splitext(os.path.split(filepath)[1])[0]
@@ -144,6 +148,7 @@ class Command(BaseCommand):
 
         self.caches['fixed_csv'] = os.path.join(self.cache_dir, file_name + '_fixed.csv')
 
+    @stage('get_name_map')
     def get_name_map(self):
         print('========get_name_map() started ===========')
         cache_file_name = self.caches['names_lookup']
@@ -206,6 +211,7 @@ class Command(BaseCommand):
         print('========get_name_map() finished ===========')
         print('Save cache to ' + cache_file_name)
 
+    @stage('get_excel_rows_info')
     def get_excel_rows_info(self):
         print('========get_excel_rows_info() started ===========')
         cache_file_name = self.caches['excel_rows_info']
@@ -241,6 +247,7 @@ class Command(BaseCommand):
             candidate_osm_ids += this_candidate_osm_ids
             excel_row.this_candidate_osm_ids = this_candidate_osm_ids
             bar.next()
+            current_stage().add()
         bar.finish()
 
         info['excel_row_infos'] = excel_row_infos
@@ -255,6 +262,7 @@ class Command(BaseCommand):
         print('========get_excel_rows_info() finished ===========')
         print('Save cache to ' + cache_file_name)
 
+    @stage('get_geoinfo_for_points')
     def get_geoinfo_for_points(self):
         print('========get_geoinfo_for_points() started ===========')
         cache_file_name = self.caches['geoinfo_points']
@@ -284,6 +292,7 @@ class Command(BaseCommand):
         print('========get_geoinfo_for_points() finished ===========')
         print('Save cache to ' + cache_file_name)
 
+    @stage('get_geoinfo_for_lines')
     def get_geoinfo_for_lines(self):
         print('========get_geoinfo_for_lines() started ===========')
         cache_file_name = self.caches['geoinfo_lines']
@@ -313,6 +322,7 @@ class Command(BaseCommand):
         print('========get_geoinfo_for_lines() finished ===========')
         print('Save cache to ' + cache_file_name)
 
+    @stage('get_geoinfo_for_polygons')
     def get_geoinfo_for_polygons(self):
         print('========get_geoinfo_for_polygons() started ===========')
         cache_file_name = self.caches['geoinfo_polygons']
@@ -342,6 +352,7 @@ class Command(BaseCommand):
         print('========get_geoinfo_for_polygons() finished ===========')
         print('Save cache to ' + cache_file_name)
 
+    @stage('get_geoinfo_for_multilines')
     def get_geoinfo_for_multilines(self):
         print('========get_geoinfo_for_multilines() started ===========')
         cache_file_name = self.caches['geoinfo_multilines']
@@ -371,6 +382,7 @@ class Command(BaseCommand):
         print('========get_geoinfo_for_multilines() finished ===========')
         print('Save cache to ' + cache_file_name)
 
+    @stage('get_geoinfo_for_geopoints')
     def get_geoinfo_for_geopoints(self):
         print('========get_geoinfo_for_geopoints() started ===========')
         cache_file_name = self.caches['geoinfo_geopoints']
@@ -400,6 +412,7 @@ class Command(BaseCommand):
         print('========get_geoinfo_for_geopoints() finished ===========')
         print('Save cache to ' + cache_file_name)
 
+    @stage('get_geoinfo_for_multipolys')
     def get_geoinfo_for_multipolys(self):
         print('========get_geoinfo_for_multipolys() started ===========')
         cache_file_name = self.caches['geoinfo_multipolys']
@@ -429,6 +442,7 @@ class Command(BaseCommand):
         print('========get_geoinfo_for_multipolys() finished ===========')
         print('Save cache to ' + cache_file_name)
         
+    @stage('find_best_candidates_by_db')
     def find_best_candidates_by_db(self, type_sensitive=True, diff_thresh=3.0, replace_thresh=1000):
         print('========find_best_candidates_by_db() started ===========')
         cache_file_name = self.caches['best_candidates']
@@ -505,6 +519,7 @@ class Command(BaseCommand):
                 excel_row.reason = 'By DB'
 
             bar.next()
+            current_stage().add()
         bar.finish()
 
         with open(cache_file_name, 'wb') as f:
@@ -513,6 +528,7 @@ class Command(BaseCommand):
         print('========find_best_candidates_by_db() finished ===========')
         print('Save cache to ' + cache_file_name)
         
+    @stage('export_candidate_search_results')
     def export_candidate_search_results(self, cache_name):
         print('========export_candidate_search_results() started ===========')
         cache_file_name = self.caches[cache_name]
@@ -544,10 +560,12 @@ class Command(BaseCommand):
 
             index += 1
             bar.next()
+            current_stage().add()
         bar.finish()
 
         output_df.to_csv(fixed_csv_file_name, index=False)
 
+    @stage('find_best_candidates_by_nominatim')
     def find_best_candidates_by_nominatim(self, type_sensitive=True, diff_thresh=3.0, replace_thresh=1000):
         print('========find_best_candidates_by_nominatim() started ===========')
         best_candidates_cache_file_name = self.caches['best_candidates']
@@ -672,6 +690,7 @@ class Command(BaseCommand):
                 excel_row.is_replaced = replace_existing
                 excel_row.reason = 'By GeoPy'
             bar.next()
+            current_stage().add()
         bar.finish()
 
         with open(best_candidates_corrected_with_nominatim_cache_file_name, 'wb') as f:
@@ -680,6 +699,7 @@ class Command(BaseCommand):
         print('========find_best_candidates_by_nominatim() finished ===========')
         print('Save cache to ' + best_candidates_corrected_with_nominatim_cache_file_name)
 
+    @stage('populate_geotype')
     def populate_geotype(self):
         print('========populate_geotype() started ===========')
         best_candidates_cache_file_name = self.caches['best_candidates_corrected_with_nominatim']
@@ -823,6 +843,7 @@ class Command(BaseCommand):
         print('========populate_geotype() finished ===========')
         print('Save cache to ' + populate_geotype_cache_file_name)
 
+    @stage('export_based_on')
     def export_based_on(self, source, base_df, modifications_map, new_file_name):
         print('========export_based_on() started ===========')
         cache_file_name = self.caches[source]
@@ -861,10 +882,12 @@ class Command(BaseCommand):
                 output_df.loc[output_ind, old_col_name] = new_val
             output_ind += 1
             bar.next()
+            current_stage().add()
         bar.finish()
 
         output_df.to_csv(new_file_name, index=False)
 
+    @stage('calculate_c2b_for_polygon')
     def calculate_c2b_for_polygon(self, source):
         print('========calculate_c2b_for_polygon() started ===========')
         polygon_only_cache_file_name = self.caches['polygon-only']
@@ -962,6 +985,7 @@ class Command(BaseCommand):
         print('========calculate_c2b_for_polygon() finished ===========')
         print('Save cache to ' + polygon_only_cache_file_name)
 
+    @stage('export_by_type')
     def export_by_type(self, base_df, modifications_map, new_file_name):
         cache_file_name = self.caches['polygon-only']
         if not os.path.isfile(cache_file_name):
@@ -998,6 +1022,7 @@ class Command(BaseCommand):
                 output_df.loc[output_ind, old_col_name] = new_val
             output_ind += 1
             bar.next()
+            current_stage().add()
         bar.finish()
 
         output_df.to_csv(new_file_name, index=False)
@@ -1012,48 +1037,49 @@ class Command(BaseCommand):
         # return
 
 
-        self.set_input('files/csv/typesConnerData.csv')
-        # self.get_name_map()
-        # self.get_excel_rows_info()
-        # self.get_geoinfo_for_polygons()
-
-        # self.get_geoinfo_for_points()
-        # self.get_geoinfo_for_lines()
-        # self.get_geoinfo_for_multilines()
-        # self.get_geoinfo_for_geopoints()
-        # self.get_geoinfo_for_multipolys()
-        # self.find_best_candidates_by_db(type_sensitive=True)
-        # self.export_candidate_search_results('best_candidates')
-        # self.find_best_candidates_by_nominatim(type_sensitive=True, diff_thresh=3.0, replace_thresh=None)
-        # self.export_candidate_search_results('best_candidates_corrected_with_nominatim')
-        # self.populate_geotype()
-        self.export_candidate_search_results('populate_geotype')
-        # base_df = pd.read_excel('files/xlsx/conners_whole_data_reg_features_with_attributes.xlsx', sheet_name="All")
-        #
-        # modifications_map = {
-        #     'RelatumLat': 'get_final_rlat',
-        #     'RelLon': 'get_final_rlon',
-        #     'Distmodified': 'get_final_distance',
-        # }
-        #
-        # new_file_name = os.path.join(cache_dir, 'conners_whole_data_reg_features_with_attributes_fixed.csv')
-        #
-        # self.export_based_on('populate_geotype', base_df, modifications_map, new_file_name)
-
-        # self.calculate_c2b_for_polygon('populate_geotype')
-        # self.export_candidate_search_results('polygon-only-excel-rows-info')
-        #
-        # base_df = pd.read_excel('files/xlsx/conners_whole_data_reg_features_with_attributes.xlsx', sheet_name="polygons")
-        # new_file_name = os.path.join(cache_dir, 'conners_whole_data_reg_features_with_attributes_polygon_only_fixed.csv')
-        #
-        # modifications_map = {
-        #     'NearestRelLat': 'nearest_rel_lat',
-        #     'NearestRelLon': 'nearest_rel_lon',
-        #     'MBB_Area': 'area',
-        #     'MBB_Elong': 'elong',
-        #     'DistanceNearest(m)': 'distance_c2b',
-        #     'Dist centroid': 'get_final_distance',
-        # }
-        #
-        # self.export_based_on('polygon-only-excel-rows-info', base_df, modifications_map, new_file_name)
+        with instrument('cleanup_corner_data', options['stats_file']):
+            self.set_input('files/csv/typesConnerData.csv')
+            # self.get_name_map()
+            # self.get_excel_rows_info()
+            # self.get_geoinfo_for_polygons()
+
+            # self.get_geoinfo_for_points()
+            # self.get_geoinfo_for_lines()
+            # self.get_geoinfo_for_multilines()
+            # self.get_geoinfo_for_geopoints()
+            # self.get_geoinfo_for_multipolys()
+            # self.find_best_candidates_by_db(type_sensitive=True)
+            # self.export_candidate_search_results('best_candidates')
+            # self.find_best_candidates_by_nominatim(type_sensitive=True, diff_thresh=3.0, replace_thresh=None)
+            # self.export_candidate_search_results('best_candidates_corrected_with_nominatim')
+            # self.populate_geotype()
+            self.export_candidate_search_results('populate_geotype')
+            # base_df = pd.read_excel('files/xlsx/conners_whole_data_reg_features_with_attributes.xlsx', sheet_name="All")
+            #
+            # modifications_map = {
+            #     'RelatumLat': 'get_final_rlat',
+            #     'RelLon': 'get_final_rlon',
+            #     'Distmodified': 'get_final_distance',
+            # }
+            #
+            # new_file_name = os.path.join(cache_dir, 'conners_whole_data_reg_features_with_attributes_fixed.csv')
+            #
+            # self.export_based_on('populate_geotype', base_df, modifications_map, new_file_name)
+
+            # self.calculate_c2b_for_polygon('populate_geotype')
+            # self.export_candidate_search_results('polygon-only-excel-rows-info')
+            #
+            # base_df = pd.read_excel('files/xlsx/conners_whole_data_reg_features_with_attributes.xlsx', sheet_name="polygons")
+            # new_file_name = os.path.join(cache_dir, 'conners_whole_data_reg_features_with_attributes_polygon_only_fixed.csv')
+            #
+            # modifications_map = {
+            #     'NearestRelLat': 'nearest_rel_lat',
+            #     'NearestRelLon': 'nearest_rel_lon',
+            #     'MBB_Area': 'area',
+            #     'MBB_Elong': 'elong',
+            #     'DistanceNearest(m)': 'distance_c2b',
+            #     'Dist centroid': 'get_final_distance',
+            # }
+            #
+            # self.export_based_on('polygon-only-excel-rows-info', base_df, modifications_map, new_file_name)
 
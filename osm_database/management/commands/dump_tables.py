@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from osm_database.management.util.table_transfer import dump_tables
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('labels', nargs='*', default=['osm_database'],
+                            help='app labels or app_label.ModelName to dump, default to osm_database')
+        parser.add_argument('--dir', action='store', dest='dir', required=True, type=str)
+        parser.add_argument('--chunk-rows', action='store', dest='chunk_rows', default=100000, type=int,
+                            help='Number of rows per chunk file')
+        parser.add_argument('--compress-level', action='store', dest='compress_level', default=6, type=int,
+                            help='gzip compression level of the chunk files, 0-9')
+
+    def handle(self, *args, **options):
+        tables = dump_tables(options['labels'], options['dir'], options['chunk_rows'], options['compress_level'])
+        for entry in tables:
+            print('{}: {} rows in {} chunks'.format(entry['table'], entry['rows'], len(entry['chunks'])))
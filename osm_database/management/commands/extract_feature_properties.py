@@ -1,16 +1,11 @@
 import os
-import pickle
 import re
 from collections import OrderedDict
-from itertools import product
 
 import pandas as pd
 import warnings
 import numpy as np
 
-from nltk.corpus import wordnet
-from openpyxl import load_workbook
-from progress.bar import Bar
 from urllib3.exceptions import InsecureRequestWarning
 import xlrd
 xlrd.xlsx.ensure_elementtree_imported(False, None)
@@ -20,116 +15,43 @@ warnings.filterwarnings("ignore", category=InsecureRequestWarning)
 
 from django.core.management import BaseCommand
 
-cache = {}
-
-
-def calc_distance(exp1, exp2):
-    """
-    Read wordnet to calculate the distance between two expressions
-    :param exp1:
-    :param exp2:
-    :return:
-    """
-
-    if not isinstance(exp1, str) or not isinstance(exp2, str):
-        raise Exception('"{}" or "{}" is not string'.format(exp1, exp2))
-
-    max_sim = None
-
-    if exp1 in cache:
-        syns1 = cache[exp1]
-    else:
-        syns1 = wordnet.synsets(exp1)
-        cache[exp1] = syns1
-
-    if exp2 in cache:
-        syns2 = cache[exp2]
-    else:
-        syns2 = wordnet.synsets(exp2)
-        cache[exp2] = syns2
-
-    for sense1, sense2 in product(syns1, syns2):
-        d = wordnet.wup_similarity(sense1, sense2)
-        if d is not None:
-            if max_sim is None:
-                max_sim = d
-            else:
-                max_sim = max(max_sim, d)
-
-    return max_sim
-
+from osm_database.management.commands.import_owl import compiled_ontology_file
+from osm_database.management.util.excel_export import write_excel
+from osm_database.management.util.instrumentation import add_stats_argument, instrument, stage
+from osm_database.management.util.ontology import load_ontology
+from osm_database.management.util.wordnet_similarity import SimilarityMatrix
 
 max_sim_indices = 3
 
+multually_exclusive_feature_names = [
+    ['PointFeature', 'PolygonFeature', 'LineFeature', 'VolumeFeature'],
+    ['ImmediateScaleFeature', 'DistrictScaleFeature', 'NeighbourhoodScaleFeature', 'CountryScaleFeature',
+     'ContinentScaleFeature'],
+    ['SolidFeature', 'LiquidFeature'],
+]
 
-def find_best_match(locatum_name, name_feature_dict):
-    feature_names = list(name_feature_dict.keys())
-    feature_sims = OrderedDict()
-    for feature_name in feature_names:
-        max_sim = calc_distance(locatum_name, feature_name)
-        if max_sim is not None:
-            feature_sims[feature_name] = max_sim
 
-    sims = np.array(list(feature_sims.values()))
-    if len(sims) == 0:
+def find_best_match(locatum_name, similarity_matrix, features):
+    """
+    :param similarity_matrix: a SimilarityMatrix that contains locatum_name, whose columns are the features
+    :return: (names of up to max_sim_indices best matching features, their scores), or (None, None) if nothing matches
+    """
+    best_match_indices, scores = similarity_matrix.top_k(locatum_name, max_sim_indices)
+    if len(best_match_indices) == 0:
         return None, None
-
-    sorted_sims = np.argsort(sims)
-    sorted_sims = sorted_sims[::-1]
-    best_match_indices = sorted_sims[0:max_sim_indices]
-
-    array_of_matches = np.array(list(feature_sims.items()))[best_match_indices]
-    retval_features = []
-    retval_scores = []
-    for feature_name, match_score in array_of_matches:
-        retval_features.append(name_feature_dict[feature_name])
-        retval_scores.append(match_score)
-    return retval_features, retval_scores
-
-
-def prune_multualy_exclusive(core_features, multually_exclusive_feature_groups):
-    for group in multually_exclusive_feature_groups:
-        rank_to_features = {}
-        lowest_rank = 9999
-        for feature in group:
-            _, rank = core_features.get(feature.name, (None, None))
-            if rank is not None:
-                if rank not in rank_to_features:
-                    features = []
-                    rank_to_features[rank] = features
-                else:
-                    features = rank_to_features[rank]
-                features.append(feature)
-                lowest_rank = min(lowest_rank, rank)
-        for rank, features in rank_to_features.items():
-            if rank > lowest_rank:
-                for feature in features:
-                    del core_features[feature.name]
-
-
-def recursive_add_parents(core_features, root_feature, thing, rank):
-    if root_feature is None:
-        return
-
-    if len(root_feature.parent) == 1 and thing in root_feature.parent:
-        return
-
-    for parent in root_feature.parent:
-        if parent == root_feature:
-            continue
-        core_features[parent.name] = (parent, rank)
-        recursive_add_parents(core_features, parent, thing, rank+1)
+    return [features[i] for i in best_match_indices], scores.tolist()
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--file', action='store', dest='file', required=True, type=str)
         parser.add_argument('--sheet-name', action='store', dest='sheet_name', default='Sheet1', type=str)
+        parser.add_argument('--processes', action='store', dest='processes', default=None, type=int,
+                            help='Number of processes comparing new types to the features, default to the number of CPUs')
+        add_stats_argument(parser)
 
     def handle(self, *args, **options):
-        feature_dict_file = 'feature_dict.pkl'
-        if not os.path.isfile(feature_dict_file):
-            raise Exception('Dictionary not found')
+        similarity_file = 'wordnet_similarity.npz'
 
         file = options['file']
         sheet_name = options['sheet_name']
@@ -139,149 +61,89 @@ class Command(BaseCommand):
         file_name = os.path.splitext(os.path.split(file)[1])[0]
         print('File name = {}'.format(file_name))
 
-        with open(feature_dict_file, 'rb') as f:
-            feature_dict = pickle.load(f)
+        with instrument('extract_feature_properties', options['stats_file']):
+            self.extract(file, file_name, sheet_name, similarity_file, options['processes'])
 
-        multually_exclusive_feature_groups = [
-            [
-                feature_dict['name']['PointFeature'],
-                feature_dict['name']['PolygonFeature'],
-                feature_dict['name']['LineFeature'],
-                feature_dict['name']['VolumeFeature']
-            ],
-            [
-                feature_dict['name']['ImmediateScaleFeature'],
-                feature_dict['name']['DistrictScaleFeature'],
-                feature_dict['name']['NeighbourhoodScaleFeature'],
-                feature_dict['name']['CountryScaleFeature'],
-                feature_dict['name']['ContinentScaleFeature'],
-            ],
-            [
-                feature_dict['name']['SolidFeature'],
-                feature_dict['name']['LiquidFeature'],
+    def extract(self, file, file_name, sheet_name, similarity_file, processes):
+        with stage('load ontology') as s:
+            ontology = load_ontology(compiled_ontology_file)
+            multually_exclusive_feature_groups = [
+                [ontology.ids[name] for name in group] for group in multually_exclusive_feature_names
             ]
-        ]
 
-        # garden_feature = feature_dict['name']['Gardens']
-        thing = feature_dict['name']['Thing']
-        # core_features = {}
-        # recursive_add_parents(core_features, garden_feature, thing, 1)
+            wordnet_feature_dict = {}
 
-        # prune_multualy_exclusive(core_features, multually_exclusive_feature_groups)
+            for feature_name in ontology.names:
+                name = feature_name
 
-        # new_feature_dict = {}
-        wordnet_feature_dict = {}
+                if name.endswith('Feature'):
+                    name = feature_name[:-7]
 
-        for feature in feature_dict['name'].values():
-            name = feature.name
+                name_spaced = re.sub("([a-z])([A-Z])", "\g<1> \g<2>", name)
+                wordnet_feature_dict[name_spaced.lower()] = feature_name
+            s.add(len(ontology.names))
 
-            if name.endswith('Feature'):
-                name = feature.name[:-7]
+        with stage('read excel') as s:
+            df = pd.read_excel(file, sheet_name=sheet_name, keep_default_na=False)
 
-            # new_feature_dict[name.lower()] = feature
-            name_spaced = re.sub("([a-z])([A-Z])", "\g<1> \g<2>", name)
-            wordnet_feature_dict[name_spaced.lower()] = feature
+            relatum_types = df['TYPE'].tolist()
+            unique_types = list(OrderedDict.fromkeys(x for x in relatum_types if x != ''))
+            s.add(df.shape[0])
 
-        df = pd.read_excel(file, sheet_name=sheet_name, keep_default_na=False)
+        with stage('match types to features') as s:
+            similarity_matrix = SimilarityMatrix(similarity_file, wordnet_feature_dict.keys(), processes)
+            similarity_matrix.add_types(unique_types)
+            wordnet_features = list(wordnet_feature_dict.values())
+            extracted = {x: find_best_match(x, similarity_matrix, wordnet_features) for x in unique_types}
+            s.add(len(unique_types))
 
-        core_features_all = {}
-        core_features_to_column = {}
+        with stage('expand ancestors') as s:
+            # Every distinct type is expanded once: the ancestors of its matched features, then the pruning, are bitwise
+            # operations over the rows of the compiled ontology
+            type_to_row = {relatum_type: i for i, relatum_type in enumerate(unique_types)}
 
-        extracted_cache = 'extracted.pkl'
-        if os.path.isfile(extracted_cache):
-            with open(extracted_cache, 'rb') as f:
-                extracted = pickle.load(f)
-        else:
-            extracted = {}
-
-        bar = Bar('Reading excel file...', max=df.shape[0])
-        try:
-            for index, row in df.iterrows():
-                relatum_type = row['TYPE']
-                if relatum_type == '':
-                    features, sims = None, None
-                elif relatum_type in extracted:
-                    features, sims = extracted[relatum_type]
-                else:
-                    features, sims = find_best_match(relatum_type, wordnet_feature_dict)
-                    extracted[relatum_type] = features, sims
+            matched_ids = np.full((len(unique_types), max_sim_indices), -1, dtype=np.int64)
+            for i, relatum_type in enumerate(unique_types):
+                features, _ = extracted[relatum_type]
                 if features is not None:
-                    for feature in features:
-                        recursive_add_parents(core_features_all, feature, thing, 1)
-
-                if index % 10 == 0:
-                    with open(extracted_cache, 'wb') as f:
-                        pickle.dump(extracted, f)
-
-                bar.next()
-            bar.finish()
-        except Exception as e:
-            raise e
-        finally:
-            with open(extracted_cache, 'wb') as f:
-                pickle.dump(extracted, f)
-
-        columns = ['0name', '1osm feature 1', '2match score 1', '3osm feature 2', '4match score 2', '5osm feature 3', '6match score 3']
-        column_index = len(columns)
-        for parent_feature_name, (parent_feature, rank) in core_features_all.items():
-            columns.append(parent_feature_name)
-            core_features_to_column[parent_feature_name] = column_index
-            column_index += 1
-
-        feature_type_df = pd.DataFrame(columns=columns)
-
-        bar = Bar('Extracting features', max=df.shape[0])
-        for index, row in df.iterrows():
-            relatum_type = row['TYPE']
-            if relatum_type == '':
-                features, scores = None, None
-            else:
-                features, scores = extracted[relatum_type]
-            row = [relatum_type, '', 0, '', 0, '', 0] + [0] * len(core_features_all)
-            if features is None:
-                row[1] = 'NotFound'
-                row[2] = 0
-                row[3] = 'NotFound'
-                row[4] = 0
-                row[5] = 'NotFound'
-                row[6] = 0
-            else:
-                row[1] = features[0].name
-                row[2] = scores[0]
-                row[3] = features[1].name
-                row[4] = scores[1]
-                row[5] = features[2].name
-                row[6] = scores[2]
-
-            if features is not None:
-                core_features = {}
-                for feature in features:
-                    recursive_add_parents(core_features, feature, thing, 1)
-                prune_multualy_exclusive(core_features, multually_exclusive_feature_groups)
-                for core_feature in core_features:
-                    index_of_core_feature = core_features_to_column.get(core_feature, -1)
-                    if index_of_core_feature == -1:
-                        continue
-                    row[index_of_core_feature] = 1
-
-            feature_type_df.loc[index] = row
-            bar.next()
-        bar.finish()
-
-        filename = 'files/xlsx/{}_{}_with_all_level_parents.xlsx'.format(file_name, sheet_name)
-        sorted_column_df = feature_type_df.sort_index(axis=1)
-
-        sorted_column_df.to_excel(filename, index=None)
-        book = load_workbook(filename)
-        ws = book.active
-        dims = {}
-        for row in ws.rows:
-            for cell in row:
-                if cell.value:
-                    dims[cell.column_letter] = max((dims.get(cell.column_letter, 0), len(str(cell.value))))
-        for col, value in dims.items():
-            ws.column_dimensions[col].width = value
-
-        book.save(filename)
-
-
+                    for j, feature in enumerate(features):
+                        matched_ids[i, j] = ontology.ids[feature]
+
+            ancestor_ranks = ontology.ancestor_ranks(matched_ids)
+            core_feature_ids = np.flatnonzero(ancestor_ranks.any(axis=0))
+            ontology.prune_mutually_exclusive(ancestor_ranks, multually_exclusive_feature_groups)
+            core_feature_flags = (ancestor_ranks[:, core_feature_ids] > 0).astype(np.int64)
+
+            no_type_row = len(unique_types)
+            core_feature_flags = np.vstack((core_feature_flags, np.zeros((1, len(core_feature_ids)), dtype=np.int64)))
+            row_indices = np.array([type_to_row.get(x, no_type_row) for x in relatum_types], dtype=np.int64)
+            s.add(len(unique_types))
+
+        with stage('build rows') as s:
+            columns = ['0name', '1osm feature 1', '2match score 1', '3osm feature 2', '4match score 2', '5osm feature 3', '6match score 3']
+            match_rows = []
+            for relatum_type in relatum_types:
+                features, scores = extracted[relatum_type] if relatum_type != '' else (None, None)
+                if features is None:
+                    match_rows.append([relatum_type, 'NotFound', 0, 'NotFound', 0, 'NotFound', 0])
+                else:
+                    match_row = [relatum_type]
+                    for i in range(max_sim_indices):
+                        if i < len(features):
+                            match_row += [features[i], scores[i]]
+                        else:
+                            match_row += ['NotFound', 0]
+                    match_rows.append(match_row)
+
+            feature_type_df = pd.DataFrame(match_rows, columns=columns, index=df.index)
+            core_feature_df = pd.DataFrame(core_feature_flags[row_indices], index=df.index,
+                                           columns=[ontology.names[i] for i in core_feature_ids])
+            feature_type_df = pd.concat([feature_type_df, core_feature_df], axis=1)
+            s.add(len(relatum_types))
+
+        with stage('write excel') as s:
+            filename = 'files/xlsx/{}_{}_with_all_level_parents.xlsx'.format(file_name, sheet_name)
+            sorted_column_df = feature_type_df.sort_index(axis=1)
+
+            write_excel(filename, {'Sheet1': sorted_column_df}, index=False)
+            s.add(sorted_column_df.shape[0])
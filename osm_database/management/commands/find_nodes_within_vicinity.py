@@ -2,9 +2,10 @@ import os
 from decimal import Decimal
 
 from geopy.distance import geodesic
-from openpyxl import load_workbook
 
 from osm_database.management.commands.util import *
+from osm_database.management.util.excel_export import write_excel
+from osm_database.management.util.instrumentation import add_stats_argument, instrument, stage
 from osm_database.models import OsmEntity, Polygon
 
 warnings.filterwarnings("ignore", category=InsecureRequestWarning)
@@ -277,6 +278,7 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--file', action='store', dest='file', required=True, type=str)
         parser.add_argument('--vicinity', action='store', dest='vicinity', required=True, type=int)
+        add_stats_argument(parser)
 
     def handle(self, *args, **options):
 
@@ -286,48 +288,59 @@ class Command(BaseCommand):
         if not os.path.isfile(centre_csv_file):
             raise Exception('File {} does not exist'.format(centre_csv_file))
 
+        with instrument('find_nodes_within_vicinity', options['stats_file']):
+            self.find_nodes(centre_csv_file, vicinity)
+
+    def find_nodes(self, centre_csv_file, vicinity):
         centre_file_name = os.path.splitext(os.path.split(centre_csv_file)[1])[0]
-        df = pd.read_csv(centre_csv_file)
 
-        centres = []
+        with stage('read centres') as s:
+            df = pd.read_csv(centre_csv_file)
+
+            centres = []
 
-        for index, row in df.iterrows():
-            name = row['Place']
-            id = row['Id']
-            centroid = row['Centroids']
-            lat, lon = list(map(Decimal, centroid.split(',')))
+            for index, row in df.iterrows():
+                name = row['Place']
+                id = row['Id']
+                centroid = row['Centroids']
+                lat, lon = list(map(Decimal, centroid.split(',')))
 
-            centres.append((name, id, lat, lon))
+                centres.append((name, id, lat, lon))
+            s.add(len(centres))
 
         dfs_by_type = {}
 
         for centre_name, id, lat, lon in centres:
-            min_lat, max_lat, min_lon, max_lon = find_max_deviation(float(lat), float(lon), vicinity)
-
-            print('Boundary within {} metres of {} is lat=[{} - {}], lon=[{} - {}]'
-                  .format(vicinity, centre_name, min_lat, max_lat, min_lon, max_lon))
-
-            if min_lon < max_lon:
-                possible_nearby_osm_entities = OsmEntity.objects.filter(lat__gte=min_lat, lat__lte=max_lat,
-                                                                        lon__gte=min_lon, lon__lte=max_lon)
-            else:
-                possible_nearby_osm_entities = OsmEntity.objects.filter(lat__gte=min_lat, lat__lte=max_lat,
-                                                                        lon__gte=max_lon, lon__lte=min_lon)
-
-            osm_entities_info = possible_nearby_osm_entities.values_list('osm_id', 'lat', 'lon')
-            nearby_entity_ids = []
-            nearby_entity_distances = {}
-            for osm_id, node_lat, node_lon in osm_entities_info:
-                distance = geodesic((float(lat), float(lon)), (float(node_lat), float(node_lon))).meters
-                if distance <= vicinity:
-                    nearby_entity_ids.append(osm_id)
-                    nearby_entity_distances[osm_id] = distance
-
-            nearby_entities = OsmEntity.objects.filter(osm_id__in=nearby_entity_ids)
-            print('Found {} nearby nodes'.format(len(nearby_entities)))
+            with stage('find entities within vicinity') as s:
+                min_lat, max_lat, min_lon, max_lon = find_max_deviation(float(lat), float(lon), vicinity)
+
+                print('Boundary within {} metres of {} is lat=[{} - {}], lon=[{} - {}]'
+                      .format(vicinity, centre_name, min_lat, max_lat, min_lon, max_lon))
+
+                if min_lon < max_lon:
+                    possible_nearby_osm_entities = OsmEntity.objects.filter(lat__gte=min_lat, lat__lte=max_lat,
+                                                                            lon__gte=min_lon, lon__lte=max_lon)
+                else:
+                    possible_nearby_osm_entities = OsmEntity.objects.filter(lat__gte=min_lat, lat__lte=max_lat,
+                                                                            lon__gte=max_lon, lon__lte=min_lon)
+
+                osm_entities_info = possible_nearby_osm_entities.values_list('osm_id', 'lat', 'lon')
+                nearby_entity_ids = []
+                nearby_entity_distances = {}
+                for osm_id, node_lat, node_lon in osm_entities_info:
+                    distance = geodesic((float(lat), float(lon)), (float(node_lat), float(node_lon))).meters
+                    s.add()
+                    if distance <= vicinity:
+                        nearby_entity_ids.append(osm_id)
+                        nearby_entity_distances[osm_id] = distance
+
+                nearby_entities = OsmEntity.objects.filter(osm_id__in=nearby_entity_ids)
+                print('Found {} nearby nodes'.format(len(nearby_entities)))
 
             for geojson_type, export_func in extract_funcs.items():
-                df = export_func(nearby_entities, nearby_entity_distances)
+                with stage('extract {} info'.format(geojson_type)) as s:
+                    df = export_func(nearby_entities, nearby_entity_distances)
+                    s.add(df.shape[0])
                 if geojson_type not in dfs_by_type:
                     dfs = {}
                     dfs_by_type[geojson_type] = dfs
@@ -337,25 +350,8 @@ class Command(BaseCommand):
                 dfs[centre_name] = df
 
         for geojson_type, dfs in dfs_by_type.items():
-            export_file_path = 'files/xlsx/{}-nearby-{}.xlsx'.format(centre_file_name, geojson_type)
-            writer = pd.ExcelWriter(export_file_path, engine='xlsxwriter')
-
-            for centre_name, df in dfs.items():
-                df.to_excel(writer, sheet_name=centre_name)
-
+            with stage('export excel') as s:
+                export_file_path = 'files/xlsx/{}-nearby-{}.xlsx'.format(centre_file_name, geojson_type)
+                write_excel(export_file_path, dfs)
+                s.add(sum(df.shape[0] for df in dfs.values()))
             print('Exported to ' + export_file_path)
-            writer.save()
-
-            print('Adjust workbook column widths file {}'.format(export_file_path))
-            book = load_workbook(export_file_path)
-            for ws in book.worksheets:
-                dims = {}
-                for row in ws.rows:
-                    for cell in row:
-                        if cell.value:
-                            dims[cell.column_letter] = max((dims.get(cell.column_letter, 0), len(str(cell.value))))
-                for col, value in dims.items():
-                    ws.column_dimensions[col].width = value
-
-            book.save(export_file_path)
-
@@ -2,13 +2,15 @@ import os
 import pathlib
 import re
 
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import shapely.wkt
 from django.core.management import BaseCommand
 from shapely.geometry import Point
 
+from osm_database.jupyter_django_commons.distance_dataset import DistanceDataset
+from osm_database.jupyter_django_commons.figure_rendering import FigureSpec, render_figures
+
 pattern = re.compile(r'([\d\-.]+ [\d\-.]+)', re.I | re.U)
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -17,60 +19,54 @@ dir_parts = current_dir.split(os.path.sep)
 cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
 
 
-class Database:
+class Database(DistanceDataset):
     """
     A database contains a map from preposition -> preposition data
     """
     def __init__(self):
-        self.data = []
-        self.npdata = None
-        self.column_names = ['Preposition', 'Relatum', 'Locatum', 'Distance (b2b)', 'Distance (c2b)','Fre']
+        super().__init__(['Preposition', 'Relatum', 'Locatum', 'Distance (b2b)', 'Distance (c2b)', 'Fre'])
 
-    def add_row(self, row):
-        preposition = row['Preposition']
-        relatum = row['Relatum']
-        locatum = row['Locatum']
-        b2b = row['Distance (b2b)']
-        c2b = row['Distance (c2b)']
-        Fre = row['Fre']
 
-        self.data.append((preposition, relatum, locatum, b2b, c2b, Fre))
+full_labels = {
+    'Fre': 'Frequency',
+    'Distance (c2b)': 'Distance from locatum centroid to relatum boundary',
+    'Distance (b2b)': 'Distance from locatum boundary to relatum boundary',
+}
 
-    def finalise(self):
-        self.npdata = np.array(self.data)
 
-    def get_categories_details(self, category, subcategory_name, datapoint_column_name, value_column_name):
-        categories_details = []
+def draw_lines(fig, series, options):
+    ax = fig.add_subplot(111)
+    for subcategory, x_data, y_data in series:
+        ax.plot(x_data, y_data, label=subcategory, marker='o')
 
-        category_column_ind = self.column_names.index(category)
-        subcategory_column_ind = self.column_names.index(subcategory_name)
-        datapoint_column_ind = self.column_names.index(datapoint_column_name)
-        value_column_ind = self.column_names.index(value_column_name)
+    ax.legend(fontsize=10)
 
-        unique_categories = np.unique(self.npdata[:, category_column_ind])
+    ax.set_xlabel(options['xlabel'])
+    ax.set_ylabel(options['ylabel'])
 
-        for category in unique_categories:
-            indices = np.where(self.npdata[:, category_column_ind] == category)
-            category_data = self.npdata[indices]
-            unique_subcategories = np.unique(category_data[:, subcategory_column_ind])
 
-            subcategories_data = []
-            for subcategory in unique_subcategories:
-                indices = np.where(category_data[:, subcategory_column_ind] == subcategory)
-                df_data = category_data[indices][:, (datapoint_column_ind, value_column_ind)]
-                df = pd.DataFrame(columns=[datapoint_column_name, value_column_name], data=df_data)
-                subcategories_data.append(dict(df=df, subcategory=subcategory))
+def draw_bubbles(fig, series, options):
+    ax = fig.add_subplot(111)
 
-            categories_details.append(dict(category=category, subcategories=subcategories_data))
+    import itertools
+    colours = itertools.cycle(('lightsteelblue', 'crimson', 'yellow', 'b', 'black', 'orange', 'lightcoral', 'lime', 'brown', 1))
 
-        return categories_details
+    for subcategory, x_data, y_data, s in series:
+        ax.scatter(x=x_data, y=y_data, s=s, c=next(colours), label=subcategory, alpha=0.5, edgecolor='black', linewidth=1)
 
+    legend = ax.legend(fontsize=10)
 
-full_labels = {
-    'Fre': 'Frequency',
-    'Distance (c2b)': 'Distance from locatum centroid to relatum boundary',
-    'Distance (b2b)': 'Distance from locatum boundary to relatum boundary',
-}
+    for legend_handler in legend.legendHandles:
+        legend_handler._sizes = [200]
+
+    ax.set_xlabel(options['xlabel'])
+    ax.set_ylabel(options['ylabel'])
+
+    ax.set_title(options['title'],
+                 fontdict={'family': 'serif',
+                           'color': 'darkblue',
+                           'weight': 'bold',
+                           'size': 18})
 
 
 class Command(BaseCommand):
@@ -85,143 +81,113 @@ class Command(BaseCommand):
         for sheet_name in xl.sheet_names:
             df = xl.parse(sheet_name, keep_default_na=False)
             df = df.fillna('')
+            self.database.add_frame(df)
 
-            for row_num, row in df.iterrows():
-                self.database.add_row(row)
-
-    def plot(self, categories_details, datapoint_column_name, value_column_name, img_dir, image_name_prefix, type='gigigi'):
+    def plot(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix, type='gigigi'):
+        """
+        :return: list of FigureSpec, one per category
+        """
         image_name_prefix += '_' + type
         if type == 'gigigi':
-            self._plot_gigigi(categories_details, datapoint_column_name, value_column_name, img_dir, image_name_prefix)
+            return self._gigigi_specs(categories_details, datapoint_column_name, value_column_name, image_name_prefix)
         elif type == 'normal':
-            self._plot_scatter(categories_details, datapoint_column_name, value_column_name, img_dir, image_name_prefix, yaxis_is_frequency=True)
+            return self._scatter_specs(categories_details, datapoint_column_name, value_column_name, image_name_prefix,
+                                       yaxis_is_frequency=True)
         else:
-            self._plot_scatter(categories_details, datapoint_column_name, value_column_name, img_dir, image_name_prefix,
-                               yaxis_is_frequency=False)
+            return self._scatter_specs(categories_details, datapoint_column_name, value_column_name, image_name_prefix,
+                                       yaxis_is_frequency=False)
 
-    def _plot_gigigi(self, categories_details, datapoint_column_name, value_column_name, img_dir, image_name_prefix):
+    def _gigigi_specs(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix):
+        specs = []
         for category_details in categories_details:
             category = category_details['category']
 
             file_name = image_name_prefix + '-' + category.replace(' ', '_')
-            file_path = os.path.join(img_dir, file_name)
-
-            subcategories = category_details['subcategories']
-
-
-            fg = plt.figure(figsize=(10, 7))
-            # plt.xticks(rotation=90, ha='right')
-            # plt.subplots_adjust(bottom=0.4, top=0.99)
-
-            import itertools
-            marker = itertools.cycle(("$f$", 'o', r"$\mathcal{A}$","$1$", 's',5, 'h', 1))
-
-            colours = itertools.cycle(('lightsteelblue', 'crimson', 'yellow', 'b', 'black', 'orange', 'lightcoral', 'lime', 'brown', 1))
 
-            for ind, subcategory_data in enumerate(subcategories, 1):
-                subcategory = subcategory_data['subcategory']
+            series = []
+            for subcategory_data in category_details['subcategories']:
                 df = subcategory_data['df']
-                x_data = np.array(df[datapoint_column_name]).astype(np.float)
-                y_data = np.array(df[value_column_name]).astype(np.float)
+                x_data = np.array(df[datapoint_column_name]).astype(np.float64)
+                y_data = np.array(df[value_column_name]).astype(np.float64)
 
                 x_sort_order = np.argsort(x_data)
-                x_data = x_data[x_sort_order]
-                y_data = y_data[x_sort_order]
-                plt.plot(x_data, y_data, label=subcategory, marker='o')
+                series.append((subcategory_data['subcategory'], x_data[x_sort_order], y_data[x_sort_order]))
 
-            legend = plt.legend(fontsize=10)
+            options = dict(xlabel=full_labels.get(datapoint_column_name, datapoint_column_name),
+                           ylabel=full_labels.get(value_column_name, value_column_name))
+            specs.append(FigureSpec(file_name, draw_lines, series, options))
+        return specs
 
-            plt.xlabel(full_labels.get(datapoint_column_name, datapoint_column_name))
-            plt.ylabel(full_labels.get(value_column_name, value_column_name))
-
-            plt.savefig(file_path)
-            plt.close()
-
-    def _plot_scatter(self, categories_details, datapoint_column_name, value_column_name, img_dir, image_name_prefix, yaxis_is_frequency=True):
+    def _scatter_specs(self, categories_details, datapoint_column_name, value_column_name, image_name_prefix, yaxis_is_frequency=True):
+        specs = []
         for category_details in categories_details:
             category = category_details['category']
 
             file_name = image_name_prefix + '-' + category.replace(' ', '_')
-            file_path = os.path.join(img_dir, file_name)
-
-            subcategories = category_details['subcategories']
-
-
-            fg = plt.figure(figsize=(10, 7))
-            # plt.xticks(rotation=90, ha='right')
-            # plt.subplots_adjust(bottom=0.4, top=0.99)
 
-            import itertools
-            marker = itertools.cycle(("$f$", 'o', r"$\mathcal{A}$","$1$", 's',5, 'h', 1))
-
-            colours = itertools.cycle(('lightsteelblue', 'crimson', 'yellow', 'b', 'black', 'orange', 'lightcoral', 'lime', 'brown', 1))
-
-            for ind, subcategory_data in enumerate(subcategories, 1):
-                subcategory = subcategory_data['subcategory']
+            series = []
+            for ind, subcategory_data in enumerate(category_details['subcategories'], 1):
                 df = subcategory_data['df']
-                x_data = np.array(df[datapoint_column_name]).astype(np.float)
-                y_data = np.array(df[value_column_name]).astype(np.float)
+                x_data = np.array(df[datapoint_column_name]).astype(np.float64)
+                y_data = np.array(df[value_column_name]).astype(np.float64)
 
-                s = np.log2(y_data + 1).astype(np.float) * 70
+                s = np.log2(y_data + 1).astype(np.float64) * 70
 
                 if not yaxis_is_frequency:
                     y_data.fill(ind)
-                plt.scatter(x=x_data, y=y_data, s=s, c=next(colours), label=subcategory, alpha=0.5, edgecolor='black', linewidth=1)
-
-            legend = plt.legend(fontsize=10)
-
-            for legend_handler in legend.legendHandles:
-                legend_handler._sizes = [200]
-            plt.xlabel(full_labels.get(datapoint_column_name, datapoint_column_name))
+                series.append((subcategory_data['subcategory'], x_data, y_data, s))
 
             if not yaxis_is_frequency:
                 y_label = 'Preposition'
             else:
                 y_label = full_labels.get(value_column_name, value_column_name)
 
-            plt.ylabel(y_label)
+            options = dict(xlabel=full_labels.get(datapoint_column_name, datapoint_column_name), ylabel=y_label,
+                           title=file_name.replace('_', ' '))
+            specs.append(FigureSpec(file_name, draw_bubbles, series, options))
+        return specs
 
-            plt.title(file_name.replace('_', ' '),
-                      fontdict={'family': 'serif',
-                                'color': 'darkblue',
-                                'weight': 'bold',
-                                'size': 18})
-
-            plt.savefig(file_path)
-            plt.close()
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', action='store', dest='processes', default=None, type=int,
+                            help='Number of processes that render the figures, default to the number of CPUs')
+        parser.add_argument('--force', action='store_true', dest='force', default=False,
+                            help='Render all figures, even those whose data and drawing code have not changed, '
+                                 'e.g. after an update of matplotlib')
 
     def handle(self, *args, **options):
-        file = 'files/xlsx/data_for_plotting1.xlsx'
-        file_name = os.path.splitext(os.path.split(file)[1])[0]
         img_dir = os.path.join(cache_dir, 'png')
         pathlib.Path(img_dir).mkdir(parents=True, exist_ok=True)
+        specs = []
+
+        file = 'files/xlsx/data_for_plotting1.xlsx'
+        file_name = os.path.splitext(os.path.split(file)[1])[0]
         image_name_prefix = file_name + '-'
 
         self.populate_objects_from_excel(file)
         self.database.finalise()
 
         categories_details = self.database.get_categories_details('Preposition', 'Relatum', 'Distance (b2b)', 'Fre')
-        self.plot(categories_details, 'Distance (b2b)', 'Fre', img_dir, image_name_prefix + 'b2b', 'gigigi')
-        self.plot(categories_details, 'Distance (b2b)', 'Fre', img_dir, image_name_prefix + 'b2b', 'gigili')
+        specs += self.plot(categories_details, 'Distance (b2b)', 'Fre', image_name_prefix + 'b2b', 'gigigi')
+        specs += self.plot(categories_details, 'Distance (b2b)', 'Fre', image_name_prefix + 'b2b', 'gigili')
 
         categories_details = self.database.get_categories_details('Preposition', 'Relatum', 'Distance (c2b)', 'Fre')
-        self.plot(categories_details,'Distance (c2b)', 'Fre', img_dir, image_name_prefix + 'c2b', 'gigigi')
-        self.plot(categories_details,'Distance (c2b)', 'Fre', img_dir, image_name_prefix + 'c2b', 'gigili')
+        specs += self.plot(categories_details,'Distance (c2b)', 'Fre', image_name_prefix + 'c2b', 'gigigi')
+        specs += self.plot(categories_details,'Distance (c2b)', 'Fre', image_name_prefix + 'c2b', 'gigili')
 
         # Part 2
         file = 'files/xlsx/data_for_plotting2.xlsx'
         file_name = os.path.splitext(os.path.split(file)[1])[0]
-        img_dir = os.path.join(cache_dir, 'png')
-        pathlib.Path(img_dir).mkdir(parents=True, exist_ok=True)
         image_name_prefix = file_name + '-'
 
         self.populate_objects_from_excel(file)
         self.database.finalise()
 
         categories_details = self.database.get_categories_details('Relatum', 'Preposition', 'Distance (b2b)', 'Fre')
-        self.plot(categories_details, 'Distance (b2b)', 'Fre', img_dir, image_name_prefix + 'b2b', 'normal')
-        self.plot(categories_details, 'Distance (b2b)', 'Fre', img_dir, image_name_prefix + 'b2b', 'gigili')
+        specs += self.plot(categories_details, 'Distance (b2b)', 'Fre', image_name_prefix + 'b2b', 'normal')
+        specs += self.plot(categories_details, 'Distance (b2b)', 'Fre', image_name_prefix + 'b2b', 'gigili')
 
         categories_details = self.database.get_categories_details('Relatum', 'Preposition', 'Distance (c2b)','Fre')
-        self.plot(categories_details, 'Distance (c2b)', 'Fre', img_dir, image_name_prefix + 'c2b', 'gigili')
-        self.plot(categories_details, 'Distance (c2b)', 'Fre', img_dir, image_name_prefix + 'c2b', 'normal')
+        specs += self.plot(categories_details, 'Distance (c2b)', 'Fre', image_name_prefix + 'c2b', 'gigili')
+        specs += self.plot(categories_details, 'Distance (c2b)', 'Fre', image_name_prefix + 'c2b', 'normal')
+
+        render_figures(specs, img_dir, options['processes'], skip_unchanged=not options['force'])
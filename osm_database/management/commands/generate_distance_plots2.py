@@ -1,11 +1,11 @@
 import os
 import pathlib
 
-import matplotlib.pyplot as plt
 import pandas as pd
 from django.core.management import BaseCommand
 
 from osm_database.jupyter_django_commons.distance_plots2 import Plotter
+from osm_database.jupyter_django_commons.figure_rendering import render_figures
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.split(__file__)[1][0:-3]
@@ -23,14 +23,12 @@ full_labels = {
 class Command(BaseCommand):
 
     def plot(self, categories_details, datapoint_column_name, value_column_name, img_dir, image_name_prefix, type='gigigi'):
-        results, result_type = self.plotter.plot(categories_details, datapoint_column_name, value_column_name,
-                                                 image_name_prefix, type)
+        results, result_type = self.plotter.figure_specs(categories_details, datapoint_column_name, value_column_name,
+                                                         image_name_prefix, type)
 
         if result_type == 'figure':
-            for plot_name, fig in results.items():
-                file_path = os.path.join(img_dir, plot_name)
-                fig.savefig(file_path)
-                plt.close(fig)
+            # Rendered together at the end of handle()
+            self.specs += results
         elif results is not None:
             file_name = image_name_prefix + '-table.xlsx'
             file_path = os.path.join(img_dir, file_name)
@@ -44,6 +42,11 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--legend', action='store', dest='show_legend', default='both', type=str)
+        parser.add_argument('--processes', action='store', dest='processes', default=None, type=int,
+                            help='Number of processes that render the figures, default to the number of CPUs')
+        parser.add_argument('--force', action='store_true', dest='force', default=False,
+                            help='Render all figures, even those whose data and drawing code have not changed, '
+                                 'e.g. after an update of matplotlib')
 
     def handle(self, *args, **options):
         show_legend = options['show_legend']
@@ -72,6 +75,7 @@ class Command(BaseCommand):
         for img_dir, legend_on in plot_config:
             self.plotter.legend_on = legend_on
             pathlib.Path(img_dir).mkdir(parents=True, exist_ok=True)
+            self.specs = []
 
 
             categories_details = self.plotter.database.get_categories_details('Preposition', 'Relatum', 'Distance (b2b)', 'Fre')
@@ -103,3 +107,5 @@ class Command(BaseCommand):
             # self.plot(categories_details, 'Distance (c2b)', 'Fre', img_dir, 'data_for_plotting2-c2b', 'normal-samesize')
             # self.plot(categories_details, 'Distance (c2b)', 'Fre', img_dir, 'data_for_plotting2-c2b', 'gigigi-accum-highlight')
             # self.plot(categories_details, 'Distance (c2b)', 'Fre', img_dir, 'data_for_plotting2-c2b', 'table-accum')
+
+            render_figures(self.specs, img_dir, options['processes'], skip_unchanged=not options['force'])
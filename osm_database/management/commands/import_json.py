@@ -9,12 +9,14 @@ from django.core.management import BaseCommand
 from django.db import IntegrityError
 from progress.bar import Bar
 
+from osm_database.management.util.instrumentation import add_stats_argument, instrument, stage
 from osm_database.models import *
 
 
 class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--folder', action='store', dest='folder', required=True, type=str)
+        add_stats_argument(parser)
 
     def create_positions(self, position_list, parent_class, parent_class_id_field, parent):
         positions = []
@@ -164,20 +166,27 @@ class Command(BaseCommand):
         if not os.path.isdir(folder):
             raise Exception('Folder {} does not exist'.format(folder))
 
-        last_position = Position.objects.last()
-        if last_position is None:
-            self.last_position_id = 0
-        else:
-            self.last_position_id = last_position.id
+        with instrument('import_json', options['stats_file']):
+            self.import_folder(folder)
 
-        cache_file = os.path.join(folder, 'processed.pkl')
-        if os.path.isfile(cache_file):
-            with open(cache_file, 'rb') as f:
-                processed = pickle.load(f)
-        else:
-            processed = set()
+    def import_folder(self, folder):
+        with stage('load existing ids') as s:
+            last_position = Position.objects.last()
+            if last_position is None:
+                self.last_position_id = 0
+            else:
+                self.last_position_id = last_position.id
+
+            cache_file = os.path.join(folder, 'processed.pkl')
+            if os.path.isfile(cache_file):
+                with open(cache_file, 'rb') as f:
+                    processed = pickle.load(f)
+            else:
+                processed = set()
+
+            existing_osm_ids = set(OsmEntity.objects.values_list('osm_id', flat=True))
+            s.add(len(existing_osm_ids))
 
-        existing_osm_ids = set(OsmEntity.objects.values_list('osm_id', flat=True))
         files_to_process = []
 
         for file in os.listdir(folder):
@@ -185,18 +194,16 @@ class Command(BaseCommand):
                 filename = os.path.join(folder, file)
                 files_to_process.append(filename)
 
-        bar = Bar('Processing each json file', max=len(files_to_process))
-        for filename in files_to_process:
-            try:
-                self.process_file(filename, existing_osm_ids)
-                processed.add(filename)
-                with open(cache_file, 'wb') as f:
-                    pickle.dump(processed, f, pickle.HIGHEST_PROTOCOL)
-            except Exception:
-                traceback.print_exc()
-            bar.next()
-        bar.finish()
-
-
-
-
+        with stage('process files') as s:
+            bar = Bar('Processing each json file', max=len(files_to_process))
+            for filename in files_to_process:
+                try:
+                    self.process_file(filename, existing_osm_ids)
+                    processed.add(filename)
+                    with open(cache_file, 'wb') as f:
+                        pickle.dump(processed, f, pickle.HIGHEST_PROTOCOL)
+                    s.add()
+                except Exception:
+                    traceback.print_exc()
+                bar.next()
+            bar.finish()
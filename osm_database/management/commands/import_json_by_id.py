@@ -8,7 +8,9 @@ from logging import warning
 from django.core.management import BaseCommand
 from django.db import IntegrityError
 from progress.bar import Bar
+from progress.counter import Counter
 
+from osm_database.management.util.detail_downloader import iter_downloaded
 from osm_database.models import *
 
 
@@ -16,6 +18,9 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--folder', action='store', dest='folder', required=True, type=str)
         parser.add_argument('--commit', action='store_true', dest='commit', default=False)
+        parser.add_argument('--shards', action='store_true', dest='shards', default=False,
+                            help='Read the responses from the manifest and shards of the downloaders in the folder '
+                                 'instead of one json file per entity')
 
     def create_positions(self, position_list, parent_class, parent_class_id_field, parent, commit):
         positions = []
@@ -41,7 +46,9 @@ class Command(BaseCommand):
     def process_file(self, filename, existing_osm_ids, commit):
         with open(filename, 'r') as f:
             entity = json.load(f, parse_float=Decimal)
+        self.process_entity(entity, filename, existing_osm_ids, commit)
 
+    def process_entity(self, entity, filename, existing_osm_ids, commit):
         osm_type = entity.get('osm_type', None)
         if osm_type == 'N':
             osm_type = 'node'
@@ -209,6 +216,35 @@ class Command(BaseCommand):
                 traceback.print_exc()
                 warning("Entity {} from {} already exist".format(entity_obj.osm_id, filename))
 
+    def save_processed(self, processed, cache_file):
+        with open(cache_file, 'wb') as f:
+            pickle.dump(processed, f, pickle.HIGHEST_PROTOCOL)
+
+    def process_shards(self, folder, processed, cache_file, existing_osm_ids, commit):
+        """
+        Import the responses stored by DetailDownloader, streaming each shard once. Processed ids are remembered in the
+        same cache file as processed files, which is written each time a shard is finished.
+        """
+        counter = Counter('Processing each downloaded entity ')
+        last_file = None
+        for osm_id, file, content in iter_downloaded(folder):
+            if file != last_file and last_file is not None and commit:
+                self.save_processed(processed, cache_file)
+            last_file = file
+
+            if osm_id not in processed:
+                source = '{} ({})'.format(osm_id, file)
+                try:
+                    entity = json.loads(content.decode('utf-8'), parse_float=Decimal)
+                    self.process_entity(entity, source, existing_osm_ids, commit)
+                    processed.add(osm_id)
+                except Exception:
+                    traceback.print_exc()
+            counter.next()
+        counter.finish()
+        if commit:
+            self.save_processed(processed, cache_file)
+
     def handle(self, *args, **options):
         folder = options['folder']
         commit = options['commit']
@@ -229,6 +265,11 @@ class Command(BaseCommand):
             processed = set()
 
         existing_osm_ids = set(['{}{}'.format(x[0], x[1]) for x in OsmEntity.objects.values_list('osm_type', 'osm_id')])
+
+        if options['shards']:
+            self.process_shards(folder, processed, cache_file, existing_osm_ids, commit)
+            return
+
         files_to_process = []
 
         for file in os.listdir(folder):
@@ -242,8 +283,7 @@ class Command(BaseCommand):
                 self.process_file(filename, existing_osm_ids, commit)
                 processed.add(filename)
                 if commit:
-                    with open(cache_file, 'wb') as f:
-                        pickle.dump(processed, f, pickle.HIGHEST_PROTOCOL)
+                    self.save_processed(processed, cache_file)
             except Exception:
                 traceback.print_exc()
             bar.next()
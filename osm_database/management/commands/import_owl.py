@@ -1,28 +1,15 @@
 import os
-import pickle
 
-import requests
-import warnings
-
-from urllib3.exceptions import InsecureRequestWarning
-
-warnings.filterwarnings("ignore", category=InsecureRequestWarning)
-
-from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
+from lxml import etree
 
+from osm_database.management.util.ontology import Ontology
 
-def find_subclasses(subclasses, parentClsName):
-    retval = []
+OWL = '{http://www.w3.org/2002/07/owl#}'
+RDF = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+RDFS = '{http://www.w3.org/2000/01/rdf-schema#}'
 
-    for subclass in subclasses:
-        classes = subclass.select('class')
-        mainCls = classes[0]
-        parentCls = classes[1]
-        if parentCls.get('iri') == parentClsName:
-            subclass_name = mainCls.get('iri')
-            retval.append(subclass_name)
-    return retval
+compiled_ontology_file = 'feature_ontology.npz'
 
 
 def get_abbreviated_name(name):
@@ -68,65 +55,81 @@ def get_feature(filename, feature_dict, iri):
     return feature
 
 
+def iter_elements(filepath, tags):
+    """
+    Stream the elements with the given (namespaced) tags. Top level elements are discarded once they are processed,
+    including those of other tags (ObjectProperty, AnnotationAssertion, ...), which iterparse's tag filter would skip
+    and leave under the root.
+    """
+    tags = {tags} if isinstance(tags, str) else set(tags)
+    for event, element in etree.iterparse(filepath, events=('end',), remove_comments=True):
+        if element.tag in tags:
+            yield element
+
+        parent = element.getparent()
+        if parent is not None and parent.getparent() is None:
+            element.clear()
+            while element.getprevious() is not None:
+                del parent[0]
+
+
 def parse_secondary_owl(feature_dict, folder, filename):
+    """
+    Read an RDF/XML ontology: every owl:Class with a rdfs:label becomes a feature, named after the label, and each
+    rdfs:subClassOf rdf:resource a parent of it
+    """
     filepath = os.path.join(folder, filename)
-    with open(filepath, 'r') as f:
-        content = f.read()
-
-    content = content.replace('owl:Class', 'owl__Class').replace('rdfs:subClassOf', 'rdfs__subClassOf')
-    soup = BeautifulSoup(content, 'html5lib')
-    feature_classes = soup.select('owl__Class')
-    for feature_class_iri in feature_classes:
-        label = feature_class_iri.find('rdfs:label')
+    for feature_class_iri in iter_elements(filepath, OWL + 'Class'):
+        label = feature_class_iri.find(RDFS + 'label')
         if label is None:
             continue
-        label = '#' + label.text
+        label = '#' + (label.text or '')
         feature_class = get_feature(filename, feature_dict, label)
-        parentClasses = feature_class_iri.select('rdfs__subClassOf')
         feature_class.resolved = True
-        for parentClass in parentClasses:
-            parentClass_name = parentClass.get('rdf:resource')
+        for parentClass in feature_class_iri.iterchildren(RDFS + 'subClassOf'):
+            parentClass_name = parentClass.get(RDF + 'resource')
             if parentClass_name is not None:
                 parentClass = get_feature(filename, feature_dict, parentClass_name)
                 feature_class.parent.add(parentClass)
                 parentClass.children.add(feature_class)
 
 
-def parse_primary_owl(feature_dict, folder, filename):
-    filepath = os.path.join(folder, filename)
-
-    with open(filepath, 'r') as f:
-        content = f.read()
+def get_class_iri(cls):
+    iri = cls.get('IRI')
+    if iri is None:
+        iri = cls.get('abbreviatedIRI')
+    return iri
 
-    soup = BeautifulSoup(content, 'html5lib')
 
-    ontology = soup.find('ontology')
-    subclasses = ontology.select('subclassof')
-    declarations = ontology.select('declaration class')
-
-    for declaration in declarations:
-        iri = declaration.get('iri')
-        if iri is None:
-            iri = declaration.get('abbreviatediri')
-        if iri is not None:
-            name, url = get_abbreviated_name(iri)
-            store_feature(feature_dict, filename, name, url)
+def parse_primary_owl(feature_dict, folder, filename):
+    """
+    Read an OWL/XML ontology: every declared Class becomes a feature, and every SubClassOf that contains exactly two
+    Class elements makes the second one a parent of the first
+    """
+    filepath = os.path.join(folder, filename)
 
-    for subclass in subclasses:
-        classes = subclass.select('class')
-        if len(classes) != 2:
-            continue
-        child_feature_iri = classes[0].get('iri')
-        parent_feature_iri = classes[1].get('iri')
+    subclasses = []
+    for element in iter_elements(filepath, (OWL + 'Declaration', OWL + 'SubClassOf')):
+        if element.tag == OWL + 'Declaration':
+            for declaration in element.iter(OWL + 'Class'):
+                iri = get_class_iri(declaration)
+                if iri is not None:
+                    name, url = get_abbreviated_name(iri)
+                    store_feature(feature_dict, filename, name, url)
+        else:
+            classes = list(element.iter(OWL + 'Class'))
+            if len(classes) == 2:
+                subclasses.append((classes[0].get('IRI'), classes[0].get('abbreviatedIRI'),
+                                   classes[1].get('IRI'), classes[1].get('abbreviatedIRI')))
 
+    # Relations are resolved once all the declarations of the file are known, as they may come before them
+    for child_feature_iri, child_abbreviated_iri, parent_feature_iri, parent_abbreviated_iri in subclasses:
         if child_feature_iri is None:
-            child_feature_iri = classes[0].get('abbreviatediri')
-            assert child_feature_iri.startswith('owl:')
-            child_feature_iri = '#' + child_feature_iri[4:]
+            assert child_abbreviated_iri.startswith('owl:')
+            child_feature_iri = '#' + child_abbreviated_iri[4:]
         if parent_feature_iri is None:
-            parent_feature_iri = classes[1].get('abbreviatediri')
-            assert parent_feature_iri.startswith('owl:')
-            parent_feature_iri = '#' + parent_feature_iri[4:]
+            assert parent_abbreviated_iri.startswith('owl:')
+            parent_feature_iri = '#' + parent_abbreviated_iri[4:]
 
         child_feature = get_feature(filename, feature_dict, child_feature_iri)
         parent_feature = get_feature(filename, feature_dict, parent_feature_iri)
@@ -151,55 +154,22 @@ class Command(BaseCommand):
         parser.add_argument('--folder', action='store', dest='folder', required=True, type=str)
 
     def handle(self, *args, **options):
-        feature_dict_file = 'feature_dict.pkl'
-        if os.path.isfile(feature_dict_file):
-            with open(feature_dict_file, 'rb') as f:
-                feature_dict = pickle.load(f)
-        else:
-            folder = options['folder']
-            if not os.path.isdir(folder):
-                raise Exception('Folder {} does not exist'.format(folder))
-
-            feature_dict = dict(name={}, url={})
-            for filename in os.listdir(folder):
-                if filename.endswith(".owl"):
-                    if 'lago' in filename:
-                        parse_primary_owl(feature_dict, folder, filename)
-
-            for filename in os.listdir(folder):
-                if filename.endswith(".owl"):
-                    if 'lago' not in filename:
-                        print(filename)
-                        parse_secondary_owl(feature_dict, folder, filename)
-
-            with open(feature_dict_file, 'wb') as f:
-                pickle.dump(feature_dict, f)
-
-
-        # soups = {}
-        # items = list(feature_dict['url'].items())
-        # for iri, feature in items:
-        #     if not feature.resolved:
-        #         url = iri[:iri.index('#')]
-        #         file_name = url[url.rfind('/') + 1:]
-        #
-        #         if file_name not in soups:
-        #             file_path = 'files/owl/' + file_name
-        #             if not os.path.isfile(file_path):
-        #                 continue
-        #             with open(file_path, 'r') as f:
-        #                 content = f.read()
-        #                 content = content.replace('owl:Class', 'owl__Class').replace('rdfs:subClassOf', 'rdfs__subClassOf')
-        #             soup = BeautifulSoup(content, 'html5lib')
-        #             parse_secondary_owl(feature_dict, soup)
-        #             soups[file_name] = True
-        # with open(feature_dict_file, 'wb') as f:
-        #     pickle.dump(feature_dict, f)
-
-
-
-
-
-
-
-
+        folder = options['folder']
+        if not os.path.isdir(folder):
+            raise Exception('Folder {} does not exist'.format(folder))
+
+        feature_dict = dict(name={}, url={})
+        for filename in os.listdir(folder):
+            if filename.endswith(".owl"):
+                if 'lago' in filename:
+                    parse_primary_owl(feature_dict, folder, filename)
+
+        for filename in os.listdir(folder):
+            if filename.endswith(".owl"):
+                if 'lago' not in filename:
+                    print(filename)
+                    parse_secondary_owl(feature_dict, folder, filename)
+
+        ontology = Ontology.from_feature_dict(feature_dict)
+        ontology.save(compiled_ontology_file)
+        print('{} features saved to {}'.format(len(ontology), compiled_ontology_file))
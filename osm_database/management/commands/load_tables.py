@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+
+from osm_database.management.util.table_transfer import load_tables
+
+
+class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', action='store', dest='dir', required=True, type=str)
+
+    def handle(self, *args, **options):
+        tables = load_tables(options['dir'])
+        for entry in tables:
+            print('{}: {} rows'.format(entry['table'], entry['rows']))
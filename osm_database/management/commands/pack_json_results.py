@@ -0,0 +1,48 @@
+import json
+import os
+
+from django.core.management import BaseCommand
+from progress.bar import Bar
+
+from osm_database.management.util.detail_downloader import DownloadManifest
+from osm_database.management.util.json_shards import ShardWriter, is_shard
+
+
+class Command(BaseCommand):
+    """
+    Move the responses that the downloaders saved as one `<osm_id>.json` per entity into gzip shards, and point the
+    manifest to their new location. Run download_json_by_id or import_osm once beforehand so that the existing files
+    are recorded in the manifest.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--folder', action='store', dest='folder', required=True, type=str,
+                            help='The results folder, containing manifest.tsv')
+        parser.add_argument('--delete', action='store_true', dest='delete', default=False,
+                            help='Delete each json file once its content is in a shard')
+
+    def handle(self, folder, delete, *args, **options):
+        manifest_path = os.path.join(folder, 'manifest.tsv')
+        if not os.path.isfile(manifest_path):
+            raise Exception('No manifest found at {}'.format(manifest_path))
+
+        manifest = DownloadManifest(manifest_path)
+        to_pack = [(osm_id, file) for osm_id, (status, file, offset, length) in manifest.entries.items()
+                   if status == '200' and not is_shard(file)]
+
+        writer = ShardWriter(folder)
+        bar = Bar('Packing json files', max=len(to_pack))
+        try:
+            for osm_id, file in to_pack:
+                path = os.path.join(folder, file)
+                with open(path, 'r') as f:
+                    content = json.load(f)
+                shard, offset, length = writer.write(content)
+                manifest.record(osm_id, 200, shard, offset, length)
+                if delete:
+                    os.remove(path)
+                bar.next()
+        finally:
+            bar.finish()
+            writer.close()
+            manifest.close()
@@ -0,0 +1,130 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import weka.core.jvm as jvm
+from django.core.management import BaseCommand
+from progress.bar import Bar
+
+from osm_database.weka_model.weka_util import WekaModel, ExpressionFeatureExtraction
+
+expression_columns = ['locatum', 'prep', 'relatum', 'rel_lat', 'rel_loc', 'loc_type', 'rel_type']
+
+# Number of rows that cannot be predicted listed with their problem
+max_problems_shown = 20
+
+
+def read_table(file, sheet_name):
+    if file.lower().endswith('.csv'):
+        return pd.read_csv(file, keep_default_na=False)
+    return pd.read_excel(file, sheet_name=sheet_name, keep_default_na=False)
+
+
+def write_table(df, file):
+    if file.lower().endswith('.csv'):
+        df.to_csv(file, index=False)
+    else:
+        df.to_excel(file, index=False)
+
+
+class Command(BaseCommand):
+    """
+    Predict the vicinity of every expression in a CSV or Excel file with the Weka model. The features of the rows are
+    built and scored in chunks. The predictions are written to a new column. Rows that cannot be predicted, because
+    their preposition or a type is not in the lookup tables or a coordinate is missing, are listed and left empty.
+
+    The input must have the columns locatum, prep, relatum, rel_lat, rel_loc (the relatum's longitude), loc_type and
+    rel_type. Use --columns to map other column names to these.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--file', action='store', dest='file', required=True, type=str)
+        parser.add_argument('--sheet-name', action='store', dest='sheet_name', default=0,
+                            help='Sheet to read if the file is an Excel file, default to the first one')
+        parser.add_argument('--output', action='store', dest='output', default=None, type=str,
+                            help='Default to <file name>_predictions with the same extension')
+        parser.add_argument('--columns', action='store', dest='columns', default=None, type=str,
+                            help='Comma separated names of the columns in the order {}'
+                            .format(','.join(expression_columns)))
+        parser.add_argument('--prediction-column', action='store', dest='prediction_column', default='vicinity',
+                            type=str)
+        parser.add_argument('--chunk-size', action='store', dest='chunk_size', default=10000, type=int,
+                            help='Number of rows sent to the model at once')
+        parser.add_argument('--model', action='store', dest='model',
+                            default='osm_database/weka_model/connors-1000.model', type=str)
+        parser.add_argument('--max-heap-size', action='store', dest='max_heap_size', default='2g', type=str)
+
+    def handle(self, *args, **options):
+        file = options['file']
+        if not os.path.isfile(file):
+            raise Exception('File {} does not exist'.format(file))
+
+        output = options['output']
+        if output is None:
+            name, ext = os.path.splitext(file)
+            output = '{}_predictions{}'.format(name, ext)
+
+        df = read_table(file, options['sheet_name'])
+        if options['columns'] is None:
+            columns = expression_columns
+        else:
+            columns = options['columns'].split(',')
+            if len(columns) != len(expression_columns):
+                raise Exception('--columns must have {} names'.format(len(expression_columns)))
+        missing_columns = [x for x in columns if x not in df.columns]
+        if missing_columns:
+            raise Exception('Columns {} not found in {}'.format(', '.join(missing_columns), file))
+
+        expressions = df[columns].copy()
+        expressions.columns = expression_columns
+        expressions['rel_lat'] = pd.to_numeric(expressions['rel_lat'], errors='coerce')
+        expressions['rel_loc'] = pd.to_numeric(expressions['rel_loc'], errors='coerce')
+
+        feature_extractor = ExpressionFeatureExtraction()
+        problems = feature_extractor.find_problems(expressions)
+        valid_rows = np.array([i for i, problem in enumerate(problems) if problem == ''], dtype=np.int64)
+        if len(valid_rows) < len(df):
+            print('{} rows cannot be predicted, their {} is left empty:'
+                  .format(len(df) - len(valid_rows), options['prediction_column']))
+            shown = 0
+            for i, problem in enumerate(problems):
+                if problem != '' and shown < max_problems_shown:
+                    print('  row {}: {}'.format(i + 1, problem))
+                    shown += 1
+            if len(df) - len(valid_rows) > shown:
+                print('  ...')
+
+        # Features are built chunk by chunk, so memory only depends on the chunk size
+        chunk_size = options['chunk_size']
+        predictions = np.full(len(df), np.nan, dtype=np.float64)
+        embed_time = 0.
+        predict_time = 0.
+        jvm.start(system_cp=True, packages=True, max_heap_size=options['max_heap_size'])
+        try:
+            weka_model = WekaModel(options['model'])
+            index_map = weka_model.index_map(feature_extractor.columns)
+
+            bar = Bar('Predicting', max=len(valid_rows))
+            for chunk_start in range(0, len(valid_rows), chunk_size):
+                chunk = valid_rows[chunk_start:chunk_start + chunk_size]
+                start = time.time()
+                vectors = feature_extractor.embed_many(expressions.iloc[chunk])
+                embed_time += time.time() - start
+
+                start = time.time()
+                rows = weka_model.convert_vectors(vectors, index_map)
+                predictions[chunk] = weka_model.predict_many(rows)
+                predict_time += time.time() - start
+                bar.next(len(chunk))
+            bar.finish()
+        finally:
+            jvm.stop()
+
+        print('Built features of {} rows in {:.1f}s'.format(len(valid_rows), embed_time))
+        print('Predicted {} rows in {:.1f}s ({:.0f} rows/s)'
+              .format(len(valid_rows), predict_time, len(valid_rows) / predict_time if predict_time > 0 else 0))
+
+        df[options['prediction_column']] = predictions
+        write_table(df, output)
+        print('Predictions written to {}'.format(output))
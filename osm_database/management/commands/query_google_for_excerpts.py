@@ -6,7 +6,6 @@ import urllib
 import zipfile
 
 import pandas as pd
-from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
 from openpyxl import load_workbook
 from progress.bar import Bar
@@ -14,6 +13,8 @@ from selenium import webdriver
 from sortedcontainers import SortedDict
 
 from osm_database.management.util.browser_wrapper import BrowserWrapper
+from osm_database.management.util.excel_export import write_excel
+from osm_database.management.util.google_cache import ParsedPageTable, parse_page, read_cached_page
 from root.utils import send_capcha_unsolve_limit_reached
 
 
@@ -23,43 +24,6 @@ dir_parts = current_dir.split(os.path.sep)
 cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
 
 
-def get_result_stats(body):
-    result_stats = body.select('#result-stats')[0]
-    no_results_indicator = body.select('.HlosJb.bOkdDe')
-    if len(no_results_indicator) > 0:
-        return 0
-    nobrs = result_stats.select('nobr')
-    for nobr in nobrs:
-        nobr.decompose()
-    result_stats_text = result_stats.text
-
-    try:
-        return int(''.join([s for s in result_stats_text if s.isdigit()]))
-    except:
-        print('Unrecognised expression: {}'.format(result_stats_text))
-        return 'Not Found'
-
-
-def get_next_pages_links(body):
-    pages = []
-    nav = body.select('div[role="navigation"]')[-1]
-    page_links = nav.select('table td a')
-    for a in page_links:
-        label = a.get('aria-label')
-        if label is not None:
-            url = 'https://google.com' + a.get('href')
-            pages.append((label, url))
-    return pages
-
-
-def get_searched_items(body, items):
-    gs = body.select('#search div.g')
-    for g in gs:
-        link = g.select('.yuRUbf a')[0].get('href')
-        excerpt = g.select('.aCOpRe')[0].text
-        items.append(Item(link, excerpt))
-
-
 class CookiesPopulationRequiredException(Exception):
     def __init__(self, cookies):
         super(CookiesPopulationRequiredException, self).__init__()
@@ -89,22 +53,8 @@ class Page:
         if not os.path.isfile(cache_file_path):
             raise Exception('File {} doesn\'t exist. Please query it first')
 
-        with open(cache_file_path, 'r') as f:
-            response = f.read()
-
-        soup = BeautifulSoup(response)
-        body = soup.find('body')
-        try:
-            self.result_count = get_result_stats(body)
-        except:
-            self.result_count = -1
-        finally:
-            if self.result_count > 0:
-                get_searched_items(body, self.items)
-                next_pages = get_next_pages_links(body)
-            else:
-                next_pages = []
-
+        self.result_count, items, next_pages = parse_page(read_cached_page(cache_file_path))
+        self.items += [Item(link, excerpt) for link, excerpt in items]
         return next_pages
 
     def make_query_get_next_pages(self, browser_wrapper):
@@ -132,21 +82,7 @@ class Page:
             finally:
                 zf.close()
 
-        soup = BeautifulSoup(response)
-        body = soup.find('body')
-        try:
-            self.result_count = get_result_stats(body)
-        except:
-            self.result_count = -1
-        finally:
-            if self.result_count > 0:
-                try:
-                    next_pages = get_next_pages_links(body)
-                except:
-                    next_pages = []
-            else:
-                next_pages = []
-
+        self.result_count, items, next_pages = parse_page(response.encode('utf-8'))
         return next_pages
 
 
@@ -324,54 +260,35 @@ class Command(BaseCommand):
             name_to_counts[page.query] = count
         return name_to_counts
 
-    def parse_html(self):
-        queries = {}
-        for expression, (locatum, preposition, sheet_name) in self.expressions.items():
-            query_result = QueryResult(expression)
-            query_result.parse_html_recursive(max_pages=100)
-            queries[expression] = (locatum, preposition, sheet_name, query_result)
-        return queries
+    def parse_html(self, processes=None):
+        """
+        Parse the cached pages that changed since the last run, in a process pool
+        :return: ParsedPageTable
+        """
+        parsed_pages = ParsedPageTable(os.path.join(self.cache_dir, 'parsed_pages.pkl'))
+        parsed_pages.update(os.path.join(self.cache_dir, 'html'), processes)
+        return parsed_pages
 
-    def produce_report(self, queries):
+    def produce_report(self, parsed_pages):
         headings = ['Locatum', 'Preposition', 'Relatum', 'Page #', 'URL', 'Num results', 'Item Link', 'Item Excerpt']
-        df = pd.DataFrame(columns=headings)
-        index = 0
-        bar = Bar('Exporting Excel file', max=len(queries))
-        for expression, (locatum, preposition, sheet_name, query_result) in queries.items():
-            total_page_count = len(query_result.pages)
-            page_index = 1
-            for page_name, page in query_result.pages.items():
-                url = page.url
+        rows = []
+        bar = Bar('Exporting Excel file', max=len(self.expressions))
+        for expression, (locatum, preposition, sheet_name) in self.expressions.items():
+            pages = parsed_pages.query_pages(expression, max_pages=100)
+            total_page_count = len(pages)
+            for page_index, page in enumerate(pages, 1):
                 page_number = '{}/{}'.format(page_index, total_page_count)
                 num_results = page.result_count
-                page_index += 1
                 if len(page.items) == 0:
-                    row = [locatum, preposition, sheet_name, page_number, url, num_results, '', '']
-                    df.loc[index] = row
-                    index += 1
+                    rows.append([locatum, preposition, sheet_name, page_number, page.url, num_results, '', ''])
                 else:
-                    for item in page.items:
-                        row = [locatum, preposition, sheet_name, page_number, url, num_results, item.url, item.excerpt]
-                        df.loc[index] = row
-                        index += 1
+                    for link, excerpt in page.items:
+                        rows.append([locatum, preposition, sheet_name, page_number, page.url, num_results, link, excerpt])
             bar.next()
         bar.finish()
 
         export_file_path = os.path.join(self.cache_dir, 'export.xlsx')
-        with pd.ExcelWriter(export_file_path, mode='w') as writer:
-            df.to_excel(writer)
-
-        book = load_workbook(export_file_path)
-        ws = book.active
-        dims = {}
-        for row in ws.rows:
-            for cell in row:
-                if cell.value:
-                    dims[cell.column_letter] = max((dims.get(cell.column_letter, 0), len(str(cell.value))))
-        for col, value in dims.items():
-            ws.column_dimensions[col].width = value
-
-        book.save(export_file_path)
+        write_excel(export_file_path, {'Sheet1': pd.DataFrame(rows, columns=headings)})
 
     def handle(self, *args, **options):
         file = options['file']
@@ -380,6 +297,6 @@ class Command(BaseCommand):
 
         self.make_query()
 
-        # queries = self.parse_html()
-        # self.produce_report(queries)
+        # parsed_pages = self.parse_html()
+        # self.produce_report(parsed_pages)
         x = 0
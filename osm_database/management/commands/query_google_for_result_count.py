@@ -5,12 +5,12 @@ import urllib
 from logging import warning
 
 import pandas as pd
-from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
 from progress.bar import Bar
 from selenium import webdriver
 
 from osm_database.management.util.browser_wrapper import BrowserWrapper
+from osm_database.management.util.google_cache import ParsedPageTable, page_key, parse_page, read_cached_page
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
 script_name = os.path.split(__file__)[1][0:-3]
@@ -18,21 +18,14 @@ dir_parts = current_dir.split(os.path.sep)
 cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
 
 
-def get_result_stats(filename, body):
-    try:
-        result_stats = body.select('#result-stats')[0]
-        no_results_indicator = body.select('.HlosJb.bOkdDe')
-        if len(no_results_indicator) > 0:
-            return 0
-        nobrs = result_stats.select('nobr')
-        for nobr in nobrs:
-            nobr.decompose()
-        result_stats_text = result_stats.text
-
-        return int(''.join([s for s in result_stats_text if s.isdigit()]))
-    except:
-        print('Malform at file: {}'.format(filename))
-        return 'Not Found'
+def get_result_count(filename, result_count):
+    """
+    The result count command records 'Not Found' for any page whose result stats can't be read
+    """
+    if isinstance(result_count, int) and result_count >= 0:
+        return result_count
+    print('Malform at file: {}'.format(filename))
+    return 'Not Found'
 
 
 class Page:
@@ -57,12 +50,8 @@ class Page:
     def extract_count(self):
         if self.result_count == 'Not Found' or self.result_count is None:
             cache_file_path = os.path.join(self.cache_dir, '{}.html'.format(self.query.replace(' ', '_')))
-            with open(cache_file_path, 'r') as f:
-                response = f.read()
-
-            soup = BeautifulSoup(response, 'lxml')
-            body = soup.find('body')
-            self.result_count = get_result_stats(cache_file_path, body)
+            result_count, _, _ = parse_page(read_cached_page(cache_file_path))
+            self.result_count = get_result_count(cache_file_path, result_count)
         elif isinstance(self.result_count, str):
             self.result_count = int(self.result_count.replace(',', ''))
 
@@ -101,6 +90,8 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--file', action='store', dest='file', required=True, type=str)
         parser.add_argument('--auto', action='store_true', dest='automode', default=False)
+        parser.add_argument('--processes', action='store', dest='processes', default=None, type=int,
+                            help='Number of processes that parse the cached pages, default to the number of CPUs')
 
     def populate_locations_from_excel(self, file):
         xl = pd.ExcelFile(file, engine='openpyxl')
@@ -203,13 +194,22 @@ class Command(BaseCommand):
     #
     #     os.rename(self.query_result_cache_file_bak, self.query_result_cache_file)
 
-    def get_name_to_counts(self, pages, name_to_counts):
+    def get_name_to_counts(self, pages, name_to_counts, processes=None):
+        # Parse all the pages that are new or changed first, in a process pool
+        parsed_pages = ParsedPageTable(os.path.join(self.cache_dir, 'parsed_pages.pkl'))
+        parsed_pages.update(os.path.join(self.cache_dir, 'html'), processes)
+
         bar = Bar('Getting result count', max=len(pages))
         for location_name, page in pages.items():
             if page.query in name_to_counts:
                 bar.next()
                 continue
-            count = page.extract_count()
+            parsed = parsed_pages.get(page_key(page.query))
+            if parsed is None:
+                count = page.extract_count()
+            else:
+                page.result_count = get_result_count(page.query, parsed.result_count)
+                count = page.result_count
             name_to_counts[page.query] = count
             bar.next()
         bar.finish()
@@ -240,7 +240,7 @@ class Command(BaseCommand):
             if os.path.isfile('name_to_counts.pkl'):
                 with open('name_to_counts.pkl', 'rb') as f:
                     name_to_counts = pickle.load(f)
-            self.get_name_to_counts(pages, name_to_counts)
+            self.get_name_to_counts(pages, name_to_counts, options['processes'])
         except:
             with open('name_to_counts.pkl', 'wb') as f:
                 pickle.dump(name_to_counts, f)
@@ -2,6 +2,7 @@ import os
 import pickle
 import time
 
+import numpy as np
 import weka.core.jvm as jvm
 from django.core.management import BaseCommand
 from watchdog.events import FileSystemEventHandler
@@ -26,6 +27,7 @@ class Command(BaseCommand):
         self.input_dir = settings.WEKA_INPUT_DIR
         self.output_dir = settings.WEKA_OUTPUT_DIR
         self.weka_model = None
+        self.index_map = None
         self.feature_extractor = ExpressionFeatureExtraction()
 
     def process_input(self, input_file_path):
@@ -36,8 +38,8 @@ class Command(BaseCommand):
         with open(input_file_path, 'rb') as f:
             args = pickle.load(f)
 
-        embed = self.feature_extractor.embed(**args)
-        row = self.weka_model.convert_embed(embed)
+        vector = self.feature_extractor.embed_vector(**args)
+        row = self.weka_model.convert_vectors(vector[np.newaxis], self.index_map)[0]
         vicinity = self.weka_model.predict(row)
         os.remove(input_file_path)
         f = open(output_file_path, 'wb')
@@ -50,6 +52,7 @@ class Command(BaseCommand):
         try:
             jvm.start(system_cp=True, packages=True, max_heap_size="512m", system_info=True)
             self.weka_model = WekaModel('osm_database/weka_model/connors-1000.model')
+            self.index_map = self.weka_model.index_map(self.feature_extractor.columns)
             print('Listening for files in {}'.format(self.input_dir))
             while True:
                 files = os.listdir(self.input_dir)
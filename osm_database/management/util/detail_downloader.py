@@ -0,0 +1,296 @@
+import json
+import os
+import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from progress.bar import Bar
+from requests.adapters import HTTPAdapter
+
+from osm_database.management.util.json_shards import ShardWriter, is_shard, iter_shard
+
+url_template = 'https://nominatim.openstreetmap.org/details.php?osmtype={}&osmid={}&addressdetails=1&polygon_geojson=1&format=json'
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# A download that ended with one of these statuses is not retried in later runs
+FINAL_STATUSES = frozenset(['200', '400', '404', '410', '414'])
+
+
+def urls_for_id(osm_id, url_template=url_template):
+    """
+    :param osm_id: an id prefixed with its type (W, R or N), e.g. 'W1234'. Without prefix, all three types are tried
+    :return: list of URLs to try in order
+    """
+    osm_type = osm_id[0].lower()
+    if osm_type in ('w', 'r', 'n'):
+        return [url_template.format(osm_type.upper(), int(osm_id[1:]))]
+    osm_id = int(osm_id)
+    return [url_template.format('W', osm_id), url_template.format('R', osm_id), url_template.format('N', osm_id)]
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter on the number of requests started per second
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.interval == 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class DownloadManifest:
+    """
+    Append-only record of every download attempt, one tab-separated line per attempt:
+        osm_id, status, file the response was written to, offset in that file, length
+    The last line of an id wins. It replaces the per-id error marker files.
+    """
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    # A line that was cut short by a crash is ignored
+                    if len(parts) == 5:
+                        osm_id, status, file, offset, length = parts
+                        self.entries[osm_id] = (status, file, int(offset), int(length))
+        self.file = None if readonly else open(path, 'a')
+
+    def __contains__(self, osm_id):
+        return osm_id in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, osm_id):
+        return self.entries.get(osm_id, None)
+
+    def is_done(self, osm_id):
+        entry = self.entries.get(osm_id, None)
+        return entry is not None and entry[0] in FINAL_STATUSES
+
+    def record(self, osm_id, status, file, offset, length):
+        self.entries[osm_id] = (str(status), file, offset, length)
+        self.file.write('{}\t{}\t{}\t{}\t{}\n'.format(osm_id, status, file, offset, length))
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+class ResultWriter:
+    """
+    Writes each successful response as a compact line to gzip shards (see ShardWriter), or if `shards` is False to its
+    own pretty-printed `<osm_id>.json` in the results folder. Error responses are appended to a single errors.log
+    """
+
+    def __init__(self, results_dir, shards=True):
+        self.results_dir = results_dir
+        self.shard_writer = ShardWriter(results_dir) if shards else None
+        self.error_file = os.path.join(results_dir, 'errors.log')
+        self.error_fd = open(self.error_file, 'ab')
+
+    def write_success(self, osm_id, result):
+        if self.shard_writer is not None:
+            return self.shard_writer.write(result)
+
+        file_name = '{}.json'.format(osm_id)
+        content = json.dumps(result, indent=2, sort_keys=True)
+        with open(os.path.join(self.results_dir, file_name), 'w') as f:
+            f.write(content)
+        return file_name, 0, len(content)
+
+    def write_error(self, osm_id, content):
+        data = content.encode('utf-8') + b'\n'
+        offset = self.error_fd.tell()
+        self.error_fd.write(data)
+        self.error_fd.flush()
+        return os.path.basename(self.error_file), offset, len(data)
+
+    def close(self):
+        if self.shard_writer is not None:
+            self.shard_writer.close()
+        self.error_fd.close()
+
+
+class DetailDownloader:
+    """
+    Download Nominatim details for many OSM ids with a pooled HTTP session, `concurrency` requests in flight and at
+    most `requests_per_second` requests started per second. 429 and 5xx responses and connection errors are retried up
+    to `max_retries` times with exponential backoff (honouring Retry-After); retries go through the rate limiter like
+    any other request, so they count against requests_per_second. Progress is kept in a manifest, so an interrupted
+    run resumes where it stopped, and ids that ended with a transient error are tried again.
+    Responses are stored in gzip shards unless `shards` is False. Use iter_downloaded() to read them back.
+    `legacy_id_prefix` is the type prefix of the ids whose files were named by their bare number by the previous
+    downloaders, e.g. 'W' for the ways downloaded by import_osm, see adopt_existing_files().
+    """
+
+    def __init__(self, results_dir, concurrency=4, requests_per_second=1.0, max_retries=5, backoff_factor=1.0,
+                 timeout=60, url_template=url_template, shards=True, legacy_id_prefix=''):
+        self.results_dir = results_dir
+        self.legacy_id_prefix = legacy_id_prefix
+        pathlib.Path(results_dir).mkdir(parents=True, exist_ok=True)
+
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.timeout = timeout
+        self.url_template = url_template
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        manifest_path = os.path.join(results_dir, 'manifest.tsv')
+        is_new_manifest = not os.path.isfile(manifest_path)
+        self.manifest = DownloadManifest(manifest_path)
+        self.writer = ResultWriter(results_dir, shards)
+        if is_new_manifest:
+            self.adopt_existing_files()
+
+    def adopt_existing_files(self):
+        """
+        Record in the manifest what a previous version of the downloaders left in the results folder: one `<id>.json`
+        per success and an empty marker file `errors/<id>` per failure. They are recorded under the ids that will be
+        asked for: a bare number gets legacy_id_prefix.
+        """
+        adopted = 0
+        for file in os.listdir(self.results_dir):
+            if file.endswith('.json'):
+                self.manifest.record(self.legacy_id(file[:-5]), 200, file, 0,
+                                     os.path.getsize(os.path.join(self.results_dir, file)))
+                adopted += 1
+        errors_dir = os.path.join(self.results_dir, 'errors')
+        if os.path.isdir(errors_dir):
+            for file in os.listdir(errors_dir):
+                self.manifest.record(self.legacy_id(file), 404, '', 0, 0)
+                adopted += 1
+        if adopted > 0:
+            print('Recorded {} previous downloads in {}'.format(adopted, self.manifest.path))
+
+    def legacy_id(self, name):
+        if name.isdigit():
+            return self.legacy_id_prefix + name
+        return name
+
+    def get(self, url):
+        """
+        GET a URL, retrying 429 and 5xx responses and connection errors. Every attempt waits for the rate limiter.
+        :return: the response of the last attempt
+        :raises requests.RequestException: if the last attempt failed to connect or timed out
+        """
+        attempt = 0
+        while True:
+            self.rate_limiter.wait()
+            try:
+                r = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                retry_after = None
+            else:
+                if r.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return r
+                retry_after = r.headers.get('Retry-After', None)
+                retry_after = float(retry_after) if retry_after is not None and retry_after.isdigit() else None
+            time.sleep(retry_after if retry_after is not None else self.backoff_factor * (2 ** attempt))
+            attempt += 1
+
+    def fetch(self, osm_id):
+        """
+        :return: (status code, parsed json if successful otherwise the response text)
+        """
+        status_code = 'XXX'
+        result = None
+        for url in urls_for_id(osm_id, self.url_template):
+            r = self.get(url)
+            status_code = r.status_code
+            if status_code == 200:
+                return status_code, r.json()
+            result = r.content.decode('utf-8')
+        return status_code, result
+
+    def _save(self, osm_id, status_code, result):
+        if status_code == 200:
+            file, offset, length = self.writer.write_success(osm_id, result)
+        else:
+            file, offset, length = self.writer.write_error(osm_id, result)
+        self.manifest.record(osm_id, status_code, file, offset, length)
+
+    def download(self, osm_ids):
+        """
+        Download every id that is not yet done according to the manifest.
+        Responses are written from the calling thread only.
+        """
+        todo = [x for x in osm_ids if not self.manifest.is_done(x)]
+        print('{} ids to download, {} already done'.format(len(todo), len(osm_ids) - len(todo)))
+
+        bar = Bar('Querying from OSM', max=len(todo))
+        failed = 0
+        start_time = time.time()
+        chunk_size = self.concurrency * 64
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for i in range(0, len(todo), chunk_size):
+                futures = {executor.submit(self.fetch, osm_id): osm_id for osm_id in todo[i:i + chunk_size]}
+                for future in as_completed(futures):
+                    osm_id = futures[future]
+                    try:
+                        status_code, result = future.result()
+                    except (requests.RequestException, ValueError) as e:
+                        status_code, result = 'XXX', '{}: {}'.format(type(e).__name__, e)
+                    if status_code != 200:
+                        failed += 1
+                    self._save(osm_id, status_code, result)
+                    bar.next()
+        bar.finish()
+
+        elapsed = time.time() - start_time
+        print('Downloaded {} ids in {:.1f}s ({:.2f} ids/s), {} failed'
+              .format(len(todo), elapsed, len(todo) / elapsed if elapsed > 0 else 0, failed))
+
+    def close(self):
+        self.session.close()
+        self.manifest.close()
+        self.writer.close()
+
+
+def iter_downloaded(results_dir):
+    """
+    Read back every successful response recorded in the manifest of a results folder, whether it is in a shard or in
+    its own `<osm_id>.json` file. Each shard is streamed once from start to end.
+    :return: a generator of (osm_id, file name, response as bytes)
+    """
+    manifest = DownloadManifest(os.path.join(results_dir, 'manifest.tsv'), readonly=True)
+    offsets_by_file = {}
+    for osm_id, (status, file, offset, length) in manifest.entries.items():
+        if status == '200':
+            offsets_by_file.setdefault(file, {})[offset] = osm_id
+
+    for file, offsets in sorted(offsets_by_file.items()):
+        path = os.path.join(results_dir, file)
+        if is_shard(file):
+            for offset, line in iter_shard(path):
+                if offset in offsets:
+                    yield offsets[offset], file, line
+        else:
+            with open(path, 'rb') as f:
+                yield offsets[0], file, f.read()
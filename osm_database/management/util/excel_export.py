@@ -0,0 +1,73 @@
+"""
+Write DataFrames to a workbook in one pass with xlsxwriter, in constant memory mode (rows are flushed to disk as soon as
+they are written). The width of each column is computed from the data before it is written, as the length of its
+longest non-empty value, the same as sizing the columns by reading the cells back.
+"""
+
+import xlsxwriter
+
+
+def series_width(series, header):
+    """
+    :return: length of the longest value of the series or of the header, ignoring empty, zero and missing values
+    """
+    width = len(str(header)) if header else 0
+    truthy = series.notna() & series.astype(bool)
+    if truthy.any():
+        width = max(width, int(series[truthy].astype(str).str.len().max()))
+    return width
+
+
+def column_widths(df, index=True):
+    """
+    :return: list of widths of the columns as written by write_excel(), the index first if index is True
+    """
+    widths = []
+    if index:
+        widths.append(series_width(df.index.to_series(), df.index.name))
+    for column in df.columns:
+        widths.append(series_width(df[column], column))
+    return widths
+
+
+def cell_value(value):
+    # Missing values are written as blank cells, like DataFrame.to_excel() does
+    if value is None or value != value:
+        return None
+    return value
+
+
+def write_sheet(workbook, sheet_name, df, index, header_format):
+    worksheet = workbook.add_worksheet(sheet_name)
+    for col, width in enumerate(column_widths(df, index)):
+        if width > 0:
+            worksheet.set_column(col, col, width)
+
+    first_column = 1 if index else 0
+    if index and df.index.name is not None:
+        worksheet.write(0, 0, df.index.name, header_format)
+    for col, column in enumerate(df.columns, first_column):
+        worksheet.write(0, col, column, header_format)
+
+    for row, values in enumerate(df.itertuples(index=index, name=None), 1):
+        if index:
+            worksheet.write(row, 0, cell_value(values[0]), header_format)
+            values = values[1:]
+        for col, value in enumerate(values, first_column):
+            value = cell_value(value)
+            if value is not None:
+                worksheet.write(row, col, value)
+
+
+def write_excel(file_path, sheets, index=True):
+    """
+    :param sheets: dict of sheet name -> DataFrame, written in this order
+    :param index: whether to write the index of the DataFrames as the first column
+    """
+    workbook = xlsxwriter.Workbook(file_path, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    try:
+        for sheet_name, df in sheets.items():
+            write_sheet(workbook, sheet_name, df, index, header_format)
+    finally:
+        workbook.close()
@@ -0,0 +1,300 @@
+"""
+Offline parsing of the Google result pages cached by query_google_for_excerpts and query_google_for_result_count.
+
+Each cached page is parsed once with lxml, in a process pool, into a ParsedPage: the result count, the excerpts and the
+links to the next pages. The parsed pages are kept in a ParsedPageTable keyed by the path of the page file relative to
+the HTML cache (without extension), e.g. 'Royal_Opera_House_at_Trafalgar_Square/Page_2'. A page is only parsed again
+if its file changed.
+"""
+
+import hashlib
+import os
+import pickle
+import urllib.parse
+import zipfile
+from collections import OrderedDict, namedtuple
+from multiprocessing import Pool
+
+import lxml.html
+from lxml import etree
+from progress.bar import Bar
+
+# Result count of a page that has no result stats, as set by the original BeautifulSoup parsers
+NO_RESULT_STATS = -1
+
+ParsedPage = namedtuple('ParsedPage', ['stamp', 'digest', 'result_count', 'items', 'next_pages'])
+ExcerptPage = namedtuple('ExcerptPage', ['name', 'url', 'result_count', 'items'])
+
+
+class PageNotCachedException(Exception):
+    def __init__(self, key):
+        super().__init__('Page {} is not cached. Please query it first'.format(key))
+        self.key = key
+
+
+def has_class(name):
+    return "contains(concat(' ', normalize-space(@class), ' '), ' {} ')".format(name)
+
+
+find_result_stats = etree.XPath('//*[@id="result-stats"]')
+find_no_results_indicator = etree.XPath('//*[{} and {}]'.format(has_class('HlosJb'), has_class('bOkdDe')))
+find_result_stats_text = etree.XPath('.//text()[not(ancestor::nobr)]')
+find_navigations = etree.XPath('//div[@role="navigation"]')
+find_page_links = etree.XPath('.//table//td//a')
+find_searched_items = etree.XPath('//*[@id="search"]//div[{}]'.format(has_class('g')))
+find_item_link = etree.XPath('.//*[{}]//a'.format(has_class('yuRUbf')))
+find_item_excerpt = etree.XPath('.//*[{} or {}]'.format(has_class('aCOpRe'), has_class('IsZvec')))
+
+
+def escape_name(name):
+    return name.replace(' ', '_').replace('/', '_or_')
+
+
+def page_key(query, page_name=None):
+    """
+    :return: key of a page in the table. Pages of query_google_for_excerpts are in one folder per query, pages of
+             query_google_for_result_count are directly in the HTML cache.
+    """
+    if page_name is None:
+        return escape_name(query)
+    return escape_name(query) + '/' + escape_name(page_name)
+
+
+def first_page_url(query):
+    query_plus = urllib.parse.quote_plus(query)
+    return "https://google.com/search?q=\"{}\"&hl=en&num=100".format(query_plus)
+
+
+def read_cached_page(file_path):
+    if file_path.endswith('.zip'):
+        with zipfile.ZipFile(file_path, 'r') as zf:
+            return zf.read('content.html')
+    with open(file_path, 'rb') as f:
+        return f.read()
+
+
+def get_result_stats(root):
+    """
+    :return: the number of results, 0 if Google says there is none, NO_RESULT_STATS if the page has no result stats,
+             'Not Found' if they cannot be read
+    """
+    result_stats = find_result_stats(root)
+    if len(result_stats) == 0:
+        return NO_RESULT_STATS
+    if len(find_no_results_indicator(root)) > 0:
+        return 0
+    result_stats_text = ''.join(find_result_stats_text(result_stats[0]))
+
+    try:
+        return int(''.join([s for s in result_stats_text if s.isdigit()]))
+    except ValueError:
+        print('Unrecognised expression: {}'.format(result_stats_text))
+        return 'Not Found'
+
+
+def get_next_pages_links(root):
+    pages = []
+    navigations = find_navigations(root)
+    if len(navigations) == 0:
+        return pages
+    for a in find_page_links(navigations[-1]):
+        label = a.get('aria-label')
+        if label is not None:
+            url = 'https://google.com' + a.get('href')
+            pages.append((label, url))
+    return pages
+
+
+def get_searched_items(root):
+    """
+    :return: list of (link, excerpt), 'Not Found' for the parts that are missing
+    """
+    items = []
+    for g in find_searched_items(root):
+        links = find_item_link(g)
+        if len(links) == 0:
+            items.append(('Not Found', 'Not Found'))
+            continue
+        link = links[0].get('href')
+        excerpts = find_item_excerpt(g)
+        excerpt = excerpts[0].text_content() if len(excerpts) > 0 else 'Not Found'
+        items.append((link, excerpt))
+    return items
+
+
+def parse_page(content):
+    """
+    :param content: the HTML, bytes
+    :return: (result count, items, next pages). Items and next pages are only read if there are results.
+    """
+    try:
+        root = lxml.html.document_fromstring(content.decode('utf-8', errors='replace'))
+    except etree.ParserError:
+        return NO_RESULT_STATS, [], []
+
+    result_count = get_result_stats(root)
+    if isinstance(result_count, int) and result_count > 0:
+        return result_count, get_searched_items(root), get_next_pages_links(root)
+    return result_count, [], []
+
+
+def file_stamp(file_path):
+    stat = os.stat(file_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def parse_cached_page(args):
+    key, file_path = args
+    content = read_cached_page(file_path)
+    result_count, items, next_pages = parse_page(content)
+    digest = hashlib.sha1(content).hexdigest()
+    return key, ParsedPage(file_stamp(file_path), digest, result_count, items, next_pages)
+
+
+def list_cached_pages(html_dir):
+    """
+    :return: dict of key -> file path of all pages in the HTML cache. A page cached both as .html and .zip is read
+             from the .html file.
+    """
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(html_dir):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            stem, ext = os.path.splitext(filename)
+            if ext not in ('.html', '.zip'):
+                continue
+            key = os.path.relpath(os.path.join(dirpath, stem), html_dir).replace(os.path.sep, '/')
+            if ext == '.html' or key not in files:
+                files[key] = os.path.join(dirpath, filename)
+    return files
+
+
+class ParsedPageTable:
+    def __init__(self, path):
+        self.path = path
+        self.pages = {}
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                self.pages = pickle.load(f)
+
+    def get(self, key):
+        return self.pages.get(key, None)
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.pages, f)
+        os.replace(tmp_path, self.path)
+
+    def update(self, html_dir, processes=None):
+        """
+        Parse the pages in html_dir that are not in the table or whose file changed since they were parsed.
+        Pages whose file is gone are removed from the table.
+        """
+        files = list_cached_pages(html_dir)
+        for key in set(self.pages) - set(files):
+            del self.pages[key]
+
+        todo = []
+        for key, file_path in files.items():
+            parsed = self.pages.get(key, None)
+            if parsed is None or parsed.stamp != file_stamp(file_path):
+                todo.append((key, file_path))
+
+        print('{} cached pages, {} to parse'.format(len(files), len(todo)))
+        if len(todo) == 0:
+            return
+
+        bar = Bar('Parsing HTML', max=len(todo))
+        try:
+            with Pool(processes) as pool:
+                for key, parsed in pool.imap_unordered(parse_cached_page, todo, chunksize=8):
+                    self.pages[key] = parsed
+                    bar.next()
+        finally:
+            bar.finish()
+            self.save()
+
+    def query_pages(self, query, max_pages=100):
+        """
+        Follow the links to the next pages from the first page of a query, the same way QueryResult does.
+        Raises PageNotCachedException if the first page, or a page it leads to within max_pages, is not cached.
+        :return: list of ExcerptPage in the order they were found. Pages that are linked past max_pages have no result
+                 and no item.
+        """
+        pages = OrderedDict([('Page 1', ExcerptPage('Page 1', first_page_url(query), 0, []))])
+        to_parse = ['Page 1']
+        num_pages_parsed = 0
+        while len(to_parse) > 0 and num_pages_parsed < max_pages:
+            page_name = to_parse.pop(0)
+            num_pages_parsed += 1
+            key = page_key(query, page_name)
+            parsed = self.get(key)
+            if parsed is None:
+                raise PageNotCachedException(key)
+
+            pages[page_name] = pages[page_name]._replace(result_count=parsed.result_count, items=parsed.items)
+            for next_page_name, next_page_url in parsed.next_pages:
+                if next_page_name not in pages:
+                    pages[next_page_name] = ExcerptPage(next_page_name, next_page_url, 0, [])
+                    to_parse.append(next_page_name)
+        return list(pages.values())
+
+    def folder_digests(self):
+        """
+        :return: dict of query folder -> hash of the content of all its cached pages. The folder of a query is
+                 page_key(query).
+        """
+        hashes = {}
+        for key in sorted(self.pages):
+            folder, _, page_name = key.rpartition('/')
+            if folder == '':
+                continue
+            if folder not in hashes:
+                hashes[folder] = hashlib.sha1()
+            hashes[folder].update('{}:{}\n'.format(page_name, self.pages[key].digest).encode('utf-8'))
+        return {folder: h.hexdigest() for folder, h in hashes.items()}
+
+
+class ReportCache:
+    """
+    Report rows of each expression, kept with the digest of the pages they were built from so that they are only
+    built again when these pages change. Also keeps the signature of each report file written, so that a report is not
+    written again when none of its expressions changed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.expressions = {}
+        self.reports = {}
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                cache = pickle.load(f)
+                self.expressions = cache['expressions']
+                self.reports = cache['reports']
+        self.num_built = 0
+
+    def get(self, expression, digest, build):
+        """
+        :param build: function that returns the rows of the expression
+        :return: the rows, from the cache if the digest is unchanged
+        """
+        entry = self.expressions.get(expression, None)
+        if entry is not None and entry[0] == digest:
+            return entry[1]
+        rows = build()
+        self.expressions[expression] = (digest, rows)
+        self.num_built += 1
+        return rows
+
+    def is_up_to_date(self, report_file, signature):
+        return os.path.isfile(report_file) and self.reports.get(report_file, None) == signature
+
+    def set_report_signature(self, report_file, signature):
+        self.reports[report_file] = signature
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'expressions': self.expressions, 'reports': self.reports}, f)
+        os.replace(tmp_path, self.path)
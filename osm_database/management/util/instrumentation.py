@@ -0,0 +1,190 @@
+"""
+Measure the stages of a management command: wall time, CPU time (including the child processes that finished during
+the stage, e.g. the workers of a Pool), peak RSS, number and total time of the SQL queries and number of items
+processed.
+
+    with instrument('import_json', options['stats_file']):
+        with stage('process files') as s:
+            for filename in files:
+                ...
+                s.add()
+
+stage() can also decorate a function or method; the function then calls current_stage().add() to count items.
+Outside of instrument(), stages measure nothing.
+
+Each stage is written as a JSON line to the stats file, if any, when it ends. A summary of the stages, grouped by name,
+is printed when instrument() exits.
+"""
+
+import json
+import os
+import sys
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import connection
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+_instrumentation = None
+
+
+def add_stats_argument(parser):
+    parser.add_argument('--stats-file', action='store', dest='stats_file', default=None, type=str,
+                        help='File to append the measurements of each stage to, as JSON lines')
+
+
+def cpu_time():
+    t = os.times()
+    return time.process_time() + t.children_user + t.children_system
+
+
+def peak_rss_mb():
+    """
+    :return: the highest RSS of the process so far in MB, None where the resource module is missing (Windows)
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == 'darwin':
+        return max_rss / 1024 / 1024
+    return max_rss / 1024
+
+
+class Stage:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.queries = 0
+        self.query_time = 0.
+        self.wall_time = 0.
+        self.cpu_time = 0.
+        self.peak_rss = None
+
+    def add(self, count=1):
+        self.items += count
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Count the query, as a wrapper given to connection.execute_wrapper()
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+    def to_dict(self):
+        return OrderedDict([('stage', self.name), ('wall_time', self.wall_time), ('cpu_time', self.cpu_time),
+                            ('peak_rss_mb', self.peak_rss), ('queries', self.queries),
+                            ('query_time', self.query_time), ('items', self.items)])
+
+
+class Instrumentation:
+    def __init__(self, command_name, stats_file=None):
+        self.command_name = command_name
+        self.stats_file = stats_file
+        self.stages = []
+        self.active = []
+
+    def write(self, stage):
+        if self.stats_file is None:
+            return
+        record = OrderedDict([('command', self.command_name), ('time', time.time())])
+        record.update(stage.to_dict())
+        with open(self.stats_file, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def summary(self):
+        """
+        :return: the stages grouped by name in the order they first started, as (name, number of runs, Stage of totals)
+        """
+        totals = OrderedDict()
+        for s in self.stages:
+            if s.name not in totals:
+                totals[s.name] = [0, Stage(s.name)]
+            total = totals[s.name]
+            total[0] += 1
+            total[1].wall_time += s.wall_time
+            total[1].cpu_time += s.cpu_time
+            total[1].queries += s.queries
+            total[1].query_time += s.query_time
+            total[1].items += s.items
+            if s.peak_rss is not None:
+                total[1].peak_rss = max(total[1].peak_rss or 0, s.peak_rss)
+        return [(name, runs, total) for name, (runs, total) in totals.items()]
+
+    def print_summary(self, file=sys.stdout):
+        headers = ['Stage', 'Runs', 'Wall (s)', 'CPU (s)', 'Peak RSS (MB)', 'Queries', 'SQL (s)', 'Items', 'Items/s']
+        rows = []
+        for name, runs, total in self.summary():
+            rate = total.items / total.wall_time if total.items and total.wall_time > 0 else None
+            rows.append([name, str(runs), '{:.3f}'.format(total.wall_time), '{:.3f}'.format(total.cpu_time),
+                         '-' if total.peak_rss is None else '{:.1f}'.format(total.peak_rss), str(total.queries),
+                         '{:.3f}'.format(total.query_time), str(total.items),
+                         '-' if rate is None else '{:.1f}'.format(rate)])
+
+        widths = [max(len(row[i]) for row in [headers] + rows) for i in range(len(headers))]
+        lines = ['{} stages'.format(self.command_name)]
+        for row in [headers] + rows:
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+            lines.append('  '.join(cells))
+        lines.insert(2, '  '.join('-' * width for width in widths))
+        print('\n'.join(lines), file=file)
+
+
+@contextmanager
+def instrument(command_name, stats_file=None):
+    """
+    Measure the stages run inside, and print their summary at the end, even if the command fails
+    """
+    global _instrumentation
+    previous = _instrumentation
+    _instrumentation = Instrumentation(command_name, stats_file)
+    try:
+        yield _instrumentation
+    finally:
+        _instrumentation.print_summary()
+        _instrumentation = previous
+
+
+@contextmanager
+def stage(name):
+    """
+    Measure a stage of the current instrumentation. Stages can be nested, the time and queries of a nested stage are
+    then counted in both stages, its items only in the nested one.
+    """
+    s = Stage(name)
+    instrumentation = _instrumentation
+    if instrumentation is None:
+        yield s
+        return
+
+    instrumentation.active.append(s)
+    instrumentation.stages.append(s)
+    start_wall = time.perf_counter()
+    start_cpu = cpu_time()
+    try:
+        with connection.execute_wrapper(s):
+            yield s
+    finally:
+        s.wall_time = time.perf_counter() - start_wall
+        s.cpu_time = cpu_time() - start_cpu
+        s.peak_rss = peak_rss_mb()
+        instrumentation.active.remove(s)
+        instrumentation.write(s)
+
+
+def current_stage():
+    """
+    :return: the innermost stage running, or a Stage that is not recorded if there is none
+    """
+    if _instrumentation is None or len(_instrumentation.active) == 0:
+        return Stage(None)
+    return _instrumentation.active[-1]
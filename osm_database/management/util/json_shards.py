@@ -0,0 +1,102 @@
+import gzip
+import json
+import os
+import re
+
+shard_name_template = '{}-{:05d}.jsonl.gz'
+shard_name_regex = re.compile(r'^(.+)-(\d{5})\.jsonl\.gz$')
+
+
+def is_shard(file_name):
+    return shard_name_regex.match(file_name) is not None
+
+
+class ShardWriter:
+    """
+    Append JSON documents as compact lines to gzip shard files `<prefix>-00000.jsonl.gz`, `<prefix>-00001.jsonl.gz`...
+    A shard is closed once its compressed size reaches `max_shard_size` and the next one is started. Each writer starts a
+    new shard instead of appending to an existing one.
+
+    The stream is flushed after every line, so a crash loses at most the line being written and every line that was
+    returned from write() can be read back.
+    """
+
+    def __init__(self, directory, prefix='details', max_shard_size=64 * 1024 * 1024, compress_level=6):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_shard_size = max_shard_size
+        self.compress_level = compress_level
+
+        numbers = [int(m.group(2)) for m in map(shard_name_regex.match, os.listdir(directory))
+                   if m is not None and m.group(1) == prefix]
+        self.next_number = max(numbers) + 1 if numbers else 0
+
+        self.shard_name = None
+        self.raw_fd = None
+        self.gzip_fd = None
+        self.offset = 0
+
+    def _open_next_shard(self):
+        self.shard_name = shard_name_template.format(self.prefix, self.next_number)
+        self.next_number += 1
+        self.raw_fd = open(os.path.join(self.directory, self.shard_name), 'xb')
+        self.gzip_fd = gzip.GzipFile(filename='', mode='wb', compresslevel=self.compress_level, fileobj=self.raw_fd,
+                                     mtime=0)
+        self.offset = 0
+
+    def _close_shard(self):
+        self.gzip_fd.close()
+        self.raw_fd.close()
+        self.gzip_fd = None
+        self.raw_fd = None
+
+    def write(self, document):
+        """
+        :param document: anything json.dumps accepts
+        :return: (shard file name, offset of the line in the uncompressed shard, length of the line in bytes)
+        """
+        if self.gzip_fd is None:
+            self._open_next_shard()
+
+        data = json.dumps(document, separators=(',', ':'), sort_keys=True, ensure_ascii=False).encode('utf-8') + b'\n'
+        offset = self.offset
+        self.gzip_fd.write(data)
+        self.gzip_fd.flush()
+        self.offset += len(data)
+        shard_name = self.shard_name
+
+        if self.raw_fd.tell() >= self.max_shard_size:
+            self._close_shard()
+        return shard_name, offset, len(data)
+
+    def close(self):
+        if self.gzip_fd is not None:
+            self._close_shard()
+
+
+def iter_shard(path):
+    """
+    Stream the lines of a shard without parsing them. A shard left unfinished by a crash is read up to its last
+    complete line.
+    :return: a generator of (offset, line as bytes)
+    """
+    offset = 0
+    with gzip.open(path, 'rb') as f:
+        try:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                yield offset, line
+                offset += len(line)
+        except EOFError:
+            pass
+
+
+def read_from_shard(path, offset, length):
+    """
+    Read one line of a shard. The shard is decompressed up to `offset`, so prefer iter_shard() to read many lines.
+    :return: the line as bytes
+    """
+    with gzip.open(path, 'rb') as f:
+        f.seek(offset)
+        return f.read(length)
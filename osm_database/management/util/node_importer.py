@@ -0,0 +1,125 @@
+import sys
+
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+
+from osm_database.models import Node, Tag, TagName, TagValue
+
+
+def bulk_create_and_get_ids(model, objs, key_of_obj, key_fields, batch_size):
+    """
+    Bulk insert objs and return a dict key -> id of the inserted rows.
+    If the backend cannot return ids from a bulk insert (e.g. MySQL), the new rows are read back by their id being
+    greater than the max id before the insert. This requires that nobody else inserts into the table at the same time.
+
+    :param model: the Model class
+    :param objs: unsaved model instances
+    :param key_of_obj: function(obj) -> key
+    :param key_fields: the fields to read back, such that the row (excluding id) equals key_of_obj()
+    :param batch_size: number of rows per INSERT
+    :return: dict key -> id
+    """
+    if len(objs) == 0:
+        return {}
+
+    with transaction.atomic():
+        max_id_before = model.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+        model.objects.bulk_create(objs, batch_size=batch_size)
+
+        # The feature was renamed can_return_rows_from_bulk_insert in Django 3.0
+        if getattr(connection.features, 'can_return_rows_from_bulk_insert',
+                   getattr(connection.features, 'can_return_ids_from_bulk_insert', False)):
+            return {key_of_obj(obj): obj.id for obj in objs}
+
+        ids = {}
+        for row in model.objects.filter(id__gt=max_id_before).values_list('id', *key_fields).iterator():
+            key = row[1] if len(key_fields) == 1 else row[1:]
+            ids[key] = row[0]
+        return ids
+
+
+class NodeImporter:
+    """
+    Import OSM nodes and their tags in bulk.
+
+    Ids of existing tag names, tag values, tags and nodes are loaded once. New nodes are buffered; every `batch_size`
+    nodes, the tag names, values and (name, value) pairs not seen before are bulk-inserted, then the nodes, then the
+    rows of the Node.tags through-table. Tag keys and values are interned so that repeated strings share memory.
+    Nodes that already exist are skipped.
+    """
+
+    def __init__(self, batch_size=10000):
+        self.batch_size = batch_size
+        self.tag_name_ids = {sys.intern(name): id for id, name in TagName.objects.values_list('id', 'name')}
+        self.tag_value_ids = {}
+        for id, value in TagValue.objects.values_list('id', 'value'):
+            self.tag_value_ids.setdefault(sys.intern(value), id)
+        self.tag_ids = {(k_id, v_id): id for id, k_id, v_id in Tag.objects.values_list('id', 'k_id', 'v_id')}
+        self.existing_node_ids = set(Node.objects.values_list('osm_id', flat=True))
+        self.pending = {}
+        self.imported_count = 0
+
+    def add(self, osm_node):
+        """
+        :param osm_node: an object with id, lat, lon and tags (dict), e.g. an OsmNode from osm_reader
+        """
+        if osm_node.id in self.existing_node_ids or osm_node.id in self.pending:
+            return
+        tags = [(sys.intern(k), sys.intern(v)) for k, v in osm_node.tags.items()]
+        self.pending[osm_node.id] = (osm_node.lat, osm_node.lon, tags)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def _save_tag_names(self):
+        # In the order they are first seen, so that of the names differing only in case, the first one is stored
+        new_names = list(dict.fromkeys(k for _, _, tags in self.pending.values() for k, _ in tags
+                                       if k not in self.tag_name_ids))
+        objs = [TagName(name=name) for name in new_names]
+        try:
+            ids = bulk_create_and_get_ids(TagName, objs, lambda x: x.name, ['name'], self.batch_size)
+        except IntegrityError:
+            # The database compares names without case (MySQL's default collation), so a name that differs only in
+            # case from an existing or another new name is the same row. get_or_create finds that row
+            ids = {name: TagName.objects.get_or_create(name=name)[0].id for name in new_names}
+        self.tag_name_ids.update(ids)
+
+    def _save_tag_values(self):
+        new_values = {v for _, _, tags in self.pending.values() for _, v in tags if v not in self.tag_value_ids}
+        objs = [TagValue(value=value) for value in new_values]
+        self.tag_value_ids.update(bulk_create_and_get_ids(TagValue, objs, lambda x: x.value, ['value'],
+                                                          self.batch_size))
+
+    def _save_tags(self):
+        new_tags = set()
+        for _, _, tags in self.pending.values():
+            for k, v in tags:
+                key = (self.tag_name_ids[k], self.tag_value_ids[v])
+                if key not in self.tag_ids:
+                    new_tags.add(key)
+        objs = [Tag(k_id=k_id, v_id=v_id) for k_id, v_id in new_tags]
+        self.tag_ids.update(bulk_create_and_get_ids(Tag, objs, lambda x: (x.k_id, x.v_id), ['k_id', 'v_id'],
+                                                    self.batch_size))
+
+    def flush(self):
+        if len(self.pending) == 0:
+            return
+
+        NodeTag = Node.tags.through
+        with transaction.atomic():
+            self._save_tag_names()
+            self._save_tag_values()
+            self._save_tags()
+
+            nodes = []
+            node_tags = []
+            for node_id, (lat, lon, tags) in self.pending.items():
+                nodes.append(Node(osm_id=node_id, lat=lat, lon=lon))
+                tag_ids = {self.tag_ids[(self.tag_name_ids[k], self.tag_value_ids[v])] for k, v in tags}
+                node_tags.extend(NodeTag(node_id=node_id, tag_id=tag_id) for tag_id in tag_ids)
+
+            Node.objects.bulk_create(nodes, batch_size=self.batch_size)
+            NodeTag.objects.bulk_create(node_tags, batch_size=self.batch_size)
+
+        self.existing_node_ids.update(self.pending.keys())
+        self.imported_count += len(self.pending)
+        self.pending = {}
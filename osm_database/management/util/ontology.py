@@ -0,0 +1,138 @@
+import os
+import pickle
+
+import numpy as np
+
+NOT_AN_ANCESTOR = 0
+
+
+class Ontology:
+    """
+    A compiled, read-only form of the feature graph built by import_owl, saved as a compressed .npz
+
+    Features are numbered 0..n-1 in the order of `names`. The parents of feature i are
+    parent_indices[parent_indptr[i]:parent_indptr[i + 1]]. The transitive closure is kept as an n x n uint8 matrix:
+    ranks[i, j] is the distance from i up to its ancestor j (1 for a direct parent), 0 if j is not an ancestor of i.
+    Ancestry of any set of features is then a row-wise min over this matrix instead of a walk over Feature objects.
+
+    The walk up from a feature stops at a feature whose only parent is the root (Thing), and a feature is never its own
+    ancestor. When an ancestor is reachable by several paths, its rank is the shortest one.
+    """
+
+    def __init__(self, names, parent_indptr, parent_indices, ranks):
+        self.names = list(names)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.parent_indptr = parent_indptr
+        self.parent_indices = parent_indices
+        self.ranks = ranks
+
+    def __len__(self):
+        return len(self.names)
+
+    @classmethod
+    def from_feature_dict(cls, feature_dict, root_name='Thing'):
+        """
+        :param feature_dict: dict(name={name: import_owl.Feature}, url=...) as pickled by import_owl
+        """
+        features = feature_dict['name']
+        names = list(features.keys())
+        ids = {name: i for i, name in enumerate(names)}
+        parents = [sorted(ids[p.name] for p in features[name].parent if p.name in ids) for name in names]
+        return cls.from_parents(names, parents, ids.get(root_name, None))
+
+    @classmethod
+    def from_parents(cls, names, parents, root_id):
+        """
+        :param names: list of feature names
+        :param parents: list of list of parent ids, one per feature
+        :param root_id: id of the root feature, or None
+        """
+        n = len(names)
+        parent_indptr = np.zeros(n + 1, dtype=np.int32)
+        parent_indptr[1:] = np.cumsum([len(x) for x in parents])
+        parent_indices = np.array([p for x in parents for p in x], dtype=np.int32)
+
+        # The parents that the walk goes up to from each feature
+        walk_parents = []
+        for i, feature_parents in enumerate(parents):
+            if root_id is not None and feature_parents == [root_id]:
+                walk_parents.append([])
+            else:
+                walk_parents.append([p for p in feature_parents if p != i])
+
+        ranks = np.zeros((n, n), dtype=np.uint8)
+        for i in range(n):
+            row = ranks[i]
+            frontier = walk_parents[i]
+            rank = 1
+            while frontier:
+                next_frontier = []
+                for p in frontier:
+                    if p != i and row[p] == NOT_AN_ANCESTOR:
+                        row[p] = rank
+                        next_frontier.extend(walk_parents[p])
+                frontier = next_frontier
+                rank += 1
+        return cls(names, parent_indptr, parent_indices, ranks)
+
+    def save(self, path):
+        np.savez_compressed(path, names=np.array(self.names, dtype=str), parent_indptr=self.parent_indptr,
+                            parent_indices=self.parent_indices, ranks=self.ranks)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['names'].tolist(), data['parent_indptr'], data['parent_indices'], data['ranks'])
+
+    def parents_of(self, feature_id):
+        return self.parent_indices[self.parent_indptr[feature_id]:self.parent_indptr[feature_id + 1]]
+
+    def ancestor_ranks(self, feature_ids):
+        """
+        Ancestors of several sets of features at once.
+        :param feature_ids: (m, k) int array, each row a set of up to k feature ids padded with -1
+        :return: (m, n) uint8 array of the lowest rank of each ancestor among the features of the row, 0 if none
+        """
+        feature_ids = np.asarray(feature_ids, dtype=np.int64).reshape(len(feature_ids), -1)
+        result = np.zeros((feature_ids.shape[0], len(self.names)), dtype=np.uint8)
+        for column in feature_ids.T:
+            present = column >= 0
+            ranks = self.ranks[column[present]]
+            current = result[present]
+            # 0 means "not an ancestor" so it must not win the minimum
+            take = (ranks != NOT_AN_ANCESTOR) & ((current == NOT_AN_ANCESTOR) | (ranks < current))
+            result[present] = np.where(take, ranks, current)
+        return result
+
+    def prune_mutually_exclusive(self, ranks, groups):
+        """
+        Within each group of mutually exclusive features, keep only the ones with the lowest rank in each row.
+        :param ranks: (m, n) array as returned by ancestor_ranks(), modified in place
+        :param groups: list of lists of feature ids
+        """
+        for group in groups:
+            group = np.asarray(group, dtype=np.int64)
+            group_ranks = ranks[:, group].astype(np.int32)
+            group_ranks[group_ranks == NOT_AN_ANCESTOR] = np.iinfo(np.int32).max
+            lowest = group_ranks.min(axis=1, keepdims=True)
+            ranks[:, group] = np.where(group_ranks > lowest, NOT_AN_ANCESTOR, ranks[:, group])
+        return ranks
+
+
+def load_ontology(compiled_file, feature_dict_file='feature_dict.pkl', root_name='Thing'):
+    """
+    Load the compiled ontology written by import_owl. A feature dict pickled by an older import_owl is compiled
+    instead if there is no compiled ontology or if the pickle is newer.
+    """
+    has_compiled = os.path.isfile(compiled_file)
+    has_pickle = os.path.isfile(feature_dict_file)
+    if has_compiled and (not has_pickle or os.path.getmtime(compiled_file) >= os.path.getmtime(feature_dict_file)):
+        return Ontology.load(compiled_file)
+    if not has_pickle:
+        raise Exception('Ontology {} not found, run import_owl first'.format(compiled_file))
+
+    with open(feature_dict_file, 'rb') as f:
+        feature_dict = pickle.load(f)
+    ontology = Ontology.from_feature_dict(feature_dict, root_name)
+    ontology.save(compiled_file)
+    return ontology
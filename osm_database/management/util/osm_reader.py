@@ -0,0 +1,67 @@
+from collections import namedtuple
+from decimal import Decimal
+
+from lxml import etree
+
+OsmNode = namedtuple('OsmNode', ['id', 'lat', 'lon', 'tags'])
+OsmWay = namedtuple('OsmWay', ['id', 'node_ids', 'tags'])
+OsmRelation = namedtuple('OsmRelation', ['id', 'members', 'tags'])
+OsmMember = namedtuple('OsmMember', ['type', 'ref', 'role'])
+
+
+def _read_tags(element):
+    return {tag.get('k'): tag.get('v') for tag in element.iterchildren('tag')}
+
+
+def _make_node(element, with_details):
+    node_id = int(element.get('id'))
+    if not with_details:
+        return OsmNode(node_id, None, None, None)
+    return OsmNode(node_id, Decimal(element.get('lat')), Decimal(element.get('lon')), _read_tags(element))
+
+
+def _make_way(element, with_details):
+    way_id = int(element.get('id'))
+    if not with_details:
+        return OsmWay(way_id, None, None)
+    node_ids = [int(nd.get('ref')) for nd in element.iterchildren('nd')]
+    return OsmWay(way_id, node_ids, _read_tags(element))
+
+
+def _make_relation(element, with_details):
+    relation_id = int(element.get('id'))
+    if not with_details:
+        return OsmRelation(relation_id, None, None)
+    members = [OsmMember(member.get('type'), int(member.get('ref')), member.get('role'))
+               for member in element.iterchildren('member')]
+    return OsmRelation(relation_id, members, _read_tags(element))
+
+
+record_makers = {
+    'node': _make_node,
+    'way': _make_way,
+    'relation': _make_relation,
+}
+
+
+def iter_osm(filepath, kinds=('node', 'way', 'relation'), with_details=True):
+    """
+    Stream the elements of an .osm XML file. Each element is discarded as soon as its record is made, so memory use
+    does not grow with the size of the file.
+
+    :param filepath: path to the .osm file
+    :param kinds: which of 'node', 'way', 'relation' to yield
+    :param with_details: if False, only the ids are read (coordinates, node refs, members and tags are None)
+    :return: a generator of OsmNode, OsmWay and OsmRelation
+    """
+    # Every element is parsed and freed, including those of the kinds not asked for: elements skipped by iterparse's
+    # tag filter would never be cleared and would pile up under the root
+    for event, element in etree.iterparse(filepath, events=('end',), tag=tuple(record_makers)):
+        if element.tag in kinds:
+            yield record_makers[element.tag](element, with_details)
+
+        # Free the element and every sibling before it, which have all been processed already
+        element.clear()
+        parent = element.getparent()
+        while element.getprevious() is not None:
+            del parent[0]
@@ -0,0 +1,236 @@
+"""
+Move the tables of an app between databases without going through Django's serializers, which build the whole fixture
+in memory.
+
+Each table is read in pages of `chunk_rows` rows ordered by primary key, each page starting after the last key of the
+previous one, so no backend has to hold a whole table in a result set. Each page is written to a gzip chunk file
+`<table>-00000.pkl.gz`, `<table>-00001.pkl.gz`... as a pickled list of row tuples in the order of the table's columns.
+A manifest `tables.json` lists the tables in the order they must be loaded (tables referenced by a foreign key first),
+with their columns and chunk files. Loading reads one chunk at a time and inserts it with COPY on Postgres and
+executemany() elsewhere, so memory use only depends on the chunk size.
+
+Values are the raw values of the database driver, so a dump is meant to be loaded into the same database engine.
+"""
+
+import gzip
+import io
+import json
+import os
+import pickle
+import re
+
+from django.apps import apps
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from progress.bar import Bar
+
+manifest_name = 'tables.json'
+chunk_name_template = '{}-{:05d}.pkl.gz'
+chunk_name_regex = re.compile(r'^(.+)-(\d{5})\.pkl\.gz$')
+
+
+def get_models(labels):
+    """
+    :param labels: list of app labels or app_label.ModelName, like dumpdata takes
+    :return: the concrete models of these labels and the auto-created through models of their many-to-many fields,
+             sorted so that every model comes after the models its foreign keys point to
+    """
+    models = []
+    for label in labels:
+        if '.' in label:
+            model_list = [apps.get_model(label)]
+        else:
+            model_list = apps.get_app_config(label).get_models()
+        for model in model_list:
+            if model._meta.proxy or not model._meta.managed:
+                continue
+            for m in [model] + [f.remote_field.through for f in model._meta.local_many_to_many]:
+                if m._meta.auto_created and m._meta.auto_created is not model:
+                    continue
+                if m not in models:
+                    models.append(m)
+
+    return sort_models(models)
+
+
+def sort_models(models):
+    """
+    :return: the models sorted so that every model comes after the models its foreign keys point to, among the given
+             ones. Otherwise the order is kept.
+    """
+    remaining = list(models)
+    ordered = []
+    while len(remaining) > 0:
+        for model in remaining:
+            dependencies = [f.related_model for f in model._meta.concrete_fields if f.is_relation]
+            if all(d in ordered or d not in remaining or d is model for d in dependencies):
+                break
+        else:
+            raise Exception('Circular foreign keys between {}'.format(', '.join(m._meta.label for m in remaining)))
+        remaining.remove(model)
+        ordered.append(model)
+    return ordered
+
+
+def get_columns(model):
+    return [f.column for f in model._meta.concrete_fields]
+
+
+def select_sql(model, after_key, limit):
+    """
+    :return: SQL of the page of `limit` rows of the table whose key is greater than after_key, from the first row if
+             after_key is False
+    """
+    qn = connection.ops.quote_name
+    columns = ', '.join(qn(c) for c in get_columns(model))
+    pk = qn(model._meta.pk.column)
+    where = '' if after_key is False else ' WHERE {} > %s'.format(pk)
+    return 'SELECT {} FROM {}{} ORDER BY {} LIMIT {:d}'.format(columns, qn(model._meta.db_table), where, pk, limit)
+
+
+def insert_sql(model):
+    qn = connection.ops.quote_name
+    columns = get_columns(model)
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(qn(model._meta.db_table), ', '.join(qn(c) for c in columns),
+                                                    ', '.join(['%s'] * len(columns)))
+
+
+def count_rows(model):
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT COUNT(*) FROM {}'.format(connection.ops.quote_name(model._meta.db_table)))
+        return cursor.fetchone()[0]
+
+
+def write_chunk(file_path, rows, compress_level):
+    with gzip.open(file_path, 'wb', compresslevel=compress_level) as f:
+        pickle.dump(rows, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def read_chunk(file_path):
+    with gzip.open(file_path, 'rb') as f:
+        return pickle.load(f)
+
+
+def dump_table(model, directory, chunk_rows, compress_level, bar):
+    """
+    :return: the entry of the table in the manifest
+    """
+    table = model._meta.db_table
+    for file_name in os.listdir(directory):
+        match = chunk_name_regex.match(file_name)
+        if match is not None and match.group(1) == table:
+            os.remove(os.path.join(directory, file_name))
+
+    pk_index = get_columns(model).index(model._meta.pk.column)
+    chunks = []
+    num_rows = 0
+    last_key = False
+    with connection.cursor() as cursor:
+        while True:
+            if last_key is False:
+                cursor.execute(select_sql(model, last_key, chunk_rows))
+            else:
+                cursor.execute(select_sql(model, last_key, chunk_rows), [last_key])
+            rows = [tuple(row) for row in cursor.fetchall()]
+            if len(rows) == 0:
+                break
+            chunk_name = chunk_name_template.format(table, len(chunks))
+            write_chunk(os.path.join(directory, chunk_name), rows, compress_level)
+            chunks.append(chunk_name)
+            num_rows += len(rows)
+            last_key = rows[-1][pk_index]
+            bar.next(len(rows))
+
+    return {'model': model._meta.label, 'table': table, 'columns': get_columns(model), 'rows': num_rows,
+            'chunks': chunks}
+
+
+def dump_tables(labels, directory, chunk_rows=100000, compress_level=6):
+    """
+    Dump the tables of the models of labels (see get_models()) to directory
+    """
+    os.makedirs(directory, exist_ok=True)
+    models = get_models(labels)
+
+    bar = Bar('Dumping {} tables'.format(len(models)), max=sum(count_rows(m) for m in models))
+    tables = []
+    for model in models:
+        tables.append(dump_table(model, directory, chunk_rows, compress_level, bar))
+    bar.finish()
+
+    manifest_path = os.path.join(directory, manifest_name)
+    with open(manifest_path + '.tmp', 'w') as f:
+        json.dump({'vendor': connection.vendor, 'tables': tables}, f, indent=2)
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return tables
+
+
+def copy_value(value):
+    """
+    :return: the value in the text format of Postgres' COPY
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, bytes):
+        value = '\\x' + value.hex()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, model, rows):
+    qn = connection.ops.quote_name
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    columns = ', '.join(qn(c) for c in get_columns(model))
+    cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(qn(model._meta.db_table), columns), buffer)
+
+
+def load_table(model, entry, directory, bar):
+    if entry['columns'] != get_columns(model):
+        raise Exception('Columns of {} in the dump are {}, but the table has {}. Apply the same migrations first'
+                        .format(entry['table'], entry['columns'], get_columns(model)))
+    if count_rows(model) > 0:
+        raise Exception('Table {} is not empty'.format(entry['table']))
+
+    sql = insert_sql(model)
+    for chunk_name in entry['chunks']:
+        rows = read_chunk(os.path.join(directory, chunk_name))
+        with transaction.atomic(), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                copy_rows(cursor, model, rows)
+            else:
+                cursor.executemany(sql, rows)
+        bar.next(len(rows))
+
+
+def load_tables(directory):
+    """
+    Load the tables dumped by dump_tables() into the database, which must have the same tables, empty.
+    """
+    manifest_path = os.path.join(directory, manifest_name)
+    if not os.path.isfile(manifest_path):
+        raise Exception('File {} doesn\'t exist'.format(manifest_path))
+    with open(manifest_path, 'r') as f:
+        manifest = json.load(f)
+
+    if manifest['vendor'] != connection.vendor:
+        raise Exception('The tables were dumped from a {} database and cannot be loaded into {}'
+                        .format(manifest['vendor'], connection.vendor))
+
+    tables = manifest['tables']
+    models = [apps.get_model(entry['model']) for entry in tables]
+
+    bar = Bar('Loading {} tables'.format(len(tables)), max=sum(entry['rows'] for entry in tables))
+    for model, entry in zip(models, tables):
+        load_table(model, entry, directory, bar)
+    bar.finish()
+
+    # Rows were inserted with their ids, so the sequences that generate ids must be moved past them
+    with connection.cursor() as cursor:
+        for sql in connection.ops.sequence_reset_sql(no_style(), models):
+            cursor.execute(sql)
+    return tables
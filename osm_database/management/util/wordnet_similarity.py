@@ -0,0 +1,121 @@
+import os
+from multiprocessing import Pool
+
+import numpy as np
+from nltk.corpus import wordnet
+from progress.bar import Bar
+
+# Synsets of the feature names, loaded once in each worker process
+feature_synsets = None
+
+# Row of similarities of one sense to every feature name, as many type strings share senses
+sense_similarities = {}
+
+
+def init_worker(feature_names):
+    global feature_synsets
+    feature_synsets = [wordnet.synsets(name) for name in feature_names]
+
+
+def sense_row(sense):
+    if sense in sense_similarities:
+        return sense_similarities[sense]
+
+    row = np.full(len(feature_synsets), np.nan, dtype=np.float32)
+    for j, synsets in enumerate(feature_synsets):
+        for other_sense in synsets:
+            d = wordnet.wup_similarity(sense, other_sense)
+            if d is not None and (np.isnan(row[j]) or d > row[j]):
+                row[j] = d
+    sense_similarities[sense] = row
+    return row
+
+
+def max_similarities(type_name):
+    """
+    :return: (type_name, the max Wu-Palmer similarity between any sense of type_name and any sense of each feature
+             name, NaN where no pair of senses has a similarity)
+    """
+    if not isinstance(type_name, str):
+        raise Exception('"{}" is not string'.format(type_name))
+
+    row = np.full(len(feature_synsets), np.nan, dtype=np.float32)
+    for sense in wordnet.synsets(type_name):
+        row = np.fmax(row, sense_row(sense))
+    return type_name, row
+
+
+class SimilarityMatrix:
+    """
+    Dense matrix of the max Wu-Palmer similarity between type strings (rows) and feature names (columns), kept on disk
+    so that each type string is only ever compared once against a given set of feature names.
+    If the feature names change, the matrix is discarded.
+    """
+
+    def __init__(self, path, feature_names, processes=None, save_every=500):
+        self.path = path
+        self.feature_names = list(feature_names)
+        self.processes = processes or os.cpu_count()
+        self.save_every = save_every
+
+        self.type_names = []
+        self.matrix = np.zeros((0, len(self.feature_names)), dtype=np.float32)
+
+        if os.path.isfile(path):
+            with np.load(path) as data:
+                if data['feature_names'].tolist() == self.feature_names:
+                    self.type_names = data['type_names'].tolist()
+                    self.matrix = data['matrix']
+        self.type_rows = {name: i for i, name in enumerate(self.type_names)}
+
+    def __contains__(self, type_name):
+        return type_name in self.type_rows
+
+    def save(self):
+        # np.savez appends .npz to any other file name, so write through a file object
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, feature_names=np.array(self.feature_names, dtype=str),
+                     type_names=np.array(self.type_names, dtype=str), matrix=self.matrix)
+        os.replace(tmp_path, self.path)
+
+    def _append(self, rows):
+        names, vectors = zip(*rows)
+        for name in names:
+            self.type_rows[name] = len(self.type_names)
+            self.type_names.append(name)
+        self.matrix = np.vstack((self.matrix, np.array(vectors, dtype=np.float32)))
+        self.save()
+
+    def add_types(self, type_names):
+        """
+        Compute the rows of the type strings not in the matrix yet, in a process pool
+        """
+        unseen = list(dict.fromkeys(x for x in type_names if x not in self.type_rows))
+        if len(unseen) == 0:
+            return
+
+        bar = Bar('Comparing new types to the features', max=len(unseen))
+        rows = []
+        with Pool(self.processes, initializer=init_worker, initargs=(self.feature_names,)) as pool:
+            for row in pool.imap_unordered(max_similarities, unseen, chunksize=4):
+                rows.append(row)
+                if len(rows) >= self.save_every:
+                    self._append(rows)
+                    rows = []
+                bar.next()
+        if len(rows) > 0:
+            self._append(rows)
+        bar.finish()
+
+    def top_k(self, type_name, k):
+        """
+        :return: (indices of the feature names, similarities), best first, at most k of them. Feature names with no
+                 similarity are left out.
+        """
+        row = self.matrix[self.type_rows[type_name]]
+        valid = np.flatnonzero(~np.isnan(row))
+        if len(valid) > k:
+            valid = valid[np.argpartition(row[valid], -k)[-k:]]
+        best = valid[np.argsort(-row[valid], kind='stable')]
+        return best, row[best]
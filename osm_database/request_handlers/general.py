@@ -5,6 +5,7 @@ from osm_database.management.commands.util import extract_points_for_polygons, e
     extract_points_for_linestrings, extract_points_for_multilinestrings
 from osm_database.model_utils import get_or_error
 from osm_database.models import OsmEntity
+from root.request_metrics import wait
 
 __all__ = ['find_rel', 'find_locs', 'get_geojson_info']
 
@@ -42,7 +43,8 @@ def find_locs(request):
 
     retval = []
     future = weka_output_handle(loc_type, preposition, entity.display_name, rlat, rlon, loc_type, entity.type)
-    vicinity = future.result()
+    with wait('weka'):
+        vicinity = future.result()
     outer_vicinity = vicinity * (1 + weka_stdev)
     inner_vicinity = vicinity * (1 - weka_stdev)
 
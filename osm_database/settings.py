@@ -256,6 +256,14 @@ WEKA_OUTPUT_DIR = os.path.join(tempdir, 'weka-output')
 pathlib.Path(WEKA_INPUT_DIR).mkdir(parents=True, exist_ok=True)
 pathlib.Path(WEKA_OUTPUT_DIR).mkdir(parents=True, exist_ok=True)
 
+# Metrics and profiles of the requests to send_request, see root.request_metrics. The /metrics page is not served
+# unless metrics is true, and profiling is off unless slow_request_seconds is set
+_request_profiling = envconf.get('request_profiling', None) or {}
+REQUEST_METRICS_ENABLED = _request_profiling.get('metrics', False)
+REQUEST_PROFILE_SLOW_SECONDS = _request_profiling.get('slow_request_seconds', None)
+REQUEST_PROFILE_SAMPLE_RATE = _request_profiling.get('sample_rate', 0.1)
+REQUEST_PROFILE_DIR = os.path.join(tempdir, 'request-profiles')
+
 # For local run:
 if DEBUG:
 
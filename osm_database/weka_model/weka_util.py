@@ -18,6 +18,33 @@ def clean_up(text):
     return cleaned
 
 
+def load_lookup_table(lookup_file):
+    """
+    Read a lookup table (first column is the row index) from an Excel file, through a compiled copy `<file>.npz` that
+    is rebuilt whenever the Excel file is modified
+    :return: row names, column names, float64 matrix of values, as pandas reads them
+    """
+    cache_file = lookup_file + '.npz'
+    if os.path.isfile(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(lookup_file):
+        with np.load(cache_file) as data:
+            # Copies compiled in float32 are rebuilt
+            if data['values'].dtype == np.float64:
+                return data['row_names'].tolist(), data['column_names'].tolist(), data['values']
+
+    df = pd.read_excel(lookup_file, index_col=0)
+    row_names = [str(x) for x in df.index]
+    column_names = [str(x) for x in df.columns]
+    values = df.values.astype(np.float64)
+
+    # Written through a file object, otherwise numpy appends another .npz to the name
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'wb') as f:
+        np.savez(f, row_names=np.array(row_names, dtype=str), column_names=np.array(column_names, dtype=str),
+                 values=values)
+    os.replace(tmp_file, cache_file)
+    return row_names, column_names, values
+
+
 class WekaModel:
     def __init__(self, model_file):
         self.classifier, self.dataset = Classifier.deserialize(model_file)
@@ -35,6 +62,20 @@ class WekaModel:
 
         return pred
 
+    def predict_many(self, rows):
+        """
+        Predict several rows in one call to the classifier
+        :param rows: (n, number of attributes) array, e.g. from convert_vectors()
+        :return: array of n predictions
+        """
+        for row in rows:
+            self.dataset.add_instance(Instance.create_instance(row))
+        try:
+            pred = self.classifier.distributions_for_instances(self.dataset)
+        finally:
+            self.dataset.delete()
+        return np.asarray(pred)[:, 0]
+
     def convert_embed(self, embed_dict):
         row = []
         for attr_name in self.attr_names:
@@ -44,6 +85,32 @@ class WekaModel:
                 row.append(embed_dict[attr_name.lower()])
         return row
 
+    def index_map(self, columns):
+        """
+        Resolve the attributes of the model against a fixed layout of columns once.
+        :param columns: lower-cased names of the columns of the vectors to convert, e.g. ExpressionFeatureExtraction.columns
+        :return: for each attribute, the index of its column. Row ID maps to len(columns), a column of ones added by
+                 convert_vectors()
+        """
+        column_indices = {x: i for i, x in enumerate(columns)}
+        indices = []
+        for attr_name in self.attr_names:
+            if attr_name.endswith('Row ID'):
+                indices.append(len(columns))
+            else:
+                indices.append(column_indices[attr_name.lower()])
+        return np.array(indices, dtype=np.int64)
+
+    def convert_vectors(self, vectors, index_map):
+        """
+        Vectorised convert_embed()
+        :param vectors: (n, len(columns)) array from ExpressionFeatureExtraction.embed_many()
+        :param index_map: as returned by index_map(columns)
+        :return: (n, number of attributes) array, each row in the order of the attributes of the model
+        """
+        vectors = np.hstack((vectors, np.ones((vectors.shape[0], 1), dtype=vectors.dtype)))
+        return vectors[:, index_map]
+
 class GloveEmbeddingExtraction:
     """
     GlvExp1,GlvExp2,GlvExp3,GlvExp4,GlvExp5,GlvExp6,GlvExp7,GlvExp8,GlvExp9,GlvExp10,GlvExp11,GlvExp12,GlvExp13,GlvExp14,GlvExp15,GlvExp16,GlvExp17,GlvExp18,GlvExp19,GlvExp20,GlvExp21,GlvExp22,GlvExp23,GlvExp24,GlvExp25,GlvExp26,GlvExp27,GlvExp28,GlvExp29,GlvExp30,GlvExp31,GlvExp32,GlvExp33,GlvExp34,GlvExp35,GlvExp36,GlvExp37,GlvExp38,GlvExp39,GlvExp40,GlvExp41,GlvExp42,GlvExp43,GlvExp44,GlvExp45,GlvExp46,GlvExp47,GlvExp48,GlvExp49,GlvExp50,
@@ -92,25 +159,35 @@ class GloveEmbeddingExtraction:
                 retval.append(glove_val)
         return np.array(retval, dtype=np.float32)
 
-    def extract(self, words, prefix):
+    def columns(self, prefix):
+        return [(prefix + str(ind)).lower() for ind in range(1, self.glove_dims + 1)]
+
+    def vector(self, words):
+        """
+        :return: the mean of the embeddings of the known words, zeros if there is none
+        """
         words = clean_up(words)
         arr = []
-        
+
         for word in words.split(' '):
             glove_val = self.glove_dict.get(word, None)
             if glove_val is not None:
                 arr.append(glove_val)
 
         if len(arr) == 0:
-            val_aggregated = np.zeros((self.glove_dims,), dtype=np.float32)
-        else:
-            val_aggregated = np.mean(arr, axis=0)
-        retval = {}
-        
-        for ind, val in enumerate(val_aggregated, 1):
-            retval[(prefix + str(ind)).lower()] = float(val)
-        
-        return retval
+            return np.zeros((self.glove_dims,), dtype=np.float32)
+        return np.mean(arr, axis=0, dtype=np.float32)
+
+    def vectors(self, texts):
+        """
+        :return: (len(texts), glove_dims) array, each distinct text is embedded once
+        """
+        unique_texts, inverse = np.unique(np.asarray(texts, dtype=str), return_inverse=True)
+        unique_vectors = np.array([self.vector(x) for x in unique_texts], dtype=np.float32)
+        return unique_vectors.reshape(-1, self.glove_dims)[inverse]
+
+    def extract(self, words, prefix):
+        return {x: float(val) for x, val in zip(self.columns(prefix), self.vector(words))}
 
 
 class PrepPpdvFeatureExtraction:
@@ -120,14 +197,15 @@ class PrepPpdvFeatureExtraction:
     DV1,DV2,DV3,DV4,DV5,DV6,DV7,DV8,DV9,DV10,DV11,DV12,DV13,DV14,DV15,DV16,DV17,DV18,DV19,DV20,DV21,DV22,DV23,DV24,DV25,DV26,DV27,DV28,DV29,DV30,DV31,DV32,DV33,DV34,DV35,DV36,DV37,DV38,DV39,DV40,DV41,DV42,DV43,DV44,DV45,DV46,DV47,DV48,DV49,DV50,DV51,DV52,DV53,DV54,DV55
     """
     def __init__(self, lookup_file):
-        self.lookup_dict = {}
-        df = pd.read_excel(lookup_file, index_col=0)
-        for row_num, row in df.iterrows():
-            self.lookup_dict[row.name] = {x.lower(): y for x, y in row.iteritems()}
+        row_names, column_names, self.values = load_lookup_table(lookup_file)
+        self.columns = [x.lower() for x in column_names]
+        self.row_indices = {x: i for i, x in enumerate(row_names)}
+
+    def vectors(self, preps):
+        return self.values[[self.row_indices[x] for x in preps]]
 
     def extract(self, prep):
-        prep_vals = self.lookup_dict[prep]
-        return prep_vals
+        return dict(zip(self.columns, self.values[self.row_indices[prep]].tolist()))
 
 
 class LagoFeatureExtraction:
@@ -150,50 +228,102 @@ class LagoFeatureExtraction:
     SolidFeature + suffix,
     """
     def __init__(self, lookup_file):
-        self.lookup_dict = {}
-        df = pd.read_excel(lookup_file, index_col=0)
-        for row_num, row in df.iterrows():
-            self.lookup_dict[row.name] = {x: y for x, y in row.iteritems()}
-        x = 0
+        row_names, self.feature_names, self.values = load_lookup_table(lookup_file)
+        self.row_indices = {x: i for i, x in enumerate(row_names)}
+
+    def columns(self, suffix):
+        return [(x + suffix).lower() for x in self.feature_names]
+
+    def vectors(self, types):
+        return self.values[[self.row_indices[x] for x in types]]
 
     def extract(self, type, suffix):
-        prep_vals = self.lookup_dict[type]
-        retval = {(x + suffix).lower(): y for x, y in prep_vals.items()}
-        return retval
+        return dict(zip(self.columns(suffix), self.values[self.row_indices[type]].tolist()))
 
 
 class ExpressionFeatureExtraction:
+    """
+    Embed an expression as a vector with a fixed layout, given by `columns` (lower-cased attribute names):
+    distmodified, relatumlat, rellon, then the LAGO features of the locatum and relatum types, the glove embeddings of
+    the locatum type, relatum type and whole expression, then the PP/DV features of the preposition.
+    The vectors are float64, like the coordinates and the lookup table values the model was given before this layout.
+    The glove vectors are float32, as they always were, and are copied in exactly.
+    Use WekaModel.index_map(columns) to reorder these vectors to the attributes of a model.
+    """
+
     def __init__(self):
         self.glove_extractor = GloveEmbeddingExtraction('osm_database/weka_model/glove.6B.50d.txt', 50)
         self.ppdv_extractor = PrepPpdvFeatureExtraction('osm_database/weka_model/prep-features.xlsx')
         self.lago_extractor = LagoFeatureExtraction('osm_database/weka_model/lago-features.xlsx')
 
+        blocks = [
+            ('scalars', ['distmodified', 'relatumlat', 'rellon']),
+            ('loc_lago', self.lago_extractor.columns('Loc')),
+            ('rel_lago', self.lago_extractor.columns('Rel')),
+            ('loc_glove', self.glove_extractor.columns('GlvLoc')),
+            ('rel_glove', self.glove_extractor.columns('GlvRel')),
+            ('exp_glove', self.glove_extractor.columns('GlvExp')),
+            ('ppdv', self.ppdv_extractor.columns),
+        ]
+        self.columns = []
+        self.slices = {}
+        for name, columns in blocks:
+            self.slices[name] = slice(len(self.columns), len(self.columns) + len(columns))
+            self.columns += columns
+
+    def find_problems(self, expressions):
+        """
+        Find the expressions that embed_many() cannot embed: their preposition or locatum or relatum type is not in the
+        lookup tables, or a coordinate is missing
+        :param expressions: a DataFrame as given to embed_many()
+        :return: list of the problems of each expression, as a string, '' if there is none
+        """
+        problems = [[] for _ in range(len(expressions))]
+        lookups = [('prep', self.ppdv_extractor.row_indices), ('loc_type', self.lago_extractor.row_indices),
+                   ('rel_type', self.lago_extractor.row_indices)]
+        for column, row_indices in lookups:
+            values = expressions[column]
+            for i in np.flatnonzero(~values.isin(list(row_indices)).values):
+                problems[i].append('unknown {} {!r}'.format(column, values.iat[i]))
+        for column in ['rel_lat', 'rel_loc']:
+            for i in np.flatnonzero(expressions[column].isna().values):
+                problems[i].append('missing {}'.format(column))
+        return ['; '.join(x) for x in problems]
+
+    def embed_many(self, expressions):
+        """
+        :param expressions: a DataFrame with the columns locatum, prep, relatum, rel_lat, rel_loc, loc_type and rel_type.
+                            Use find_problems() to leave out those that cannot be embedded
+        :return: (number of expressions, len(columns)) float64 array
+        """
+        vectors = np.zeros((len(expressions), len(self.columns)), dtype=np.float64)
+        vectors[:, self.slices['scalars']] = np.column_stack((
+            np.zeros(len(expressions)), expressions['rel_lat'].values, expressions['rel_loc'].values
+        ))
+        exps = expressions['locatum'].astype(str) + ' ' + expressions['prep'].astype(str) + ' ' + \
+            expressions['relatum'].astype(str)
+
+        vectors[:, self.slices['loc_lago']] = self.lago_extractor.vectors(expressions['loc_type'])
+        vectors[:, self.slices['rel_lago']] = self.lago_extractor.vectors(expressions['rel_type'])
+        vectors[:, self.slices['loc_glove']] = self.glove_extractor.vectors(expressions['loc_type'])
+        vectors[:, self.slices['rel_glove']] = self.glove_extractor.vectors(expressions['rel_type'])
+        vectors[:, self.slices['exp_glove']] = self.glove_extractor.vectors(exps)
+        vectors[:, self.slices['ppdv']] = self.ppdv_extractor.vectors(expressions['prep'])
+        return vectors
+
+    def embed_vector(self, locatum, prep, relatum, rel_lat, rel_loc, loc_type, rel_type):
+        expressions = pd.DataFrame(dict(locatum=[locatum], prep=[prep], relatum=[relatum], rel_lat=[rel_lat],
+                                        rel_loc=[rel_loc], loc_type=[loc_type], rel_type=[rel_type]))
+        return self.embed_many(expressions)[0]
+
     def embed(self, locatum, prep, relatum, rel_lat, rel_loc, loc_type, rel_type):
         """
         Row ID, Always 1
         Distmodified Always 0
         RelatumLat
         RelLon
-        
-        """
-        retval = dict(
-            distmodified=0,
-            relatumlat=rel_lat,
-            rellon=rel_loc,
-        )
-        exp = '{} {} {}'.format(locatum, prep, relatum)
-        loc_lago_features = self.lago_extractor.extract(loc_type, 'Loc')
-        rel_lago_features = self.lago_extractor.extract(rel_type, 'Rel')
-        loc_glove_features = self.glove_extractor.extract(loc_type, 'GlvLoc')
-        rel_glove_features = self.glove_extractor.extract(rel_type, 'GlvRel')
-        exp_glove_features = self.glove_extractor.extract(exp, 'GlvExp')
-        prep_ppdv_features = self.ppdv_extractor.extract(prep)
-        
-        retval.update(loc_lago_features)
-        retval.update(rel_lago_features)
-        retval.update(loc_glove_features)
-        retval.update(rel_glove_features)
-        retval.update(exp_glove_features)
-        retval.update(prep_ppdv_features)
-
-        return retval
+
+        :return: dict of lower-cased attribute name -> value
+        """
+        vector = self.embed_vector(locatum, prep, relatum, rel_lat, rel_loc, loc_type, rel_type)
+        return dict(zip(self.columns, vector.tolist()))
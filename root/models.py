@@ -1,5 +1,6 @@
 import datetime
 import string
+import zlib
 
 import six
 from django.conf import settings
@@ -13,7 +14,7 @@ from django.db.models.query import QuerySet
 from django_bulk_update.helper import bulk_update
 
 __all__ = ['enum', 'MagicChoices', 'ValueTypes', 'ExtraAttr', "ExtraAttrValue", 'AutoSetterGetterMixin',
-           'ColumnActionValue', 'User', 'SimpleModel', 'SimpleModel', 'SimpleModel',
+           'ColumnActionValue', 'User', 'SimpleModel', 'SimpleModel', 'SimpleModel', 'CompressedTextField',
            'value_setter', 'value_getter', 'get_bulk_id', 'has_field']
 
 
@@ -429,6 +430,54 @@ class AutoSetterGetterMixin:
         return lambda objs, value, extras: cls._set_extra_(objs, attr, value, extras)
 
 
+class CompressedTextField(models.BinaryField):
+    """
+    A text field that is stored zlib-compressed in a binary column. Values are compressed when written and
+    decompressed transparently when read, so the model attribute is always a str
+    """
+
+    def __init__(self, *args, compress_level=6, **kwargs):
+        self.compress_level = compress_level
+        super(CompressedTextField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(CompressedTextField, self).deconstruct()
+        if self.compress_level != 6:
+            kwargs['compress_level'] = self.compress_level
+        return name, path, args, kwargs
+
+    def get_default(self):
+        default = super(CompressedTextField, self).get_default()
+        if isinstance(default, bytes):
+            return default.decode('utf-8')
+        return default
+
+    def compress(self, value):
+        return zlib.compress(value.encode('utf-8'), self.compress_level)
+
+    @staticmethod
+    def decompress(value):
+        return zlib.decompress(bytes(value)).decode('utf-8')
+
+    def from_db_value(self, value, expression, connection, *args):
+        if value is None:
+            return value
+        return self.decompress(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return self.decompress(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if isinstance(value, str):
+            value = self.compress(value)
+        return super(CompressedTextField, self).get_db_prep_value(value, connection, prepared)
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+
 class ValidateOnUpdateQuerySet(QuerySet):
     def update(self, **kwargs):
         model = self.model
@@ -0,0 +1,254 @@
+"""
+Metrics of the requests handled by root.views.send_request, by fetch type (the name of the function that handles the
+request, e.g. find_locs or osm_database.get_geojson_info):
+ - a histogram of the time to handle the request and serialise the response,
+ - the number of responses with an error status,
+ - the number and total time of the SQL queries,
+ - the total time spent waiting on other services, e.g. Weka, measured with wait(),
+ - the total size of the responses.
+
+They are served in the Prometheus text format by metrics_view() if settings.REQUEST_METRICS_ENABLED is set, otherwise
+the page is not found. Each process of the server keeps its own metrics.
+
+If settings.REQUEST_PROFILE_SLOW_SECONDS is set, a sample (settings.REQUEST_PROFILE_SAMPLE_RATE) of the requests is run
+under cProfile, and the profiles of those that take longer than this many seconds are saved to
+settings.REQUEST_PROFILE_DIR as `<fetch type>-<time>-<duration>ms-<pid>.<number>.prof`, to be read with pstats or
+snakeviz.
+"""
+
+import cProfile
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse, HttpResponseNotFound
+
+# Upper bounds of the buckets of the latency histogram, in seconds
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_local = threading.local()
+
+
+class RequestRecord:
+    """
+    Measurements of one request, filled in while it is handled
+    """
+
+    def __init__(self, fetch_type):
+        self.fetch_type = fetch_type
+        self.queries = 0
+        self.query_time = 0.
+        self.waits = {}
+        self.response = None
+
+    def __call__(self, execute, sql, params, many, context):
+        """
+        Count the query, as a wrapper given to connection.execute_wrapper()
+        """
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+    def add_wait(self, name, seconds):
+        self.waits[name] = self.waits.get(name, 0.) + seconds
+
+
+class HandlerMetrics:
+    """
+    Totals of the requests of one fetch type
+    """
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(latency_buckets)
+        self.count = 0
+        self.duration_sum = 0.
+        self.errors = 0
+        self.queries = 0
+        self.query_time = 0.
+        self.waits = OrderedDict()
+        self.response_bytes = 0
+
+    def add(self, record, duration, status_code, response_bytes):
+        for i, bound in enumerate(latency_buckets):
+            if duration <= bound:
+                self.bucket_counts[i] += 1
+                break
+        self.count += 1
+        self.duration_sum += duration
+        if status_code >= 400:
+            self.errors += 1
+        self.queries += record.queries
+        self.query_time += record.query_time
+        for name, seconds in record.waits.items():
+            self.waits[name] = self.waits.get(name, 0.) + seconds
+        self.response_bytes += response_bytes
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_number(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers = OrderedDict()
+        self.num_profiles = 0
+
+    def add(self, record, duration, status_code, response_bytes):
+        with self.lock:
+            handler = self.handlers.get(record.fetch_type, None)
+            if handler is None:
+                handler = HandlerMetrics()
+                self.handlers[record.fetch_type] = handler
+            handler.add(record, duration, status_code, response_bytes)
+
+    def add_profile(self):
+        """
+        :return: the number of the profile, counted from 1 in this process
+        """
+        with self.lock:
+            self.num_profiles += 1
+            return self.num_profiles
+
+    def to_prometheus(self):
+        """
+        :return: the metrics in the Prometheus text exposition format
+        """
+        with self.lock:
+            handlers = list(self.handlers.items())
+            lines = []
+
+            def family(name, type, help, samples):
+                lines.append('# HELP {} {}'.format(name, help))
+                lines.append('# TYPE {} {}'.format(name, type))
+                for sample_name, labels, value in samples:
+                    label_str = ','.join('{}="{}"'.format(k, escape_label(str(v))) for k, v in labels)
+                    lines.append('{}{{{}}} {}'.format(sample_name, label_str, format_number(value)))
+
+            samples = []
+            for fetch_type, handler in handlers:
+                cumulative = 0
+                for bound, count in zip(latency_buckets, handler.bucket_counts):
+                    cumulative += count
+                    samples.append(('osm_request_duration_seconds_bucket',
+                                    [('fetch_type', fetch_type), ('le', format_number(float(bound)))], cumulative))
+                samples.append(('osm_request_duration_seconds_bucket', [('fetch_type', fetch_type), ('le', '+Inf')],
+                                handler.count))
+                samples.append(('osm_request_duration_seconds_sum', [('fetch_type', fetch_type)],
+                                handler.duration_sum))
+                samples.append(('osm_request_duration_seconds_count', [('fetch_type', fetch_type)], handler.count))
+            family('osm_request_duration_seconds', 'histogram',
+                   'Time to handle a request and serialise its response, by fetch type', samples)
+
+            family('osm_request_errors_total', 'counter', 'Number of responses with an error status, by fetch type',
+                   [('osm_request_errors_total', [('fetch_type', t)], h.errors) for t, h in handlers])
+            family('osm_request_sql_queries_total', 'counter', 'Number of SQL queries, by fetch type',
+                   [('osm_request_sql_queries_total', [('fetch_type', t)], h.queries) for t, h in handlers])
+            family('osm_request_sql_seconds_total', 'counter', 'Time spent in SQL queries, by fetch type',
+                   [('osm_request_sql_seconds_total', [('fetch_type', t)], h.query_time) for t, h in handlers])
+            family('osm_request_wait_seconds_total', 'counter',
+                   'Time spent waiting on other services such as Weka, by fetch type',
+                   [('osm_request_wait_seconds_total', [('fetch_type', t), ('wait', name)], seconds)
+                    for t, h in handlers for name, seconds in h.waits.items()])
+            family('osm_request_response_bytes_total', 'counter', 'Size of the response bodies, by fetch type',
+                   [('osm_request_response_bytes_total', [('fetch_type', t)], h.response_bytes) for t, h in handlers])
+
+            lines.append('# HELP osm_request_profiles_total Number of profiles of slow requests saved')
+            lines.append('# TYPE osm_request_profiles_total counter')
+            lines.append('osm_request_profiles_total {}'.format(self.num_profiles))
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = RequestMetrics()
+
+
+@contextmanager
+def wait(name):
+    """
+    Count the time spent inside as waiting on the service `name` in the request being handled by this thread, if any
+    """
+    record = getattr(_local, 'record', None)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if record is not None:
+            record.add_wait(name, time.perf_counter() - start)
+
+
+def start_profiler():
+    """
+    :return: a running cProfile.Profile if this request is sampled for profiling, otherwise None
+    """
+    slow_seconds = getattr(settings, 'REQUEST_PROFILE_SLOW_SECONDS', None)
+    if slow_seconds is None or random.random() >= getattr(settings, 'REQUEST_PROFILE_SAMPLE_RATE', 0.1):
+        return None
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Another profiler is already running, e.g. for a request in another thread
+        return None
+    return profiler
+
+
+def save_profile(profiler, fetch_type, duration):
+    profile_dir = settings.REQUEST_PROFILE_DIR
+    os.makedirs(profile_dir, exist_ok=True)
+    number = metrics.add_profile()
+    file_name = '{}-{}-{:d}ms-{:d}.{:d}.prof'.format(re.sub(r'[^\w.-]', '_', fetch_type),
+                                                  time.strftime('%Y%m%d-%H%M%S'), int(duration * 1000), os.getpid(),
+                                                  number)
+    profiler.dump_stats(os.path.join(profile_dir, file_name))
+
+
+@contextmanager
+def request_profile(fetch_type):
+    """
+    Measure the request handled inside, which must set the response to the yielded RequestRecord. A request that raises
+    is counted as an error.
+    """
+    record = RequestRecord(fetch_type)
+    previous = getattr(_local, 'record', None)
+    _local.record = record
+    profiler = start_profiler()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(record):
+            yield record
+    finally:
+        duration = time.perf_counter() - start
+        _local.record = previous
+        if profiler is not None:
+            profiler.disable()
+            if duration >= settings.REQUEST_PROFILE_SLOW_SECONDS:
+                save_profile(profiler, fetch_type, duration)
+
+        response = record.response
+        if response is None:
+            metrics.add(record, duration, 500, 0)
+        else:
+            response_bytes = 0 if response.streaming else len(response.content)
+            metrics.add(record, duration, response.status_code, response_bytes)
+
+
+def metrics_view(request):
+    if not getattr(settings, 'REQUEST_METRICS_ENABLED', False):
+        return HttpResponseNotFound()
+    return HttpResponse(metrics.to_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
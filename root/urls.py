@@ -4,7 +4,7 @@ from django.conf.urls import url
 from django.conf.urls.static import static
 from django.urls import include
 
-from root import views, userviews
+from root import views, userviews, request_metrics
 
 urlpatterns = [
     url(r'^tz_detect/', include('tz_detect.urls')),
@@ -12,6 +12,7 @@ urlpatterns = [
     url(r'^send-request/(?P<type>[0-9a-z-_]+)/$', views.send_request, name='send-request'),
     url(r'^send-request/(?P<module>[0-9a-z-_]+)/(?P<type>[0-9a-z-]+)/$', views.send_request,
         name='send-request'),
+    url(r'^metrics$', request_metrics.metrics_view, name='metrics'),
     url(r'^login$', userviews.UserSignInView.as_view(), name='login'),
     url(r'^register$', userviews.UserRegistrationView.as_view(), name='register'),
     url(r'^reset', userviews.UserResetPasswordView.as_view(), name='reset-password'),
@@ -22,6 +22,7 @@ from osm_database import jsons
 from root.exceptions import CustomAssertionError
 from root.models import ValueTypes, ExtraAttr, value_setter, value_getter, has_field, ExtraAttrValue,\
     ColumnActionValue, get_bulk_id, get_field
+from root.request_metrics import request_profile
 
 error_tracker = settings.ERROR_TRACKER
 
@@ -565,7 +566,7 @@ def send_request(request, *args, **kwargs):
     :param request: must specify a valid `type` in POST data, otherwise 404. The type must be in form of
                     get_xxx_yyy and a function named set-xxx-yyy(request) must be available and registered
                     using register_app_modules
-    :return: AJAX content
+    :return: AJAX content. The latency, queries and response size of each type are recorded, see root.request_metrics
     """
     fetch_type = kwargs['type']
     module = kwargs.get('module', None)
@@ -576,12 +577,15 @@ def send_request(request, *args, **kwargs):
         function = globals().get(func_name, None)
 
         if function:
-            response = exception_handler(function, request)
-            if isinstance(response, HttpResponse):
-                return response
-            if isinstance(response, dict):
-                return HttpResponse(json.dumps(response))
-            return HttpResponse(json.dumps(dict(success=True, warning=None, payload=response)))
+            with request_profile(func_name) as profile:
+                response = exception_handler(function, request)
+                if not isinstance(response, HttpResponse):
+                    if isinstance(response, dict):
+                        response = HttpResponse(json.dumps(response))
+                    else:
+                        response = HttpResponse(json.dumps(dict(success=True, warning=None, payload=response)))
+                profile.response = response
+            return response
 
     return HttpResponseNotFound()
 
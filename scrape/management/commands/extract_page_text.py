@@ -0,0 +1,150 @@
+import os
+from multiprocessing import Pool
+
+from bs4 import BeautifulSoup as bs
+from django.core.management import BaseCommand
+from django_bulk_update.helper import bulk_update
+from progress.bar import Bar
+
+from scrape.management.commands.hiki_niupepa_kupu import Perehitanga, Rārangi, UrlQuerier, cache_pack_dir, \
+    issue_links, newspaper_links, next_page_links, pae_tukutuku_haurua
+from scrape.management.util.db_storage import UrlIdMap
+from scrape.management.util.page_cache import PageCache, hash_url, read_page
+from scrape.management.util.text_cleanup import rāringa_kaituhituhi
+from scrape.models import Page
+
+update_fields = ['raw_text', 'adapted_text', 'maori_word_count', 'ambiguous_word_count', 'other_word_count',
+                 'total_word_count', 'percentage_maori']
+
+# Each worker process keeps its own handle to the pack file, and the locations of the pages in it
+pack_reader = None
+page_locations = None
+
+
+def init_worker(pack_file, locations):
+    global pack_reader, page_locations
+    pack_reader = open(pack_file, 'rb')
+    page_locations = locations
+
+
+class PackedPages:
+    # Read-only stand-in of the page cache for UrlQuerier, reading from the worker's handle to the pack file
+    def __contains__(self, url):
+        return hash_url(url) in page_locations
+
+    def get(self, url, default=None):
+        location = page_locations.get(hash_url(url), None)
+        if location is None:
+            return default
+        return read_page(pack_reader, *location)
+
+
+def extract_issue(taukaea):
+    """
+    Walk the cached pages of one issue from its first page and run the same paragraph split and cleanup as
+    hiki_niupepa_kupu on them. hiki_niupepa_kupu stores each paragraph into the row of its page, overwriting the
+    previous one, so the text kept for a page is that of the last paragraph stored for it.
+    :param taukaea: url of the first page of the issue
+    :return: (dict of url -> (raw text, adapted text, Māori word count, ambiguous word count, other word count,
+             total word count, percentage Māori), the url of the first page that is not cached or could not be parsed,
+             or None if the whole issue was read)
+    """
+    pages = dict()
+
+    def store_page(npp_name, issue, published_date, page_number, maori_words, ambiguous_words, other_words,
+                   total_words, percent_maori, adapted_text, url, raw_text):
+        pages[url] = (raw_text, adapted_text, maori_words, ambiguous_words, other_words, total_words, percent_maori)
+
+    url_querier = UrlQuerier(PackedPages(), None)
+    niupepa = Perehitanga(['', taukaea])
+    tīmata_kōwae = None
+    tuatahi = True
+    while taukaea is not None:
+        if taukaea not in url_querier.cache:
+            return pages, taukaea
+        try:
+            tāuru = Rārangi(url_querier, niupepa, taukaea)
+            kōwae = rāringa_kaituhituhi(tāuru, tīmata_kōwae, store_page)
+        except Exception:
+            return pages, taukaea
+
+        # As in hātepe_perehitanga, what is left over at the end of the first page is not carried to the next one
+        if not tuatahi:
+            tīmata_kōwae = kōwae
+        tuatahi = False
+
+        taukaea = next(iter(next_page_links(tāuru.hupa)), None)
+    return pages, None
+
+
+class Command(BaseCommand):
+    """
+    Re-extract the text and word counts of every page in the database from the page cache of hiki_niupepa_kupu.
+    The issues are walked in the cache the same way as hiki_niupepa_kupu walks the archive, one issue per task of a
+    process pool, and the results are written back in batches. No page is fetched.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', action='store', dest='processes', default=os.cpu_count(), type=int,
+                            help='Number of worker processes, default to the number of CPUs')
+        parser.add_argument('--batch-size', action='store', dest='batch_size', default=1000, type=int,
+                            help='Number of pages to write to the database at once')
+
+    def save(self, pages):
+        bulk_update(pages, update_fields=update_fields, batch_size=len(pages))
+
+    def issue_urls(self, page_cache):
+        """
+        :return: the urls of the first page of every issue, from the archive and newspaper pages in the cache
+        """
+        issues = []
+        archive = page_cache.get(pae_tukutuku_haurua)
+        if archive is None:
+            raise Exception('The archive page {} is not cached'.format(pae_tukutuku_haurua))
+        for newspaper_url in newspaper_links(bs(archive, 'html.parser')):
+            content = page_cache.get(newspaper_url)
+            if content is None:
+                print('Newspaper page {} is not cached'.format(newspaper_url))
+                continue
+            issues += issue_links(bs(content, 'html.parser'))
+        return list(dict.fromkeys(issues))
+
+    def handle(self, processes, batch_size, *args, **options):
+        page_cache = PageCache(cache_pack_dir, readonly=True)
+        page_ids = UrlIdMap()
+        page_ids.load(Page.objects.values_list('url', 'id').iterator())
+
+        issues = self.issue_urls(page_cache)
+        locations = {hash_url(url): (offset, length) for url, offset, length in page_cache.iter_locations()}
+        page_cache.close()
+        print('{} cached pages, {} issues'.format(len(locations), len(issues)))
+
+        bar = Bar('Extracting page text', max=len(issues))
+        batch = []
+        updated_count = 0
+        with Pool(processes, initializer=init_worker, initargs=(page_cache.pack_file, locations)) as pool:
+            for pages, failed_url in pool.imap_unordered(extract_issue, issues):
+                bar.next()
+                if failed_url is not None:
+                    print('\nStopped at {}, not cached or not readable'.format(failed_url))
+
+                # Only the pages that exist in the database are written
+                for url, extracted in pages.items():
+                    page_id = page_ids.get(url)
+                    if page_id is None:
+                        continue
+                    page = Page(id=page_id)
+                    page.raw_text, page.adapted_text, page.maori_word_count, page.ambiguous_word_count, \
+                        page.other_word_count, page.total_word_count, page.percentage_maori = extracted
+                    batch.append(page)
+
+                if len(batch) >= batch_size:
+                    self.save(batch)
+                    updated_count += len(batch)
+                    batch = []
+
+        if len(batch) > 0:
+            self.save(batch)
+            updated_count += len(batch)
+        bar.finish()
+        print('Done, {} of the {} pages in the database were updated'.format(updated_count, len(page_ids)))
@@ -3,13 +3,15 @@ import os
 import pathlib
 import pickle
 import re
-import zipfile
+import time
 
 from bs4 import BeautifulSoup as bs
 from django.core.management import BaseCommand
 
 from scrape.management.util.browser_wrapper import BrowserWrapper
-from scrape.management.util.taumahi import tiki_ōrau
+from scrape.management.util.fetcher import AsyncFetcher
+from scrape.management.util.page_cache import PageCache
+from scrape.management.util.text_cleanup import mātītori_kupu, unu_kupu_tōkau, kupu_moroki, rāringa_kaituhituhi
 from scrape.models import Newspaper, Publication, Page
 
 current_dir = os.path.dirname(os.path.abspath(__file__))
@@ -18,6 +20,7 @@ dir_parts = current_dir.split(os.path.sep)
 cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
 cache_html_dir = os.path.join(cache_dir, 'html')
 cache_zip_dir = os.path.join(cache_dir, 'zip')
+cache_pack_dir = os.path.join(cache_dir, 'pack')
 
 pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
 pathlib.Path(cache_html_dir).mkdir(parents=True, exist_ok=True)
@@ -33,98 +36,76 @@ NEWSPAPER_VOL_MATCHER = re.compile(r'(.*?) \d\d\d\d.*?Volume (\d+).*')
 NEWSPAPER_NO_MATCHER = re.compile(r'(.*?) \d\d\d\d.*?No. (\d+).*')
 
 
-class AutoSaveCache:
-    def __init__(self, filename: str, save_freq: int):
-        self.filename = filename
-        self.filename_bak = filename + '.bak'
-        self.save_freq = save_freq
-
-        if os.path.isfile(self.filename):
-            with open(self.filename, 'rb') as f:
-                self.db_storage = pickle.load(f)
-        else:
-            self.db_storage = {}
-
-        self.item_count = len(self.db_storage)
-
-    def get_index(self, url):
-        index = self.db_storage.get(url, None)
-        if index is None:
-            return self.item_count + 1, True
-        return index, False
-
-    def __setitem__(self, key, value):
-        if key in self.db_storage:
-            raise Exception('Key {} already exists'.format(key))
-        self.item_count += 1
-        self.db_storage[key] = self.item_count
-
-        if self.item_count % self.save_freq == 0:
-            with open(self.filename_bak, 'wb') as f:
-                pickle.dump(self.db_storage, f)
-
-            os.rename(self.filename_bak, self.filename)
-            print('Saved cache')
-
-    def save(self):
-        with open(self.filename_bak, 'wb') as f:
-            pickle.dump(self.db_storage, f)
-
-        os.rename(self.filename_bak, self.filename)
-        print('Saved final cache')
-
-
 class UrlQuerier:
-    def __init__(self, cache, browser_wrapper):
+    def __init__(self, cache, browser_wrapper, max_retrials=10):
         self.cache = cache
         self.browser_wrapper = browser_wrapper
+        self.max_retrials = max_retrials
 
-    def _query(self, url, cache_file_path_zip):
-        query_finished = False
-        response = None
-        while not query_finished:
+    def _query(self, url):
+        for retrial in range(self.max_retrials):
             try:
-                response = self.browser_wrapper.make_query_retrial_if_fail(url)
-                query_finished = True
+                return self.browser_wrapper.make_query_retrial_if_fail(url)
             except Exception as e:
                 self.browser_wrapper.reload()
+                time.sleep(min(60, 2 ** retrial))
+        raise Exception('Max retrial exceeded for {}'.format(url))
 
-        zf = zipfile.ZipFile(cache_file_path_zip, mode='w', compression=zipfile.ZIP_DEFLATED)
-        try:
-            zf.writestr('content.html', response)
-        finally:
-            zf.close()
-        return response
+    def load(self, url):
+        """
+        :return: the cached content of url, or None if it hasn't been fetched
+        """
+        return self.cache.get(url)
 
-    def _load(self, cache_file_path_zip):
-        zf = zipfile.ZipFile(cache_file_path_zip, 'r')
-        response = zf.read('content.html').decode('utf-8')
-        return response
+    def store(self, url, content):
+        self.cache.put(url, content)
 
     def query_or_load(self, url):
         # if replace:
         #     url = url.replace('&c=niupepa', '').replace('&cl=CL1.1', '&cl=CL2.1').replace('/library', '/library.cgi').replace('/library.cgi.cgi', '/library.cgi')
-        cache_index, is_new = self.cache.get_index(url)
-        cache_file_path_zip = os.path.join(cache_zip_dir, '{}.zip'.format(cache_index))
+        content = self.load(url)
+        if content is None:
+            content = self._query(url)
+            self.store(url, content)
+        return content
 
-        if is_new:
-            content = self._query(url, cache_file_path_zip)
-        else:
-            content = self._load(cache_file_path_zip)
 
-        if is_new:
-            self.cache[url] = cache_index
+def newspaper_links(hupa):
+    # Links to each newspaper from the archive page
+    links = []
+    for tr in hupa.select('div.top')[0].find_all('tr', {'valign': 'top'}):
+        for td in tr.find_all('td', {'valign': 'top'}):
+            if td.a:
+                links.append(pae_tukutuku + td.a['href'])
+    return links
 
-        return content
 
+def issue_links(hupa):
+    # Links to the first page of each issue from a newspaper's page, commentaries excluded
+    links = []
+    for tr in hupa.select('#group_top')[0].find_all('tr', {"valign": "top"}):
+        if "commentary" in tr.text.lower():
+            continue
+        for td in tr.find_all('td', {"valign": "top"}):
+            if td.a:
+                links.append(pae_tukutuku + td.a['href'])
+    return links
 
-def clean_whitespace(paragraph):
-    return re.sub(r'\s+', ' ', paragraph).strip()
 
+def next_page_links(hupa):
+    # Link to the next page of the same issue, if any
+    navarrows = hupa.select('div.navarrowsbottom')
+    if len(navarrows) == 0:
+        return []
+    taukaea_pinetohu = navarrows[0].find('td', align='right', valign='top')
+    if taukaea_pinetohu is None or taukaea_pinetohu.a is None or not taukaea_pinetohu.a['href']:
+        return []
+    return [pae_tukutuku + taukaea_pinetohu.a['href']]
 
-# Punctuation that will be searched for, and stripped respectively. The former indicates the end of a paragraph if followed by a new line character.
-tohutuhi = ".!?"
-tohukī = "‘’\'\") "
+
+def needs_browser(url, content):
+    # Plain HTTP is enough unless we are served a captcha
+    return 'g-recaptcha' in content
 
 
 class Perehitanga:
@@ -166,205 +147,11 @@ class Rārangi:
         self.mātāmuri_rārangi = niupepa.mātāmuri
 
 
-class Tīmata_kōwae:
-    # Sets up the 'left over paragraph' from the previous page in a class object for readability
-    # The input is a Rārangi class object.
-    def __init__(self, tāuru):
-        self.tau = tāuru.tau
-        self.kupu = tāuru.kupu
-        self.taukaea = tāuru.taukaea
-
-
-def kupu_moroki(tāuru, tīmata_kōwae):
-
-    # It strips the text of any unnecessary trailing characters that could follow the end of the sentence, such as quotation marks
-    mahuru_kupu = tāuru.kupu.strip(tohukī)
-    # If there is anything left after these characters have been stripped (so as not to cause an error)
-    if mahuru_kupu:
-        # If the last character of the string is an acceptable "end of paragraph" character, and there are preceeding pages (i.e. it is not the last page of the issue since a paragraph will not continue over consecutive issues)
-        if (mahuru_kupu[-1] not in tohutuhi) and (tāuru.hupa.select('div.navarrowsbottom')[0].find('td', align='right', valign='top').a):
-            # Then this paragraph will be carried over to the next page (the next time this function is called) by using the global tīmata_kōwae variable
-
-            # If there isn't already a paragraph being carried over, it stores the start of the paragraph's text, page number and url
-            if not tīmata_kōwae:
-                tīmata_kōwae = Tīmata_kōwae(tāuru)
-            # Otherwise if there is a paragraph being carried over, it just adds the text to the rest of the paragraph, without changing the original page number and url
-            else:
-                tīmata_kōwae.kupu += tāuru.kupu
-            # It then breaks, exiting out of the function, so the carried paragraph is not written until all the text in the paragraph has been collected
-
-    return tīmata_kōwae
-
-
-def mātītori_kupu(kupu):
-    return re.findall(r'[\w\W]*?[{}][{}]*\n|[\w\W]+$'.format(tohutuhi, tohukī), kupu)
-
-
-def rāringa_kaituhituhi(tāuru, tīmata_kōwae, store_page):
-    # This function splits the text from a given page into its constituent
-    # Paragraphs, and writes them along with the page's information (date
-    # Retrieved, newspaper name, issue name, page number, Māori word count,
-    # Ambiguous word count, other word count, total word count, Māori word
-    # Percentage, the raw text, and the url of the page). If it determines that
-    # The paragraph carries on to the next page, and it is not the last page of
-    # An issue, it carries the information that changes from page to page (text,
-    # Page number, url) to the next time the function is called, i.e. the next
-    # Page. It tries to find where the paragraph continues, and then writes it
-    # To the text csv with the information of the page where it was first found.
-    # If it can't, it will continue to loop this information forward until the
-    # Last page of the issue. It takes a Rārangi class object, and a csv writer.
-
-    if tāuru.kupu:  # Only writes the information if text was able to be extracted
-
-        # Splits the text up into paragraphs
-        kupu_tūtira = mātītori_kupu(tāuru.kupu)
-
-        # Loops through the paragraphs
-        for kupu in kupu_tūtira:
-
-            # Strips leading and trailing white space
-            tāuru.kupu = kupu.strip()
-
-            # If the paragraph is the last paragraph on the page
-            if kupu == kupu_tūtira[-1]:
-                tīmata_kōwae = kupu_moroki(tāuru, tīmata_kōwae)
-
-            # If there is leftover text from the previous page, Find the first paragraph that isn't in caps, i.e. isn't a title
-            if tīmata_kōwae and not kupu.isupper():
-
-                # Add the leftover text to the first paragraph that isn't entirely uppercase
-                tāuru.kupu = tīmata_kōwae.kupu + tāuru.kupu
-                # The page number and url that are to be written with the paragraph are from the original paragraph, so they are taken from the global variable and assigned to the variables that will be written
-                whārangi_tau = tīmata_kōwae.tau
-                whārangi_taukaea = tīmata_kōwae.taukaea
-                # Then the global variable is cleared, because it is being written, so nothing is being carried over to the next call of the function
-                tīmata_kōwae = None
-
-            else:
-                # If nothing is being added from a previous page, the page number and url that are to be written come from the current page, and are assigned to the variables which will be written
-                whārangi_tau = tāuru.tau
-                whārangi_taukaea = tāuru.taukaea
-
-            # Replaces all white space with a space
-            tāuru.kupu = clean_whitespace(tāuru.kupu)
-            # If there is no text left after it has been stripped, there is no point writing it, so the function continues onto the next paragraph
-            if not tāuru.kupu:
-                continue
-
-            tāuru.urutau = whakarauiri(tāuru.kupu)
-            tāuru.urutau = tohutau(tāuru.urutau)
-            # Gets the percentage of the text that is Māori
-            tāuru.māori, tāuru.rangirua, tāuru.pākehā, tāuru.tapeke, tāuru.ōrau = tiki_ōrau(
-                tāuru.urutau)
-            # Prepares the row that is to be written to the csv
-
-            # ['newspaper', 'issue', 'page', 'māori_words', 'ambiguous_words', 'other_words',
-            #  'total_words', 'percent_māori', 'adapted_text', 'url', 'raw_text'])
-
-            store_page(tāuru.niupepa, tāuru.perehitanga, tāuru.published_date, whārangi_tau, tāuru.māori, tāuru.rangirua, tāuru.pākehā,
-                       tāuru.tapeke, tāuru.ōrau, tāuru.urutau, whārangi_taukaea, tāuru.kupu)
-
-    return tīmata_kōwae
-
-
-def rīwhi_tauriterite(kimikimi, taumahi_ingoa, kōwae):
-    # Finds all matches to the input regex, in the input text, using the input string to determine what to replace the match with
-    # The first argument is a regex expression, the second is a string containing a function name from the tau module, the third is the text that is to be modified
-    ngā_whakataki_tūtira = re.compile(kimikimi).findall(kōwae)
-    for ngā_whakataki in ngā_whakataki_tūtira:
-        whakataki = ngā_whakataki[0].strip()
-        kupu = " "
-        if taumahi_ingoa == "rā_kupu":
-            kupu += "<date>"
-        elif taumahi_ingoa == "tāima_kupu":
-            kupu += "<time>"
-        else:
-            kupu += "<number>"
-        kupu += " "
-        kōwae = kōwae.replace(whakataki, kupu)
-    return kōwae
-
-
-def tohutau(kupu):
-    # Formats text in a way suitable for the irstlm language model
-    kupu = re.sub(r'w[”“"\'`‘’´]', 'wh', kupu.lower())
-    kupu = re.sub(r'[—–]', '-', kupu)
-    kupu = re.sub(r'([^A-Za-zĀĒĪŌŪāēīōū\s])', r' \1 ', kupu)
-    kupu = re.sub(r'< (date|number|time) >', r'<\1>', kupu)
-    kupu = re.sub(r'-', r'@-@', kupu)
-    return "<s> " + clean_whitespace(kupu) + " </s>"
-
-
-def unu_kupu_tōkau(hupa, tau):
-    # Extracts the text for all pages of the issue it has been passed.
-    # It takes a tuple and a list. The tuple has the newspaper name, issue name
-    # And issue link. The list is of tuples containing each page of the issue's
-    # Number, soup and url. It outputs a list of tuples, which contain each page
-    # Of an issue's number, text and url.
-
-    # Simplify the soup to the area we are interested in
-    kupu_tōkau = hupa.select('div.documenttext')[0].find('td')
-
-    # Must determine there is a div.documenttext, because .text will raise an error if it kupu_tōkau is None
-    if kupu_tōkau != None:
-        if kupu_tōkau.text:
-            # If it can find text, it returns it
-            return kupu_tōkau.text
-        else:
-            # If there is no text found, print an error
-            print("Failed to extract text from page " + tau)
-    else:
-        print("Failed to extract text from page " + tau)
-
-    return
-
-
-def whakarauiri(kupu):
-    # The calls to these functions in tau don't need to be made for the irstlm language model, however replacements make the model more effective. Hence we use a string with the function of the tau module's name to represent the kind of object it is replacing.
-    marama = '(Hanuere|Pepuere|Maehe|Apereira|Mei|Hune|Hurae|Akuhata|Hepetema|Oketopa|Noema|Nowema|Tihema)'
-    # Comma separated pound values, ending with common representations for shillings and pounds
-    kupu = rīwhi_tauriterite('((£?([1-9]\d{0,2}[,\/‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3}([.,]{2}\d{1,2}){1,2}))', "pakaru_moni", kupu)
-    kupu = rīwhi_tauriterite('(?i)(£?[1-9]\d{0,2}[,\/‘`´’\'\".][ ]?(\d{3}[,\/‘`´’\'\".]?[ ]?)+ ?l\.? ?( ?\d+ ?[ds]\.? ?){0,2})', "pakaru_moni", kupu)
-    # Non-comma separated pound values, with the same endings
-    kupu = rīwhi_tauriterite('(£?([1-9]\d*([.,]{2}\d{1,2}){1,2}))', "pakaru_moni", kupu)
-    kupu = rīwhi_tauriterite('(?i)((£?[1-9]\d*( ?\d+ ?[lsd]\.? ?){1,3}))', "pakaru_moni", kupu)
-    # Typical date format xx/xx/xx
-    kupu = rīwhi_tauriterite('((\d{1,2}\/){1,2}\d{2})', "rā_kupu", kupu)
-    # Other common date formats that involve words - e.g. the (day) of (month), (year); or (month) (day) (year)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + ',? \d{4}(\b|\W|\s|\s|$|\W))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{1,2}( [,o])? ' + marama + ',? \d{4}(\b|\W|\s|\s|$|\W))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{1,2},? \d{4}(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{4},? ' + marama + ')', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{4}(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + '(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{1,2}( [,o])? ' + marama + '(\b|\W|\s|$))', "rā_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{1,2}(\b|\W|\s|$))', "rā_kupu", kupu)
-    # Comma separated pound values with no suffixes
-    kupu = rīwhi_tauriterite('(£([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', "pakaru_moni", kupu)
-    # Other comma separated values, not financial
-    kupu = rīwhi_tauriterite('(([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', "hōputu_tau", kupu)
-    # Finds times separated by punctuation (with or without a space), optionally followed by am/pm
-    kupu = rīwhi_tauriterite('(?i)((\d{1,2}\. ){1,2}(\d{1,2}) ?[ap]\.?m\.?)', "tāima_kupu", kupu)
-    kupu = rīwhi_tauriterite('(?i)((\d{1,2}[,.:]){0,2}(\d{1,2}) ?[ap]\.?m\.?)', "tāima_kupu", kupu)
-    kupu = rīwhi_tauriterite('((\d{1,2}\. ?){1,2}\d{1,2})', "tāima_kupu", kupu)
-    # Deals with any leftover slash-separated values that weren't accepted by "tāima_kupu" by replacing the slashes with words
-    kupu = rīwhi_tauriterite('((\d{1,6}( \/ | \/|\/ |\/|\.)){1,5}\d{1,5})', "hautau_rānei_ira", kupu)
-    # Finds all other monetary values
-    kupu = rīwhi_tauriterite('(£(\d)+)', "pakaru_moni", kupu)
-    # Finds all other numbers
-    kupu = rīwhi_tauriterite('((\d)+)', "hōputu_tau", kupu)
-    # Removes characters that aren't letters or spaces.
-    kupu = re.sub(r'[^A-Za-zĀĒĪŌŪāēīōū!"#$%&\'()*+,./:;<=>?[\\]^_`‘’{|}-£´\s]', '', kupu)
-    # Clears excess spaces
-    return clean_whitespace(kupu)
-
-
 class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
-        cache_file = os.path.join(cache_dir, 'cache.pkl')
-        self.cache = AutoSaveCache(cache_file, 10)
+        self.cache = PageCache(cache_pack_dir)
 
         self.browser_wrapper = BrowserWrapper(cache_dir)
         self.url_querier = UrlQuerier(self.cache, self.browser_wrapper)
@@ -434,6 +221,45 @@ class Command(BaseCommand):
         parser.add_argument('--textfile', action='store', dest='textfile', required=False, type=str, default=None,
                             help="Output csv file where the date retrieved, newspaper names, issue names, page numbers,"
                                  " word counts, Māori percentage, page text and page urls are stored")
+        parser.add_argument('--prefetch', action='store_true', dest='prefetch', default=False,
+                            help='Download all uncached pages of the archive concurrently before processing them. '
+                                 'Pages are cached as served over plain HTTP (a browser is only used when a captcha '
+                                 'is served), not as the page_source of the browser. This assumes that the archive '
+                                 'pages are static HTML, which has not been checked on every page')
+        parser.add_argument('--max-per-host', action='store', dest='max_per_host', default=4, type=int,
+                            help='Maximum number of requests in flight to the archive when prefetching')
+        parser.add_argument('--rps', action='store', dest='requests_per_second', default=2.0, type=float,
+                            help='Maximum number of requests per second to the archive when prefetching')
+        parser.add_argument('--retry-budget', action='store', dest='retry_budget', default=1000, type=int,
+                            help='Maximum number of retries for the whole prefetch run')
+
+    def prefetch(self, max_per_host, requests_per_second, retry_budget):
+        # Walks the archive the same way as matua(): archive page -> newspapers -> issues -> next pages, but fetches
+        # concurrently and only stores the pages in the cache. matua() then runs entirely from the cache.
+        link_extractors = [newspaper_links, issue_links, next_page_links]
+        levels = {pae_tukutuku_haurua: 0}
+
+        def on_page(url, content):
+            if url not in self.cache:
+                self.url_querier.store(url, content)
+            level = levels[url]
+            next_level = min(level + 1, len(link_extractors) - 1)
+            links = link_extractors[level](bs(content, 'html.parser'))
+            for link in links:
+                levels.setdefault(link, next_level)
+            return links
+
+        def browser_factory():
+            browser_wrapper = BrowserWrapper(cache_dir)
+            browser_wrapper.auto_solve_captcha = True
+            return browser_wrapper
+
+        fetcher = AsyncFetcher(max_per_host=max_per_host, requests_per_second=requests_per_second,
+                               retry_budget=retry_budget, needs_browser=needs_browser, browser_factory=browser_factory)
+        stats = fetcher.crawl([pae_tukutuku_haurua], on_page, load_cached=self.url_querier.load)
+        print(stats)
+        for url, reason in fetcher.failures.items():
+            print('Failed: {} ({})'.format(url, reason))
 
     def hātepe_perehitanga(self, niupepa):
         # This function extracts the text from every page of the newspaper issue it
@@ -558,15 +384,17 @@ class Command(BaseCommand):
         self.tiki_niupepa()
 
     def finalise(self):
-        self.cache.save()
+        self.cache.close()
         with open(self.progress_cache_file, 'wb') as f:
             pickle.dump(self.progress_cache, f)
 
-    def handle(self, textfile, *args, **options):
+    def handle(self, textfile, prefetch, max_per_host, requests_per_second, retry_budget, *args, **options):
         self.browser_wrapper.auto_solve_captcha = True
         # self.populate()
 
         try:
+            if prefetch:
+                self.prefetch(max_per_host, requests_per_second, retry_budget)
             self.matua()
         finally:
             self.finalise()
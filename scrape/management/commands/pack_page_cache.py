@@ -0,0 +1,56 @@
+import os
+import pickle
+import zipfile
+
+from django.core.management import BaseCommand
+from progress.bar import Bar
+
+from scrape.management.commands import hiki_niupepa_kupu, scrape_maori_text
+from scrape.management.util.page_cache import PageCache
+
+
+class Command(BaseCommand):
+    """
+    Convert the old page cache of hiki_niupepa_kupu and scrape_maori_text (one N.zip per page under zip/, indexed by
+    a pickled url -> N dict in cache.pkl) into the PageCache pack store that these commands now use.
+    Pages already in the pack store are skipped, so this can be re-run safely.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', dest='delete', default=False,
+                            help='Delete each zip file once its content is in the pack store')
+
+    def pack(self, cache_dir, cache_zip_dir, cache_pack_dir, delete):
+        cache_file = os.path.join(cache_dir, 'cache.pkl')
+        if not os.path.isfile(cache_file):
+            print('No zip cache index found at {}'.format(cache_file))
+            return
+
+        with open(cache_file, 'rb') as f:
+            url_to_index = pickle.load(f)
+
+        page_cache = PageCache(cache_pack_dir)
+        bar = Bar('Packing {}'.format(cache_zip_dir), max=len(url_to_index))
+        missing = 0
+        try:
+            for url, index in url_to_index.items():
+                cache_file_path_zip = os.path.join(cache_zip_dir, '{}.zip'.format(index))
+                if url not in page_cache:
+                    if not os.path.isfile(cache_file_path_zip):
+                        missing += 1
+                        bar.next()
+                        continue
+                    with zipfile.ZipFile(cache_file_path_zip, 'r') as zf:
+                        page_cache.put(url, zf.read('content.html').decode('utf-8'))
+                if delete and os.path.isfile(cache_file_path_zip):
+                    os.remove(cache_file_path_zip)
+                bar.next()
+        finally:
+            bar.finish()
+            page_cache.close()
+
+        print('{} pages now in {}, {} zip files were missing'.format(len(page_cache), cache_pack_dir, missing))
+
+    def handle(self, delete, *args, **options):
+        for module in [hiki_niupepa_kupu, scrape_maori_text]:
+            self.pack(module.cache_dir, module.cache_zip_dir, module.cache_pack_dir, delete)
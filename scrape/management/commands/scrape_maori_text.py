@@ -1,14 +1,15 @@
 import datetime
 import os
 import pathlib
-import pickle
 import re
-import zipfile
+import time
 
 from bs4 import BeautifulSoup
 from django.core.management import BaseCommand
 
 from scrape.management.util.browser_wrapper import BrowserWrapper
+from scrape.management.util.db_storage import DbStorage
+from scrape.management.util.page_cache import PageCache
 from scrape.models import Newspaper as DbNewspaper
 from scrape.models import Publication as DbPublication
 from scrape.models import Page as DbPage
@@ -19,6 +20,7 @@ dir_parts = current_dir.split(os.path.sep)
 cache_dir = os.path.join(os.path.sep.join(dir_parts[0:dir_parts.index('management')]), 'cache', script_name)
 cache_html_dir = os.path.join(cache_dir, 'html')
 cache_zip_dir = os.path.join(cache_dir, 'zip')
+cache_pack_dir = os.path.join(cache_dir, 'pack')
 
 pathlib.Path(cache_dir).mkdir(parents=True, exist_ok=True)
 pathlib.Path(cache_html_dir).mkdir(parents=True, exist_ok=True)
@@ -31,159 +33,27 @@ NEWSPAPER_VOL_MATCHER = re.compile(r'(.*?) \d\d\d\d.*?Volume (\d+).*')
 NEWSPAPER_NO_MATCHER = re.compile(r'(.*?) \d\d\d\d.*?No. (\d+).*')
 
 
-class DbStorage:
-    def __init__(self):
-        self.newspapers = None
-        self.publications = None
-        self.pages = None
-        self.populate_newspapers_from_database()
-        self.populate_publications_from_database()
-        self.populate_pages_from_database()
-
-    def populate_newspapers_from_database(self):
-        self.newspapers = {x[1]: x[0] for x in DbNewspaper.objects.values_list('id', 'name')}
-
-    def populate_publications_from_database(self):
-        pub_vl = DbPublication.objects.values_list('id', 'newspaper__name', 'published_date')
-        self.publications = {}
-        for id, newspaper_title, published_date in pub_vl:
-            self.publications[(newspaper_title, published_date)] = id
-
-    def populate_pages_from_database(self):
-        self.pages = {x[0]: x[1] for x in DbPage.objects.values_list('url', 'id')}
-
-    def get_newspaper(self, name):
-        return self.newspapers.get(name, None)
-
-    def get_publication(self, newspaper_title, published_date):
-        return self.publications.get((newspaper_title, published_date), None)
-
-    def get_page(self, url):
-        return self.pages.get(url, None)
-
-    def add_newspaper(self, db_npp):
-        self.newspapers[db_npp.name] = db_npp
-
-    def add_publication(self, newspaper_title, db_pub):
-        self.publications[(newspaper_title, db_pub.published_date)] = db_pub
-
-    def add_pages(self, db_page):
-        self.pages[db_page.url] = db_page
-
-    def save(self):
-        unsaved_npps = [x for x in self.newspapers.values() if not isinstance(x, int)]
-
-        print('Saving {} newspapers'.format(len(unsaved_npps)))
-        DbNewspaper.objects.bulk_create(unsaved_npps)
-        self.populate_newspapers_from_database()
-
-        unsaved_pubs = [x for x in self.publications.values() if not isinstance(x, int)]
-        for pub in unsaved_pubs:
-            if pub.newspaper_id is None or not isinstance(pub.newspaper_id, int):
-                pub.newspaper_id = self.get_newspaper(pub.newspaper_title)
-                if pub.newspaper_id is None:
-                    raise Exception('Newspaper "{}" not found'.format(pub.newspaper_title))
-
-            assert pub.newspaper_id is not None
-
-        print('Saving {} publications'.format(len(unsaved_pubs)))
-        DbPublication.objects.bulk_create(unsaved_pubs)
-        self.populate_publications_from_database()
-
-        unsaved_pages = [x for x in self.pages.values() if not isinstance(x, int)]
-        for page in unsaved_pages:
-            if page.publication_id is None or not isinstance(page.publication_id, int):
-                page.publication_id = self.get_publication(page.newspaper_title, page.published_date)
-                if page.publication_id is None:
-                    raise Exception('Publication "{}/{}" not found'.format(page.newspaper_title, page.published_date))
-                
-            assert page.publication_id is not None
-
-        print('Saving {} pages'.format(len(unsaved_pages)))
-        DbPage.objects.bulk_create(unsaved_pages)
-        self.populate_pages_from_database()
-
-
-class AutoSaveCache:
-    def __init__(self, filename: str, save_freq: int):
-        self.filename = filename
-        self.filename_bak = filename + '.bak'
-        self.save_freq = save_freq
-
-        if os.path.isfile(self.filename):
-            with open(self.filename, 'rb') as f:
-                self.db_storage = pickle.load(f)
-        else:
-            self.db_storage = {}
-
-        self.item_count = len(self.db_storage)
-
-    def get_index(self, url):
-        index = self.db_storage.get(url, None)
-        if index is None:
-            return self.item_count + 1, True
-        return index, False
-
-    def __setitem__(self, key, value):
-        if key in self.db_storage:
-            raise Exception('Key {} already exists'.format(key))
-        self.item_count += 1
-        self.db_storage[key] = self.item_count
-
-        if self.item_count % self.save_freq == 0:
-            with open(self.filename_bak, 'wb') as f:
-                pickle.dump(self.db_storage, f)
-
-            os.rename(self.filename_bak, self.filename)
-            print('Saved cache')
-
-    def save(self):
-        with open(self.filename_bak, 'wb') as f:
-            pickle.dump(self.db_storage, f)
-
-        os.rename(self.filename_bak, self.filename)
-        print('Saved final cache')
-
-
 class SelfQueryOrLoad:
-    def __init__(self, url, cache, browser_wrapper):
+    def __init__(self, url, cache, browser_wrapper, max_retrials=10):
         self.url = url
         self.cache = cache
         self.browser_wrapper = browser_wrapper
+        self.max_retrials = max_retrials
 
-    def _query(self, cache_file_path_zip):
-        query_finished = False
-        response = None
-        while not query_finished:
+    def _query(self):
+        for retrial in range(self.max_retrials):
             try:
-                response = self.browser_wrapper.make_query_retrial_if_fail(self.url)
-                query_finished = True
+                return self.browser_wrapper.make_query_retrial_if_fail(self.url)
             except Exception as e:
                 self.browser_wrapper.reload()
-
-        zf = zipfile.ZipFile(cache_file_path_zip, mode='w', compression=zipfile.ZIP_DEFLATED)
-        try:
-            zf.writestr('content.html', response)
-        finally:
-            zf.close()
-        return response
-
-    def _load(self, cache_file_path_zip):
-        zf = zipfile.ZipFile(cache_file_path_zip, 'r')
-        response = zf.read('content.html').decode('utf-8')
-        return response
+                time.sleep(min(60, 2 ** retrial))
+        raise Exception('Max retrial exceeded for {}'.format(self.url))
 
     def query_or_load(self):
-        cache_index, is_new = self.cache.get_index(self.url)
-        cache_file_path_zip = os.path.join(cache_zip_dir, '{}.zip'.format(cache_index))
-
-        if os.path.isfile(cache_file_path_zip):
-            content = self._load(cache_file_path_zip)
-        else:
-            content = self._query(cache_file_path_zip)
-
-        if is_new:
-            self.cache[self.url] = cache_index
+        content = self.cache.get(self.url)
+        if content is None:
+            content = self._query()
+            self.cache.put(self.url, content)
 
         soup = BeautifulSoup(content, 'html5lib')
         return soup
@@ -351,7 +221,7 @@ class Content(SelfQueryOrLoad):
         db_page.page_number = page_no
         document_text = '\n'.join(document_text)
         document_text = re.sub('[ \t]{2,}', ' ', document_text)
-        db_page.content = re.sub('\n\s+\n', '\n', document_text)
+        db_page.raw_text = re.sub('\n\s+\n', '\n', document_text)
 
         db_storage.add_pages(db_page)
 
@@ -360,8 +230,7 @@ class Command(BaseCommand):
 
     def __init__(self):
         super().__init__()
-        cache_file = os.path.join(cache_dir, 'cache.pkl')
-        self.cache = AutoSaveCache(cache_file, 10)
+        self.cache = PageCache(cache_pack_dir)
         self.browser_wrapper = BrowserWrapper(cache_dir)
         self.db_storage = DbStorage()
 
@@ -396,7 +265,7 @@ class Command(BaseCommand):
             self.db_storage.save()
 
     def finalise(self):
-        self.cache.save()
+        self.cache.close()
 
     def handle(self, *args, **options):
         self.browser_wrapper.auto_solve_captcha = True
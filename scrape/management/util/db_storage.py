@@ -0,0 +1,214 @@
+import hashlib
+
+import numpy as np
+from django.db import connection, transaction
+
+from scrape.models import Newspaper as DbNewspaper
+from scrape.models import Publication as DbPublication
+from scrape.models import Page as DbPage
+
+
+def hash_url(url):
+    """
+    Reduce a URL to a signed 64-bit integer
+    :param url: the URL string
+    :return: an int that fits in np.int64
+    """
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+class UrlIdMap:
+    """
+    A compact url -> id map. URLs are kept as 64-bit hashes in two sorted numpy arrays (16 bytes per entry instead of a
+    Python str + int + dict slot). Newly added entries go into a small dict and are merged into the arrays by `compact()`
+    """
+
+    def __init__(self):
+        self.hashes = np.empty(0, dtype=np.int64)
+        self.ids = np.empty(0, dtype=np.int64)
+        self.recent = {}
+
+    def __len__(self):
+        return len(self.hashes) + len(self.recent)
+
+    def __contains__(self, url):
+        return self.get(url) is not None
+
+    def __setitem__(self, url, id):
+        self.recent[hash_url(url)] = id
+
+    def get(self, url, default=None):
+        key = hash_url(url)
+        id = self.recent.get(key, None)
+        if id is not None:
+            return id
+        pos = np.searchsorted(self.hashes, key)
+        if pos < len(self.hashes) and self.hashes[pos] == key:
+            return int(self.ids[pos])
+        return default
+
+    def load(self, url_id_iterator, chunk_size=100000):
+        """
+        Bulk load (url, id) pairs, e.g. from a values_list() iterator, without holding all URLs in memory at once
+        :param url_id_iterator: iterable of (url, id)
+        :param chunk_size: number of pairs to hash before merging them into the arrays
+        :return: None
+        """
+        for url, id in url_id_iterator:
+            self.recent[hash_url(url)] = id
+            if len(self.recent) >= chunk_size:
+                self.compact()
+        self.compact()
+
+    def compact(self):
+        if len(self.recent) == 0:
+            return
+        new_hashes = np.fromiter(self.recent.keys(), dtype=np.int64, count=len(self.recent))
+        new_ids = np.fromiter(self.recent.values(), dtype=np.int64, count=len(self.recent))
+        hashes = np.concatenate((self.hashes, new_hashes))
+        ids = np.concatenate((self.ids, new_ids))
+
+        # Stable sort keeps the most recent value last among duplicates, which is the one we keep
+        order = np.argsort(hashes, kind='stable')
+        hashes = hashes[order]
+        ids = ids[order]
+        keep = np.ones(len(hashes), dtype=bool)
+        keep[:-1] = hashes[:-1] != hashes[1:]
+
+        self.hashes = hashes[keep]
+        self.ids = ids[keep]
+        self.recent = {}
+
+
+class DbStorage:
+    """
+    Keeps track of what newspapers, publications and pages are already in the database, accumulates new ones in memory
+    and writes them in batches. After each bulk insert only the ids of the newly inserted rows are fetched back, so
+    re-running a scrape costs time proportional to the number of new pages, not to the size of the tables.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.newspapers = None
+        self.publications = None
+        self.pages = UrlIdMap()
+        self.unsaved_pages = {}
+        self.populate_newspapers_from_database()
+        self.populate_publications_from_database()
+        self.populate_pages_from_database()
+
+    def populate_newspapers_from_database(self):
+        self.newspapers = {x[1]: x[0] for x in DbNewspaper.objects.values_list('id', 'name')}
+
+    def populate_publications_from_database(self):
+        pub_vl = DbPublication.objects.values_list('id', 'newspaper__name', 'published_date')
+        self.publications = {}
+        for id, newspaper_title, published_date in pub_vl:
+            self.publications[(newspaper_title, published_date)] = id
+
+    def populate_pages_from_database(self):
+        self.pages = UrlIdMap()
+        self.pages.load(DbPage.objects.values_list('url', 'id').iterator())
+
+    def get_newspaper(self, name):
+        return self.newspapers.get(name, None)
+
+    def get_publication(self, newspaper_title, published_date):
+        return self.publications.get((newspaper_title, published_date), None)
+
+    def get_page(self, url):
+        page = self.unsaved_pages.get(url, None)
+        if page is not None:
+            return page
+        return self.pages.get(url)
+
+    def add_newspaper(self, db_npp):
+        self.newspapers[db_npp.name] = db_npp
+
+    def add_publication(self, newspaper_title, db_pub):
+        self.publications[(newspaper_title, db_pub.published_date)] = db_pub
+
+    def add_pages(self, db_page):
+        self.unsaved_pages[db_page.url] = db_page
+
+    def _bulk_create(self, model, objs):
+        """
+        Insert objs in batches. Returns True if the database backend has set the primary keys on the objects
+        """
+        with transaction.atomic():
+            for i in range(0, len(objs), self.batch_size):
+                model.objects.bulk_create(objs[i:i + self.batch_size])
+        # The feature was renamed can_return_rows_from_bulk_insert in Django 3.0
+        return getattr(connection.features, 'can_return_rows_from_bulk_insert',
+                       getattr(connection.features, 'can_return_ids_from_bulk_insert', False))
+
+    def _save_newspapers(self):
+        unsaved_npps = [x for x in self.newspapers.values() if not isinstance(x, int)]
+        if len(unsaved_npps) == 0:
+            return
+
+        print('Saving {} newspapers'.format(len(unsaved_npps)))
+        if self._bulk_create(DbNewspaper, unsaved_npps):
+            id_by_name = {x.name: x.id for x in unsaved_npps}
+        else:
+            names = [x.name for x in unsaved_npps]
+            id_by_name = dict(DbNewspaper.objects.filter(name__in=names).values_list('name', 'id'))
+        self.newspapers.update(id_by_name)
+
+    def _save_publications(self):
+        unsaved_pubs = [x for x in self.publications.values() if not isinstance(x, int)]
+        if len(unsaved_pubs) == 0:
+            return
+
+        for pub in unsaved_pubs:
+            if pub.newspaper_id is None or not isinstance(pub.newspaper_id, int):
+                pub.newspaper_id = self.get_newspaper(pub.newspaper_title)
+                if pub.newspaper_id is None:
+                    raise Exception('Newspaper "{}" not found'.format(pub.newspaper_title))
+
+            assert pub.newspaper_id is not None
+
+        print('Saving {} publications'.format(len(unsaved_pubs)))
+        if self._bulk_create(DbPublication, unsaved_pubs):
+            id_by_key = {(x.newspaper_title, x.published_date): x.id for x in unsaved_pubs}
+        else:
+            wanted = {(x.newspaper_title, x.published_date) for x in unsaved_pubs}
+            newspaper_ids = {x.newspaper_id for x in unsaved_pubs}
+            pub_vl = DbPublication.objects.filter(newspaper_id__in=newspaper_ids)\
+                .values_list('id', 'newspaper__name', 'published_date')
+            id_by_key = {(name, date): id for id, name, date in pub_vl if (name, date) in wanted}
+        self.publications.update(id_by_key)
+
+    def _save_pages(self):
+        unsaved_pages = list(self.unsaved_pages.values())
+        if len(unsaved_pages) == 0:
+            return
+
+        for page in unsaved_pages:
+            if page.publication_id is None or not isinstance(page.publication_id, int):
+                page.publication_id = self.get_publication(page.newspaper_title, page.published_date)
+                if page.publication_id is None:
+                    raise Exception('Publication "{}/{}" not found'.format(page.newspaper_title, page.published_date))
+
+            assert page.publication_id is not None
+
+        print('Saving {} pages'.format(len(unsaved_pages)))
+        if self._bulk_create(DbPage, unsaved_pages):
+            for page in unsaved_pages:
+                self.pages[page.url] = page.id
+        else:
+            # Pages are looked up through the indexed publication FK rather than by URL
+            publication_ids = list({x.publication_id for x in unsaved_pages})
+            for i in range(0, len(publication_ids), self.batch_size):
+                page_vl = DbPage.objects.filter(publication_id__in=publication_ids[i:i + self.batch_size])\
+                    .values_list('url', 'id')
+                for url, id in page_vl.iterator():
+                    if url in self.unsaved_pages:
+                        self.pages[url] = id
+        self.pages.compact()
+        self.unsaved_pages = {}
+
+    def save(self):
+        self._save_newspapers()
+        self._save_publications()
+        self._save_pages()
@@ -0,0 +1,277 @@
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class FetchFailedException(Exception):
+    def __init__(self, url, reason):
+        super(FetchFailedException, self).__init__('Failed to fetch {}: {}'.format(url, reason))
+        self.url = url
+        self.reason = reason
+
+
+class RetryableException(Exception):
+    def __init__(self, reason, retry_after=None):
+        super(RetryableException, self).__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class RateLimiter:
+    """
+    Spaces out request start times so that no more than `rate` requests start per second.
+    Must only be used from within one event loop
+    """
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.next_slot = 0
+
+    async def wait(self):
+        if self.interval == 0:
+            return
+        now = asyncio.get_event_loop().time()
+        slot = max(now, self.next_slot)
+        self.next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class HostPolicy:
+    """
+    Concurrency limit and rate limit for one host
+    """
+
+    def __init__(self, max_concurrency, requests_per_second):
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.rate_limiter = RateLimiter(requests_per_second)
+
+
+class BrowserPool:
+    """
+    A small pool of BrowserWrapper instances, used only for pages that cannot be fetched with plain HTTP (e.g. when a
+    captcha has to be solved). Browser calls are blocking so they run in the default executor.
+    """
+
+    def __init__(self, browser_factory, size):
+        self.browser_factory = browser_factory
+        self.size = size
+        self.browsers = []
+        self.idle = None
+
+    async def _acquire(self):
+        if self.idle is None:
+            self.idle = asyncio.Queue()
+        if self.idle.empty() and len(self.browsers) < self.size:
+            browser = self.browser_factory()
+            self.browsers.append(browser)
+            return browser
+        return await self.idle.get()
+
+    async def fetch(self, url):
+        loop = asyncio.get_event_loop()
+        browser = await self._acquire()
+        try:
+            return await loop.run_in_executor(None, browser.make_query_retrial_if_fail, url)
+        except Exception as e:
+            await loop.run_in_executor(None, browser.reload)
+            raise RetryableException('Browser error: {}'.format(e))
+        finally:
+            self.idle.put_nowait(browser)
+
+    def close(self):
+        for browser in self.browsers:
+            if browser.browser_initiated:
+                browser.browser.quit()
+        self.browsers = []
+        self.idle = None
+
+
+class FetchStats:
+    def __init__(self):
+        self.requests = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.retries = 0
+        self.browser_fallbacks = 0
+        self.start_time = time.time()
+
+    def __str__(self):
+        elapsed = time.time() - self.start_time
+        rate = self.succeeded / elapsed if elapsed > 0 else 0
+        return 'Fetched {} pages in {:.1f}s ({:.2f} pages/s), {} requests, {} retries, {} browser fallbacks, {} failed'\
+            .format(self.succeeded, elapsed, rate, self.requests, self.retries, self.browser_fallbacks, self.failed)
+
+
+class AsyncFetcher:
+    """
+    Fetch pages concurrently with plain HTTP, falling back to a pool of browsers only when `needs_browser` says the HTTP
+    response is not usable.
+
+    Politeness is enforced per host: at most `max_per_host` requests in flight and at most `requests_per_second`
+    request starts per second. Failed requests (connection errors, timeouts, 429 and 5xx) are retried with exponential
+    backoff and jitter, up to `max_retries` per URL and `retry_budget` retries for the whole run (None = unlimited).
+    Once the budget is spent, further failures are recorded in `self.failures` instead of being retried.
+    """
+
+    def __init__(self, max_per_host=4, requests_per_second=2.0, max_retries=5, retry_budget=None, backoff_base=1.0,
+                 backoff_max=60.0, timeout=60, headers=None, needs_browser=None, browser_factory=None,
+                 browser_pool_size=1, max_workers=None):
+        self.max_per_host = max_per_host
+        self.requests_per_second = requests_per_second
+        self.max_retries = max_retries
+        self.retry_budget = retry_budget
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.headers = headers
+        self.needs_browser = needs_browser
+        self.browser_pool = BrowserPool(browser_factory, browser_pool_size) if browser_factory is not None else None
+        self.max_workers = max_workers or max_per_host * 4
+
+        self.host_policies = {}
+        self.retries_left = retry_budget
+        self.failures = {}
+        self.stats = None
+
+    def _host_policy(self, url):
+        host = urlsplit(url).netloc
+        policy = self.host_policies.get(host, None)
+        if policy is None:
+            policy = HostPolicy(self.max_per_host, self.requests_per_second)
+            self.host_policies[host] = policy
+        return policy
+
+    def _backoff_delay(self, attempt, retry_after=None):
+        if retry_after is not None:
+            return min(self.backoff_max, retry_after)
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    async def _http_get(self, session, url):
+        async with session.get(url) as response:
+            if response.status in RETRY_STATUSES:
+                retry_after = response.headers.get('Retry-After', None)
+                retry_after = float(retry_after) if retry_after is not None and retry_after.isdigit() else None
+                raise RetryableException('HTTP {}'.format(response.status), retry_after)
+            if response.status >= 400:
+                raise FetchFailedException(url, 'HTTP {}'.format(response.status))
+            return await response.text()
+
+    async def _fetch_once(self, session, url):
+        policy = self._host_policy(url)
+        async with policy.semaphore:
+            await policy.rate_limiter.wait()
+            self.stats.requests += 1
+            try:
+                content = await self._http_get(session, url)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise RetryableException('{}: {}'.format(type(e).__name__, e))
+
+            if self.needs_browser is not None and self.needs_browser(url, content):
+                if self.browser_pool is None:
+                    raise FetchFailedException(url, 'Page requires a browser but no browser_factory was given')
+                self.stats.browser_fallbacks += 1
+                content = await self.browser_pool.fetch(url)
+            return content
+
+    async def fetch(self, session, url):
+        """
+        Fetch one URL, retrying within the limits set on this fetcher
+        :raises FetchFailedException: if the page could not be fetched
+        """
+        attempt = 0
+        while True:
+            try:
+                return await self._fetch_once(session, url)
+            except RetryableException as e:
+                if attempt >= self.max_retries:
+                    raise FetchFailedException(url, 'Max retrials exceeded, last error: {}'.format(e.reason))
+                if self.retries_left is not None:
+                    if self.retries_left <= 0:
+                        raise FetchFailedException(url, 'Retry budget exhausted, last error: {}'.format(e.reason))
+                    self.retries_left -= 1
+                self.stats.retries += 1
+                await asyncio.sleep(self._backoff_delay(attempt, e.retry_after))
+                attempt += 1
+
+    async def _worker(self, session, queue, seen, on_page, load_cached):
+        while True:
+            url = await queue.get()
+            try:
+                content = load_cached(url) if load_cached is not None else None
+                if content is None:
+                    content = await self.fetch(session, url)
+                    self.stats.succeeded += 1
+                next_urls = on_page(url, content)
+                if next_urls:
+                    for next_url in next_urls:
+                        if next_url not in seen:
+                            seen.add(next_url)
+                            queue.put_nowait(next_url)
+            except FetchFailedException as e:
+                self.stats.failed += 1
+                self.failures[url] = e.reason
+                print(e)
+            except Exception as e:
+                self.stats.failed += 1
+                self.failures[url] = '{}: {}'.format(type(e).__name__, e)
+                print('Error processing {}: {}'.format(url, e))
+            finally:
+                queue.task_done()
+
+    async def crawl_async(self, start_urls, on_page, load_cached=None):
+        self.stats = FetchStats()
+        self.host_policies = {}
+        queue = asyncio.Queue()
+        seen = set()
+        for url in start_urls:
+            if url not in seen:
+                seen.add(url)
+                queue.put_nowait(url)
+
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        connector = aiohttp.TCPConnector(limit_per_host=self.max_per_host)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector, headers=self.headers) as session:
+            workers = [asyncio.ensure_future(self._worker(session, queue, seen, on_page, load_cached))
+                       for _ in range(self.max_workers)]
+            try:
+                await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        return self.stats
+
+    def crawl(self, start_urls, on_page, load_cached=None):
+        """
+        Fetch `start_urls` and every URL returned by `on_page`, each at most once.
+        :param start_urls: iterable of URLs to start from
+        :param on_page: callable(url, content) -> iterable of URLs to fetch next, or None. It is called from the event
+                        loop thread, one page at a time, so it does not need to be thread safe
+        :param load_cached: optional callable(url) -> content or None. If it returns the content, the URL is not fetched
+                            but on_page is still called so that links on cached pages are followed
+        :return: a FetchStats
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(self.crawl_async(start_urls, on_page, load_cached))
+        finally:
+            loop.close()
+            if self.browser_pool is not None:
+                self.browser_pool.close()
+
+    def fetch_all(self, urls, on_page, load_cached=None):
+        """
+        Same as crawl() but does not follow any links
+        """
+        def on_page_no_follow(url, content):
+            on_page(url, content)
+
+        return self.crawl(urls, on_page_no_follow, load_cached)
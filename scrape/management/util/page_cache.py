@@ -0,0 +1,218 @@
+import hashlib
+import os
+import pathlib
+import struct
+import zlib
+
+# Pack record: magic, url length, compressed data length (0 for a reference to identical content stored earlier),
+# content digest, followed by the url and the compressed data
+RECORD_HEADER = struct.Struct('<4sII16s')
+RECORD_MAGIC = b'PGC1'
+
+# Index entry: url hash, content digest, data offset, compressed data length, end offset of the pack record
+INDEX_ENTRY = struct.Struct('<q16sQIQ')
+
+
+def hash_url(url):
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'little', signed=True)
+
+
+def hash_content(content):
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+def read_page(f, offset, length):
+    """
+    Read one page from an open pack file, given its location as returned by PageCache.location() or iter_locations()
+    """
+    f.seek(offset)
+    return zlib.decompress(f.read(length)).decode('utf-8')
+
+
+class PageCache:
+    """
+    An append-only, content-addressed store for fetched pages.
+
+    All pages live in one pack file (`<name>.pack`), each record zlib-compressed and written with a single append, so a
+    crash can at worst leave a truncated last record, which is discarded on the next open. Pages with identical content
+    are stored once. The index (`<name>.idx`) is a log of fixed-size entries appended after each record and read into
+    memory on open: adding a page costs one append to each file and looking one up costs one seek into the pack.
+    If the index is behind the pack (e.g. after a crash between the two appends) it is caught up by scanning the tail
+    of the pack.
+
+    Only one process may write to a store at a time. Any number of processes can read it.
+    """
+
+    def __init__(self, directory, name='pages', compress_level=6, readonly=False):
+        pathlib.Path(directory).mkdir(parents=True, exist_ok=True)
+        self.pack_file = os.path.join(directory, name + '.pack')
+        self.index_file = os.path.join(directory, name + '.idx')
+        self.compress_level = compress_level
+        self.readonly = readonly
+
+        self.locations = {}
+        self.contents = {}
+        self.pack_end = 0
+
+        self._load_index()
+        if not readonly:
+            self._recover()
+            self.pack_fd = os.open(self.pack_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            self.index_fd = os.open(self.index_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.reader = open(self.pack_file, 'rb') if os.path.isfile(self.pack_file) else None
+
+    def _add_to_memory(self, url_hash, digest, offset, length, record_end):
+        self.locations[url_hash] = (offset, length)
+        self.contents[digest] = (offset, length)
+        self.pack_end = max(self.pack_end, record_end)
+
+    def _load_index(self):
+        if not os.path.isfile(self.index_file):
+            return
+        with open(self.index_file, 'rb') as f:
+            data = f.read()
+        # A partially written trailing entry is ignored here and overwritten by _recover()
+        usable = len(data) - len(data) % INDEX_ENTRY.size
+        for url_hash, digest, offset, length, record_end in INDEX_ENTRY.iter_unpack(data[:usable]):
+            self._add_to_memory(url_hash, digest, offset, length, record_end)
+
+    def _recover(self):
+        if os.path.isfile(self.index_file):
+            index_size = os.path.getsize(self.index_file)
+            if index_size % INDEX_ENTRY.size != 0:
+                os.truncate(self.index_file, index_size - index_size % INDEX_ENTRY.size)
+
+        if not os.path.isfile(self.pack_file):
+            return
+        pack_size = os.path.getsize(self.pack_file)
+        if pack_size == self.pack_end:
+            return
+
+        entries = []
+        valid_end = self.pack_end
+        with open(self.pack_file, 'rb') as f:
+            for url, digest, offset, length, record_end in self._scan(f, self.pack_end, pack_size):
+                if length == 0:
+                    offset, length = self.contents[digest]
+                url_hash = hash_url(url)
+                self._add_to_memory(url_hash, digest, offset, length, record_end)
+                entries.append(INDEX_ENTRY.pack(url_hash, digest, offset, length, record_end))
+                valid_end = record_end
+
+        if valid_end < pack_size:
+            print('Discarding {} bytes of incomplete record at the end of {}'.format(pack_size - valid_end,
+                                                                                     self.pack_file))
+            os.truncate(self.pack_file, valid_end)
+        if len(entries) > 0:
+            print('Recovered {} index entries from {}'.format(len(entries), self.pack_file))
+            with open(self.index_file, 'ab') as f:
+                f.write(b''.join(entries))
+
+    @staticmethod
+    def _scan(f, start, end):
+        """
+        Yield (url, digest, data offset, data length, record end) of complete records between start and end
+        """
+        position = start
+        f.seek(position)
+        while position + RECORD_HEADER.size <= end:
+            header = f.read(RECORD_HEADER.size)
+            magic, url_length, length, digest = RECORD_HEADER.unpack(header)
+            if magic != RECORD_MAGIC:
+                return
+            record_end = position + RECORD_HEADER.size + url_length + length
+            if record_end > end:
+                return
+            url = f.read(url_length).decode('utf-8')
+            offset = position + RECORD_HEADER.size + url_length
+            f.seek(length, os.SEEK_CUR)
+            yield url, digest, offset, length, record_end
+            position = record_end
+
+    def __len__(self):
+        return len(self.locations)
+
+    def __contains__(self, url):
+        return hash_url(url) in self.locations
+
+    def location(self, url):
+        """
+        :return: (offset, length) of the compressed content of url in the pack file, or None
+        """
+        return self.locations.get(hash_url(url), None)
+
+    def read_at(self, offset, length):
+        if self.reader is None:
+            self.reader = open(self.pack_file, 'rb')
+        return read_page(self.reader, offset, length)
+
+    def get(self, url, default=None):
+        location = self.locations.get(hash_url(url), None)
+        if location is None:
+            return default
+        return self.read_at(*location)
+
+    def put(self, url, content):
+        if self.readonly:
+            raise Exception('Cache {} is opened read-only'.format(self.pack_file))
+
+        content_bytes = content.encode('utf-8')
+        url_bytes = url.encode('utf-8')
+        digest = hash_content(content_bytes)
+        existing = self.contents.get(digest, None)
+        data = b'' if existing is not None else zlib.compress(content_bytes, self.compress_level)
+
+        record = RECORD_HEADER.pack(RECORD_MAGIC, len(url_bytes), len(data), digest) + url_bytes + data
+        record_start = self.pack_end
+        os.write(self.pack_fd, record)
+        record_end = record_start + len(record)
+
+        if existing is not None:
+            offset, length = existing
+        else:
+            offset, length = record_start + RECORD_HEADER.size + len(url_bytes), len(data)
+
+        url_hash = hash_url(url)
+        os.write(self.index_fd, INDEX_ENTRY.pack(url_hash, digest, offset, length, record_end))
+        self._add_to_memory(url_hash, digest, offset, length, record_end)
+
+    def __setitem__(self, url, content):
+        self.put(url, content)
+
+    def __getitem__(self, url):
+        content = self.get(url)
+        if content is None:
+            raise KeyError(url)
+        return content
+
+    def iter_locations(self):
+        """
+        Walk the pack file once, yielding (url, offset, length) for the latest version of each url.
+        Use read_at() to get the content
+        """
+        if not os.path.isfile(self.pack_file):
+            return
+        yielded = set()
+        with open(self.pack_file, 'rb') as f:
+            for url, digest, offset, length, record_end in self._scan(f, 0, self.pack_end):
+                url_hash = hash_url(url)
+                location = self.locations.get(url_hash, None)
+                # Skip superseded versions of a page: only the record the index currently points to is yielded
+                if url_hash not in yielded and location == self.contents.get(digest, None):
+                    yielded.add(url_hash)
+                    yield url, location[0], location[1]
+
+    def flush(self):
+        if not self.readonly:
+            os.fsync(self.pack_fd)
+            os.fsync(self.index_fd)
+
+    def close(self):
+        if not self.readonly:
+            self.flush()
+            os.close(self.pack_fd)
+            os.close(self.index_fd)
+            self.readonly = True
+        if self.reader is not None:
+            self.reader.close()
+            self.reader = None
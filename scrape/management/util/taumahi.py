@@ -1,6 +1,9 @@
 import os
 import re
 import sys
+from collections import Counter
+
+import numpy as np
 
 
 oropuare = "aāeēiīoōuū"
@@ -8,6 +11,12 @@ orokati = "hkmnprtwŋƒ"
 no_tohutō = ''.maketrans({'ā': 'a', 'ē': 'e', 'ī': 'i', 'ō': 'o', 'ū': 'u'})
 arapū = "AaĀāEeĒēIiĪīOoŌōUuŪūHhKkMmNnPpRrTtWwŊŋƑƒ-"
 
+# Patterns used on every word, compiled once
+hōputu_takitahi_tauira = re.compile(r'(w\')|(w’)|(wh)|(ng)|(W\')|(W’)|(Wh)|(Ng)|(WH)|(NG)')
+hōputu_takirua_tauira = re.compile(r'(ŋ)|(ƒ)|(Ŋ)|(Ƒ)')
+orokati_rua_tauira = re.compile("[{o}][{o}]".format(o=orokati))
+kupu_tauira = re.compile('(?!-)(?!{p}*--{p}*)({p}+)(?<!-)'.format(p='[a-zāēīōū\-’\']'), flags=re.IGNORECASE)
+
 
 def whakatakitahi(tauriterite):
     # If passed the appropriate letters, return the corresponding symbol
@@ -40,34 +49,18 @@ def hōputu(kupu, hōputu_takitahi=True):
     # consonants are easier to deal with in unicode format
     # The Boolean variable determines whether it's encoding or decoding
     # (set False if decoding)
-    if isinstance(kupu, list):
+    if isinstance(kupu, dict):
+        kupu = kupu.keys()
+    if isinstance(kupu, str):
         if hōputu_takitahi:
-            return [re.sub(r'(w\')|(w’)|(wh)|(ng)|(W\')|(W’)|(Wh)|(Ng)|(WH)|(NG)', whakatakitahi, whakatomo) for whakatomo in kupu]
+            return hōputu_takitahi_tauira.sub(whakatakitahi, kupu)
         else:
-            return [re.sub(r'(ŋ)|(ƒ)|(Ŋ)|(Ƒ)', whakatakirua, whakatomo) for whakatomo in kupu]
-    elif isinstance(kupu, dict):
-        if hōputu_takitahi:
-            return [re.sub(r'(w\')|(w’)|(wh)|(ng)|(W\')|(W’)|(Wh)|(Ng)|(WH)|(NG)', whakatakitahi, whakatomo) for whakatomo in kupu.keys()]
-        else:
-            return [re.sub(r'(ŋ)|(ƒ)|(Ŋ)|(Ƒ)', whakatakirua, whakatomo) for whakatomo in kupu.keys()]
-    else:
-        if hōputu_takitahi:
-            return re.sub(r'(w\')|(w’)|(wh)|(ng)|(W\')|(W’)|(Wh)|(Ng)|(WH)|(NG)', whakatakitahi, kupu)
-        else:
-            return re.sub(r'(ŋ)|(ƒ)|(Ŋ)|(Ƒ)', whakatakirua, kupu)
-
-
-def kōmiri_kupu(kupu_tōkau, kūare_tohutō=True):
-    # Removes words that contain any English characters from the string above,
-    # returns dictionaries of word counts for three categories of Māori words:
-    # Māori, ambiguous, non-Māori (Pākehā)
-    # Set kūare_tohutō = True to become sensitive to the presence of macrons when making the match
+            return hōputu_takirua_tauira.sub(whakatakirua, kupu)
+    return [hōputu(whakatomo, hōputu_takitahi) for whakatomo in kupu]
 
-    # Splits the raw text along characters that a
-    kupu_hou = re.findall('(?!-)(?!{p}*--{p}*)({p}+)(?<!-)'.format(
-        p='[a-zāēīōū\-’\']'), kupu_tōkau, flags=re.IGNORECASE)
 
-    rootpath = ''
+def tiki_kōnae_tūtira(kūare_tohutō=True):
+    # Returns the paths to the files of English and ambiguous words
     try:
         root = __file__
         if os.path.islink(root):
@@ -78,67 +71,129 @@ def kōmiri_kupu(kupu_tōkau, kūare_tohutō=True):
         print("There is no __file__ variable. Please contact the author.")
         sys.exit()
 
-    # Reads the file lists of English and ambiguous words into list variables
-    kōnae_pākehā, kōnae_rangirua = open(dirpath + "/kupu_kino.txt" if kūare_tohutō else dirpath + "/kupu_kino_kūare_tohutō.txt", "r"), open(
-        dirpath + "/kupu_rangirua.txt" if kūare_tohutō else dirpath + "/kupu_rangirua_kūare_tohutō.txt", "r")
-    kupu_pākehā = kōnae_pākehā.read().split()
-    kupu_rangirua = kōnae_rangirua.read().split()
-    kōnae_pākehā.close(), kōnae_rangirua.close()
-
-    # Setting up the dictionaries in which the words in the text will be placed
-    raupapa_māori, raupapa_rangirua, raupapa_pākehā = {}, {}, {}
-
-    kupu_hou, kupu_pākehā, kupu_rangirua = hōputu(
-        kupu_hou), hōputu(kupu_pākehā), hōputu(kupu_rangirua)
-
-    # Puts each word through tests to determine which word frequency dictionary
-    # it should be referred to. Goes to the ambiguous dictionary if it's in the
-    # ambiguous list, goes to the Māori dictionary if it doesn't have consecutive
-    # consonants, doesn't end in a consnant, doesn't have any english letters
-    # and isn't one of the provided stop words. Otherwise it goes to the non-Māori
-    # dictionary. If this word hasn't been added to the dictionary, it does so,
-    # and adds a count for every time the corresponding word gets passed to the
-    # dictionary.
-
-    for kupu in kupu_hou:
-        if kupu.lower() in kupu_rangirua:
-            kupu = hōputu(kupu, False)
-            if kupu not in raupapa_rangirua:
-                raupapa_rangirua[kupu] = 0
-            raupapa_rangirua[kupu] += 1
-            continue
-        elif not (re.compile("[{o}][{o}]".format(o=orokati)).search(kupu.lower()) or (kupu[-1].lower() in orokati) or any(pūriki not in arapū for pūriki in kupu.lower()) or (kupu.lower() in kupu_pākehā)):
-            kupu = hōputu(kupu, False)
-            if kupu not in raupapa_māori:
-                raupapa_māori[kupu] = 0
-            raupapa_māori[kupu] += 1
-            continue
+    if kūare_tohutō:
+        return dirpath + "/kupu_kino.txt", dirpath + "/kupu_rangirua.txt"
+    return dirpath + "/kupu_kino_kūare_tohutō.txt", dirpath + "/kupu_rangirua_kūare_tohutō.txt"
+
+
+class WordClassifier:
+    """
+    Sorts words into Māori, ambiguous and non-Māori (Pākehā). The word lists are read and encoded with hōputu once,
+    and kept as frozensets. The category of each distinct word is remembered, so classifying a large corpus costs little
+    more than tokenizing it. Use get_classifier() to share one instance per process.
+    """
+    MĀORI = 0
+    RANGIRUA = 1
+    PĀKEHĀ = 2
+
+    def __init__(self, kūare_tohutō=True, max_cached_words=1000000):
+        kōnae_pākehā, kōnae_rangirua = tiki_kōnae_tūtira(kūare_tohutō)
+        with open(kōnae_pākehā, "r") as f:
+            self.kupu_pākehā = frozenset(hōputu(f.read().split()))
+        with open(kōnae_rangirua, "r") as f:
+            self.kupu_rangirua = frozenset(hōputu(f.read().split()))
+        self.arapū = frozenset(arapū)
+        self.orokati = frozenset(orokati)
+        self.max_cached_words = max_cached_words
+        self.categories = {}
+
+    def tokenize(self, kupu_tōkau):
+        return kupu_tauira.findall(kupu_tōkau)
+
+    def classify_word(self, kupu):
+        # Goes to the ambiguous category if it's in the ambiguous list, to the Māori category if it doesn't have
+        # consecutive consonants, doesn't end in a consonant, doesn't have any english letters and isn't one of the
+        # provided stop words. Otherwise it is non-Māori.
+        category = self.categories.get(kupu, None)
+        if category is not None:
+            return category
+
+        kupu_iti = hōputu(kupu).lower()
+        if kupu_iti in self.kupu_rangirua:
+            category = self.RANGIRUA
+        elif not (orokati_rua_tauira.search(kupu_iti) or (kupu_iti[-1] in self.orokati)
+                  or not self.arapū.issuperset(kupu_iti) or (kupu_iti in self.kupu_pākehā)):
+            category = self.MĀORI
         else:
-            kupu = hōputu(kupu, False)
-            if kupu not in raupapa_pākehā:
-                raupapa_pākehā[kupu] = 0
-            raupapa_pākehā[kupu] += 1
+            category = self.PĀKEHĀ
 
-    return raupapa_māori, raupapa_rangirua, raupapa_pākehā
+        if len(self.categories) >= self.max_cached_words:
+            self.categories = {}
+        self.categories[kupu] = category
+        return category
 
+    def kōmiri(self, kupu_tōkau):
+        # Returns dictionaries of word counts for the three categories: Māori, ambiguous, non-Māori
+        raupapa = ({}, {}, {})
+        for kupu, tatau in Counter(self.tokenize(kupu_tōkau)).items():
+            rārangi = raupapa[self.classify_word(kupu)]
+            kupu = hōputu(hōputu(kupu), False)
+            rārangi[kupu] = rārangi.get(kupu, 0) + tatau
+        return raupapa
 
-def tiki_ōrau(kōwae):
-    # Uses the kōmiri_kupu function from the taumahi module to estimate how
-    # Much of the text is Māori. Input is a string of text, output is a percentage string
+    def count(self, kupu_tōkau):
+        # Returns the number of Māori, ambiguous and non-Māori words in the text
+        tatau = [0, 0, 0]
+        for kupu, tatau_kupu in Counter(self.tokenize(kupu_tōkau)).items():
+            tatau[self.classify_word(kupu)] += tatau_kupu
+        return tatau
 
-    # Gets the word frequency dictionaries for the input text
-    raupapa_maori, raupapa_rangirua, raupapa_pakeha = kōmiri_kupu(kōwae, False)
+    def classify(self, texts):
+        """
+        Count words of each category in many texts
+        :param texts: iterable of str
+        :return: an int64 array of shape (len(texts), 3), columns are Māori, ambiguous and non-Māori counts
+        """
+        return np.array([self.count(kupu_tōkau) for kupu_tōkau in texts], dtype=np.int64).reshape(-1, 3)
 
-    # Calculates how many words of the maori and English dictionary there are
-    tatau_maori = sum(raupapa_maori.values())
-    tatau_rangirua = sum(raupapa_rangirua.values())
-    tatau_pakeha = sum(raupapa_pakeha.values())
-    tatau_kapa = tatau_maori + tatau_pakeha
-    tatau_tapeke = tatau_kapa + tatau_rangirua
 
+kaikōmiri = {}
+
+
+def get_classifier(kūare_tohutō=True):
+    classifier = kaikōmiri.get(kūare_tohutō, None)
+    if classifier is None:
+        classifier = WordClassifier(kūare_tohutō)
+        kaikōmiri[kūare_tohutō] = classifier
+    return classifier
+
+
+def kōmiri_kupu(kupu_tōkau, kūare_tohutō=True):
+    # Removes words that contain any English characters from the string above,
+    # returns dictionaries of word counts for three categories of Māori words:
+    # Māori, ambiguous, non-Māori (Pākehā)
+    # Set kūare_tohutō = True to become sensitive to the presence of macrons when making the match
+    return get_classifier(kūare_tohutō).kōmiri(kupu_tōkau)
+
+
+def tatau_ōrau(tatau_maori, tatau_rangirua, tatau_pakeha):
     # Provided there are some words that are categorised as maori or English,
-    # It calculates how many maori words there are compared to the sum, and
-    # Returns the percentage as a string
-    orau = 0.00 if (not tatau_kapa != 0) else round((tatau_maori / tatau_kapa) * 100, 2)
+    # It calculates how many maori words there are compared to the sum
+    tatau_kapa = tatau_maori + tatau_pakeha
+    return 0.00 if (not tatau_kapa != 0) else round((tatau_maori / tatau_kapa) * 100, 2)
+
+
+def tiki_ōrau(kōwae):
+    # Uses the kōmiri_kupu function from the taumahi module to estimate how
+    # Much of the text is Māori. Input is a string of text, output is a percentage string
 
-    return tatau_maori, tatau_rangirua, tatau_pakeha, tatau_tapeke, orau
\ No newline at end of file
+    # Gets the word counts for the input text
+    tatau_maori, tatau_rangirua, tatau_pakeha = get_classifier(False).count(kōwae)
+    tatau_tapeke = tatau_maori + tatau_pakeha + tatau_rangirua
+    orau = tatau_ōrau(tatau_maori, tatau_rangirua, tatau_pakeha)
+
+    return tatau_maori, tatau_rangirua, tatau_pakeha, tatau_tapeke, orau
+
+
+def tiki_ōrau_maha(ngā_kōwae):
+    """
+    Batch version of tiki_ōrau
+    :param ngā_kōwae: iterable of texts
+    :return: (counts, percentages): counts is an int64 array of shape (n, 4) with columns Māori, ambiguous, non-Māori
+             and total word counts, percentages is a float array of the percentage of Māori words, rounded as tiki_ōrau
+    """
+    tatau = get_classifier(False).classify(ngā_kōwae)
+    tatau_kapa = tatau[:, 0] + tatau[:, 2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        orau = np.where(tatau_kapa != 0, np.round(tatau[:, 0] / tatau_kapa * 100, 2), 0.0)
+    return np.column_stack((tatau, tatau.sum(axis=1))), orau
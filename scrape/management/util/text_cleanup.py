@@ -0,0 +1,205 @@
+import re
+
+from scrape.management.util.taumahi import tiki_ōrau
+
+
+def clean_whitespace(paragraph):
+    return re.sub(r'\s+', ' ', paragraph).strip()
+
+
+# Punctuation that will be searched for, and stripped respectively. The former indicates the end of a paragraph if followed by a new line character.
+tohutuhi = ".!?"
+tohukī = "‘’\'\") "
+
+
+def mātītori_kupu(kupu):
+    return re.findall(r'[\w\W]*?[{}][{}]*\n|[\w\W]+$'.format(tohutuhi, tohukī), kupu)
+
+
+def rīwhi_tauriterite(kimikimi, taumahi_ingoa, kōwae):
+    # Finds all matches to the input regex, in the input text, using the input string to determine what to replace the match with
+    # The first argument is a regex expression, the second is a string containing a function name from the tau module, the third is the text that is to be modified
+    ngā_whakataki_tūtira = re.compile(kimikimi).findall(kōwae)
+    for ngā_whakataki in ngā_whakataki_tūtira:
+        whakataki = ngā_whakataki[0].strip()
+        kupu = " "
+        if taumahi_ingoa == "rā_kupu":
+            kupu += "<date>"
+        elif taumahi_ingoa == "tāima_kupu":
+            kupu += "<time>"
+        else:
+            kupu += "<number>"
+        kupu += " "
+        kōwae = kōwae.replace(whakataki, kupu)
+    return kōwae
+
+
+def tohutau(kupu):
+    # Formats text in a way suitable for the irstlm language model
+    kupu = re.sub(r'w[”“"\'`‘’´]', 'wh', kupu.lower())
+    kupu = re.sub(r'[—–]', '-', kupu)
+    kupu = re.sub(r'([^A-Za-zĀĒĪŌŪāēīōū\s])', r' \1 ', kupu)
+    kupu = re.sub(r'< (date|number|time) >', r'<\1>', kupu)
+    kupu = re.sub(r'-', r'@-@', kupu)
+    return "<s> " + clean_whitespace(kupu) + " </s>"
+
+
+def unu_kupu_tōkau(hupa, tau):
+    # Extracts the text for all pages of the issue it has been passed.
+    # It takes a tuple and a list. The tuple has the newspaper name, issue name
+    # And issue link. The list is of tuples containing each page of the issue's
+    # Number, soup and url. It outputs a list of tuples, which contain each page
+    # Of an issue's number, text and url.
+
+    # Simplify the soup to the area we are interested in
+    kupu_tōkau = hupa.select('div.documenttext')[0].find('td')
+
+    # Must determine there is a div.documenttext, because .text will raise an error if it kupu_tōkau is None
+    if kupu_tōkau != None:
+        if kupu_tōkau.text:
+            # If it can find text, it returns it
+            return kupu_tōkau.text
+        else:
+            # If there is no text found, print an error
+            print("Failed to extract text from page " + tau)
+    else:
+        print("Failed to extract text from page " + tau)
+
+    return
+
+
+def whakarauiri(kupu):
+    # The calls to these functions in tau don't need to be made for the irstlm language model, however replacements make the model more effective. Hence we use a string with the function of the tau module's name to represent the kind of object it is replacing.
+    marama = '(Hanuere|Pepuere|Maehe|Apereira|Mei|Hune|Hurae|Akuhata|Hepetema|Oketopa|Noema|Nowema|Tihema)'
+    # Comma separated pound values, ending with common representations for shillings and pounds
+    kupu = rīwhi_tauriterite('((£?([1-9]\d{0,2}[,\/‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3}([.,]{2}\d{1,2}){1,2}))', "pakaru_moni", kupu)
+    kupu = rīwhi_tauriterite('(?i)(£?[1-9]\d{0,2}[,\/‘`´’\'\".][ ]?(\d{3}[,\/‘`´’\'\".]?[ ]?)+ ?l\.? ?( ?\d+ ?[ds]\.? ?){0,2})', "pakaru_moni", kupu)
+    # Non-comma separated pound values, with the same endings
+    kupu = rīwhi_tauriterite('(£?([1-9]\d*([.,]{2}\d{1,2}){1,2}))', "pakaru_moni", kupu)
+    kupu = rīwhi_tauriterite('(?i)((£?[1-9]\d*( ?\d+ ?[lsd]\.? ?){1,3}))', "pakaru_moni", kupu)
+    # Typical date format xx/xx/xx
+    kupu = rīwhi_tauriterite('((\d{1,2}\/){1,2}\d{2})', "rā_kupu", kupu)
+    # Other common date formats that involve words - e.g. the (day) of (month), (year); or (month) (day) (year)
+    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + ',? \d{4}(\b|\W|\s|\s|$|\W))', "rā_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{1,2}( [,o])? ' + marama + ',? \d{4}(\b|\W|\s|\s|$|\W))', "rā_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{1,2},? \d{4}(\b|\W|\s|$))', "rā_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{4},? ' + marama + ')', "rā_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{4}(\b|\W|\s|$))', "rā_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)(te )\d{1,2}( [,o])? ' + marama + '(\b|\W|\s|$))', "rā_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)((\b|\W|\s|^)\d{1,2}( [,o])? ' + marama + '(\b|\W|\s|$))', "rā_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)(' + marama + ',? \d{1,2}(\b|\W|\s|$))', "rā_kupu", kupu)
+    # Comma separated pound values with no suffixes
+    kupu = rīwhi_tauriterite('(£([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', "pakaru_moni", kupu)
+    # Other comma separated values, not financial
+    kupu = rīwhi_tauriterite('(([1-9]\d{0,2}[,‘`´’\'\".][ ]?)(\d{3}[,\/‘`´’\'\".][ ]?)*\d{3})', "hōputu_tau", kupu)
+    # Finds times separated by punctuation (with or without a space), optionally followed by am/pm
+    kupu = rīwhi_tauriterite('(?i)((\d{1,2}\. ){1,2}(\d{1,2}) ?[ap]\.?m\.?)', "tāima_kupu", kupu)
+    kupu = rīwhi_tauriterite('(?i)((\d{1,2}[,.:]){0,2}(\d{1,2}) ?[ap]\.?m\.?)', "tāima_kupu", kupu)
+    kupu = rīwhi_tauriterite('((\d{1,2}\. ?){1,2}\d{1,2})', "tāima_kupu", kupu)
+    # Deals with any leftover slash-separated values that weren't accepted by "tāima_kupu" by replacing the slashes with words
+    kupu = rīwhi_tauriterite('((\d{1,6}( \/ | \/|\/ |\/|\.)){1,5}\d{1,5})', "hautau_rānei_ira", kupu)
+    # Finds all other monetary values
+    kupu = rīwhi_tauriterite('(£(\d)+)', "pakaru_moni", kupu)
+    # Finds all other numbers
+    kupu = rīwhi_tauriterite('((\d)+)', "hōputu_tau", kupu)
+    # Removes characters that aren't letters or spaces.
+    kupu = re.sub(r'[^A-Za-zĀĒĪŌŪāēīōū!"#$%&\'()*+,./:;<=>?[\\]^_`‘’{|}-£´\s]', '', kupu)
+    # Clears excess spaces
+    return clean_whitespace(kupu)
+
+
+class Tīmata_kōwae:
+    # Sets up the 'left over paragraph' from the previous page in a class object for readability
+    # The input is a Rārangi class object.
+    def __init__(self, tāuru):
+        self.tau = tāuru.tau
+        self.kupu = tāuru.kupu
+        self.taukaea = tāuru.taukaea
+
+
+def kupu_moroki(tāuru, tīmata_kōwae):
+
+    # It strips the text of any unnecessary trailing characters that could follow the end of the sentence, such as quotation marks
+    mahuru_kupu = tāuru.kupu.strip(tohukī)
+    # If there is anything left after these characters have been stripped (so as not to cause an error)
+    if mahuru_kupu:
+        # If the last character of the string is an acceptable "end of paragraph" character, and there are preceeding pages (i.e. it is not the last page of the issue since a paragraph will not continue over consecutive issues)
+        if (mahuru_kupu[-1] not in tohutuhi) and (tāuru.hupa.select('div.navarrowsbottom')[0].find('td', align='right', valign='top').a):
+            # Then this paragraph will be carried over to the next page (the next time this function is called) by using the global tīmata_kōwae variable
+
+            # If there isn't already a paragraph being carried over, it stores the start of the paragraph's text, page number and url
+            if not tīmata_kōwae:
+                tīmata_kōwae = Tīmata_kōwae(tāuru)
+            # Otherwise if there is a paragraph being carried over, it just adds the text to the rest of the paragraph, without changing the original page number and url
+            else:
+                tīmata_kōwae.kupu += tāuru.kupu
+            # It then breaks, exiting out of the function, so the carried paragraph is not written until all the text in the paragraph has been collected
+
+    return tīmata_kōwae
+
+
+def rāringa_kaituhituhi(tāuru, tīmata_kōwae, store_page):
+    # This function splits the text from a given page into its constituent
+    # Paragraphs, and writes them along with the page's information (date
+    # Retrieved, newspaper name, issue name, page number, Māori word count,
+    # Ambiguous word count, other word count, total word count, Māori word
+    # Percentage, the raw text, and the url of the page). If it determines that
+    # The paragraph carries on to the next page, and it is not the last page of
+    # An issue, it carries the information that changes from page to page (text,
+    # Page number, url) to the next time the function is called, i.e. the next
+    # Page. It tries to find where the paragraph continues, and then writes it
+    # To the text csv with the information of the page where it was first found.
+    # If it can't, it will continue to loop this information forward until the
+    # Last page of the issue. It takes a Rārangi class object, and a csv writer.
+
+    if tāuru.kupu:  # Only writes the information if text was able to be extracted
+
+        # Splits the text up into paragraphs
+        kupu_tūtira = mātītori_kupu(tāuru.kupu)
+
+        # Loops through the paragraphs
+        for kupu in kupu_tūtira:
+
+            # Strips leading and trailing white space
+            tāuru.kupu = kupu.strip()
+
+            # If the paragraph is the last paragraph on the page
+            if kupu == kupu_tūtira[-1]:
+                tīmata_kōwae = kupu_moroki(tāuru, tīmata_kōwae)
+
+            # If there is leftover text from the previous page, Find the first paragraph that isn't in caps, i.e. isn't a title
+            if tīmata_kōwae and not kupu.isupper():
+
+                # Add the leftover text to the first paragraph that isn't entirely uppercase
+                tāuru.kupu = tīmata_kōwae.kupu + tāuru.kupu
+                # The page number and url that are to be written with the paragraph are from the original paragraph, so they are taken from the global variable and assigned to the variables that will be written
+                whārangi_tau = tīmata_kōwae.tau
+                whārangi_taukaea = tīmata_kōwae.taukaea
+                # Then the global variable is cleared, because it is being written, so nothing is being carried over to the next call of the function
+                tīmata_kōwae = None
+
+            else:
+                # If nothing is being added from a previous page, the page number and url that are to be written come from the current page, and are assigned to the variables which will be written
+                whārangi_tau = tāuru.tau
+                whārangi_taukaea = tāuru.taukaea
+
+            # Replaces all white space with a space
+            tāuru.kupu = clean_whitespace(tāuru.kupu)
+            # If there is no text left after it has been stripped, there is no point writing it, so the function continues onto the next paragraph
+            if not tāuru.kupu:
+                continue
+
+            tāuru.urutau = whakarauiri(tāuru.kupu)
+            tāuru.urutau = tohutau(tāuru.urutau)
+            # Gets the percentage of the text that is Māori
+            tāuru.māori, tāuru.rangirua, tāuru.pākehā, tāuru.tapeke, tāuru.ōrau = tiki_ōrau(
+                tāuru.urutau)
+            # Prepares the row that is to be written to the csv
+
+            # ['newspaper', 'issue', 'page', 'māori_words', 'ambiguous_words', 'other_words',
+            #  'total_words', 'percent_māori', 'adapted_text', 'url', 'raw_text'])
+
+            store_page(tāuru.niupepa, tāuru.perehitanga, tāuru.published_date, whārangi_tau, tāuru.māori, tāuru.rangirua, tāuru.pākehā,
+                       tāuru.tapeke, tāuru.ōrau, tāuru.urutau, whārangi_taukaea, tāuru.kupu)
+
+    return tīmata_kōwae
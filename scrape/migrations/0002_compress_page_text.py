@@ -0,0 +1,59 @@
+# Generated by Django 2.0.4 on 2026-10-19 10:00
+
+from django.db import migrations
+import root.models
+
+
+def compress_page_text(apps, schema_editor):
+    Page = apps.get_model('scrape', 'Page')
+    for page in Page.objects.only('id', 'raw_text', 'adapted_text').iterator():
+        page.raw_text_compressed = page.raw_text or ''
+        page.adapted_text_compressed = page.adapted_text or ''
+        page.save(update_fields=['raw_text_compressed', 'adapted_text_compressed'])
+
+
+def decompress_page_text(apps, schema_editor):
+    Page = apps.get_model('scrape', 'Page')
+    for page in Page.objects.only('id', 'raw_text_compressed', 'adapted_text_compressed').iterator():
+        page.raw_text = page.raw_text_compressed
+        page.adapted_text = page.adapted_text_compressed
+        page.save(update_fields=['raw_text', 'adapted_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('scrape', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='page',
+            name='raw_text_compressed',
+            field=root.models.CompressedTextField(default=''),
+        ),
+        migrations.AddField(
+            model_name='page',
+            name='adapted_text_compressed',
+            field=root.models.CompressedTextField(default=''),
+        ),
+        migrations.RunPython(compress_page_text, decompress_page_text),
+        migrations.RemoveField(
+            model_name='page',
+            name='raw_text',
+        ),
+        migrations.RemoveField(
+            model_name='page',
+            name='adapted_text',
+        ),
+        migrations.RenameField(
+            model_name='page',
+            old_name='raw_text_compressed',
+            new_name='raw_text',
+        ),
+        migrations.RenameField(
+            model_name='page',
+            old_name='adapted_text_compressed',
+            new_name='adapted_text',
+        ),
+    ]
@@ -1,7 +1,7 @@
 from django.db import models
 
 # Create your models here.
-from root.models import SimpleModel
+from root.models import SimpleModel, CompressedTextField
 
 
 class Newspaper(SimpleModel):
@@ -24,10 +24,10 @@ class Publication(SimpleModel):
 class Page(SimpleModel):
     publication = models.ForeignKey(Publication, on_delete=models.CASCADE)
     page_number = models.CharField(max_length=255)
-    raw_text = models.TextField()
+    raw_text = CompressedTextField(default='')
     url = models.CharField(max_length=1024)
 
-    adapted_text = models.TextField()
+    adapted_text = CompressedTextField(default='')
     percentage_maori = models.FloatField(null=True, blank=True)
     maori_word_count = models.IntegerField(null=True, blank=True)
     ambiguous_word_count = models.IntegerField(null=True, blank=True)
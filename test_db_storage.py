@@ -0,0 +1,129 @@
+import datetime
+import os
+import random
+import zlib
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", 'osm_database.settings')
+
+django.setup()
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from scrape.management.util.db_storage import DbStorage, UrlIdMap
+from scrape.models import Newspaper, Page, Publication
+
+old_database_name = None
+
+
+def setUpModule():
+    global old_database_name
+    setup_test_environment()
+    old_database_name = connection.creation.create_test_db(verbosity=0)
+
+
+def tearDownModule():
+    connection.creation.destroy_test_db(old_database_name, verbosity=0)
+    teardown_test_environment()
+
+
+class UrlIdMapTest(TestCase):
+    def test_same_as_dict(self):
+        """
+        The map must give the same ids as the dict of url -> id it replaces
+        """
+        rng = random.Random(1)
+        urls = ['https://paperspast.natlib.govt.nz/newspapers/{}/page/{}'.format(rng.randrange(10 ** 9), i)
+                for i in range(5000)]
+        expected = {url: i for i, url in enumerate(urls)}
+
+        url_map = UrlIdMap()
+        url_map.load(expected.items(), chunk_size=700)
+        for url in rng.sample(urls, 300):
+            expected[url] = rng.randrange(10 ** 6)
+            url_map[url] = expected[url]
+        url_map.compact()
+        url_map['https://example.com/new'] = expected['https://example.com/new'] = 123456
+
+        self.assertEqual(len(url_map), len(expected))
+        for url, id in expected.items():
+            self.assertEqual(url_map.get(url), id)
+        self.assertIsNone(url_map.get('https://example.com/missing'))
+        self.assertNotIn('https://example.com/missing', url_map)
+
+
+class DbStorageTest(TestCase):
+    def add_page(self, storage, newspaper_title, published_date, page_number, text):
+        """
+        Add a page the way scrape_maori_text does, with its newspaper and publication if they are new
+        """
+        db_pub = storage.get_publication(newspaper_title, published_date)
+        if db_pub is None:
+            db_newspaper = storage.get_newspaper(newspaper_title)
+            if db_newspaper is None:
+                storage.add_newspaper(Newspaper(name=newspaper_title))
+                db_newspaper = storage.get_newspaper(newspaper_title)
+            db_pub = Publication(published_date=published_date)
+            db_pub.newspaper_title = newspaper_title
+            db_pub.newspaper_id = db_newspaper if isinstance(db_newspaper, int) else None
+            storage.add_publication(newspaper_title, db_pub)
+
+        url = 'https://example.com/{}/{}/{}'.format(newspaper_title, published_date, page_number)
+        db_page = Page(page_number=page_number, url=url, raw_text=text, adapted_text=text.lower())
+        db_page.newspaper_title = newspaper_title
+        db_page.published_date = published_date
+        db_page.publication_id = db_pub if isinstance(db_pub, int) else None
+        storage.add_pages(db_page)
+        return url
+
+    def test_save_and_reload(self):
+        storage = DbStorage(batch_size=3)
+        dates = [datetime.date(1880, 1, 1) + datetime.timedelta(days=7 * i) for i in range(4)]
+        urls = []
+        for title in ['Te Waka Maori', 'Te Korimako']:
+            for date in dates:
+                for page_number in ['1', '2']:
+                    urls.append(self.add_page(storage, title, date, page_number, 'Ko te {} {}'.format(title, date)))
+        storage.save()
+
+        self.assertEqual(Newspaper.objects.count(), 2)
+        self.assertEqual(Publication.objects.count(), 8)
+        self.assertEqual(Page.objects.count(), 16)
+        for url in urls:
+            page = Page.objects.get(url=url)
+            self.assertEqual(storage.get_page(url), page.id)
+            self.assertEqual(page.publication.newspaper.name, url.split('/')[3])
+            self.assertEqual(str(page.publication.published_date), url.split('/')[4])
+
+        # A new run sees what is in the database and only saves the new pages
+        storage = DbStorage(batch_size=3)
+        for url in urls:
+            self.assertEqual(storage.get_page(url), Page.objects.get(url=url).id)
+        new_url = self.add_page(storage, 'Te Korimako', dates[0], '3', 'He korero hou')
+        storage.save()
+        self.assertEqual(Newspaper.objects.count(), 2)
+        self.assertEqual(Publication.objects.count(), 8)
+        self.assertEqual(Page.objects.count(), 17)
+        self.assertEqual(storage.get_page(new_url), Page.objects.get(url=new_url).id)
+
+
+class CompressedTextFieldTest(TestCase):
+    def test_round_trip(self):
+        text = 'Kua tae mai te rongo. ' * 200 + 'āēīōū'
+        newspaper = Newspaper.objects.create(name='Te Wananga')
+        publication = Publication.objects.create(newspaper=newspaper, published_date=datetime.date(1875, 3, 6))
+        page = Page.objects.create(publication=publication, page_number='1', url='https://example.com/p1',
+                                   raw_text=text)
+
+        page = Page.objects.get(id=page.id)
+        self.assertEqual(page.raw_text, text)
+        self.assertEqual(page.adapted_text, '')
+
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT raw_text FROM {} WHERE id = %s'.format(Page._meta.db_table), [page.id])
+            stored = bytes(cursor.fetchone()[0])
+        self.assertLess(len(stored), len(text))
+        self.assertEqual(zlib.decompress(stored).decode('utf-8'), text)
@@ -0,0 +1,197 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from osm_database.management.util.detail_downloader import DetailDownloader, iter_downloaded
+
+
+class StandInNominatim:
+    """
+    A local HTTP server answering details.php-like requests. By default every id gets a 200 with a small document;
+    `responses[<type><id>]` is a list of (status, headers) to give instead, one per request, the last one repeating
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse_qs(urlsplit(self.path).query)
+                osm_id = query['osmtype'][0] + query['osmid'][0]
+                with stand_in.lock:
+                    stand_in.requests.append((time.monotonic(), osm_id))
+                    responses = stand_in.responses.get(osm_id, [])
+                    status, headers = responses.pop(0) if len(responses) > 1 else (responses or [(200, {})])[0]
+                if status == 200:
+                    body = json.dumps({'osm_id': int(query['osmid'][0]), 'osm_type': query['osmtype'][0]})
+                else:
+                    body = 'Error {}'.format(status)
+                body = body.encode('utf-8')
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url_template = 'http://127.0.0.1:{}/details.php?osmtype={{}}&osmid={{}}&format=json'\
+            .format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def request_ids(self):
+        return [osm_id for _, osm_id in self.requests]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AdoptExistingFilesTest(unittest.TestCase):
+    """
+    Results folders left by the downloaders from before the manifest: `<id>.json` per success, `errors/<id>` per failure
+    """
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.results_dir, 'errors'))
+        for name, document in [('123', {'osm_id': 123}), ('R77', {'osm_id': 77})]:
+            with open(os.path.join(self.results_dir, '{}.json'.format(name)), 'w') as f:
+                json.dump(document, f, indent=2, sort_keys=True)
+        open(os.path.join(self.results_dir, 'errors', '456'), 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_ways_of_import_osm_are_not_downloaded_again(self):
+        downloader = DetailDownloader(self.results_dir, legacy_id_prefix='W')
+        try:
+            self.assertTrue(downloader.manifest.is_done('W123'))
+            self.assertTrue(downloader.manifest.is_done('W456'))
+            self.assertTrue(downloader.manifest.is_done('R77'))
+            self.assertNotIn('123', downloader.manifest)
+            self.assertFalse(downloader.manifest.is_done('W789'))
+        finally:
+            downloader.close()
+
+        downloaded = {osm_id: json.loads(content.decode('utf-8'))
+                      for osm_id, file, content in iter_downloaded(self.results_dir)}
+        self.assertEqual(downloaded, {'W123': {'osm_id': 123}, 'R77': {'osm_id': 77}})
+
+    def test_ids_are_kept_without_prefix(self):
+        downloader = DetailDownloader(self.results_dir)
+        try:
+            self.assertTrue(downloader.manifest.is_done('123'))
+            self.assertTrue(downloader.manifest.is_done('456'))
+        finally:
+            downloader.close()
+
+    def test_existing_manifest_is_kept(self):
+        DetailDownloader(self.results_dir, legacy_id_prefix='W').close()
+        with open(os.path.join(self.results_dir, 'manifest.tsv'), 'r') as f:
+            num_lines = len(f.readlines())
+
+        DetailDownloader(self.results_dir, legacy_id_prefix='W').close()
+        with open(os.path.join(self.results_dir, 'manifest.tsv'), 'r') as f:
+            self.assertEqual(len(f.readlines()), num_lines)
+
+
+
+class DownloadTest(unittest.TestCase):
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        self.server = StandInNominatim()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.results_dir)
+
+    def download(self, osm_ids, **kwargs):
+        kwargs.setdefault('requests_per_second', None)
+        kwargs.setdefault('backoff_factor', 0.01)
+        downloader = DetailDownloader(self.results_dir, url_template=self.server.url_template, **kwargs)
+        try:
+            downloader.download(osm_ids)
+        finally:
+            downloader.close()
+
+    def downloaded(self):
+        return {osm_id: json.loads(content.decode('utf-8'))
+                for osm_id, file, content in iter_downloaded(self.results_dir)}
+
+    def statuses(self):
+        downloader = DetailDownloader(self.results_dir)
+        try:
+            return {osm_id: entry[0] for osm_id, entry in downloader.manifest.entries.items()}
+        finally:
+            downloader.close()
+
+    def test_download(self):
+        self.server.responses['W2'] = [(404, {})]
+        # Without a type, the id is tried as a way, then a relation, then a node
+        self.server.responses['W3'] = [(404, {})]
+        self.download(['W1', 'W2', '3', 'N4'])
+        self.assertEqual(self.downloaded(), {'W1': {'osm_id': 1, 'osm_type': 'W'}, '3': {'osm_id': 3, 'osm_type': 'R'},
+                                             'N4': {'osm_id': 4, 'osm_type': 'N'}})
+        self.assertEqual(self.statuses(), {'W1': '200', 'W2': '404', '3': '200', 'N4': '200'})
+
+    def test_retries(self):
+        self.server.responses['W1'] = [(503, {}), (429, {'Retry-After': '1'}), (200, {})]
+        self.server.responses['W2'] = [(500, {})]
+        start_time = time.monotonic()
+        self.download(['W1', 'W2'], max_retries=2)
+
+        self.assertEqual(self.server.request_ids().count('W1'), 3)
+        retry_after_times = [t for t, osm_id in self.server.requests if osm_id == 'W1']
+        self.assertGreaterEqual(retry_after_times[2] - retry_after_times[1], 1)
+        # Given up after max_retries
+        self.assertEqual(self.server.request_ids().count('W2'), 3)
+        self.assertEqual(self.statuses(), {'W1': '200', 'W2': '500'})
+        self.assertLess(time.monotonic() - start_time, 10)
+
+    def test_connection_errors(self):
+        self.server.close()
+        self.download(['W1'], max_retries=1)
+        self.assertEqual(self.statuses(), {'W1': 'XXX'})
+
+    def test_retries_count_against_the_rate(self):
+        for i in range(5):
+            self.server.responses['W{}'.format(i)] = [(503, {}), (200, {})]
+        self.download(['W{}'.format(i) for i in range(5)], concurrency=4, requests_per_second=20, backoff_factor=0)
+
+        times = sorted(t for t, _ in self.server.requests)
+        self.assertEqual(len(times), 10)
+        # 1/20s apart, give or take the time for a request to arrive
+        self.assertGreaterEqual(min(b - a for a, b in zip(times, times[2:])), 0.08)
+        self.assertGreaterEqual(times[-1] - times[0], 9 * 0.05 - 0.02)
+
+    def test_resume(self):
+        self.server.responses['W1'] = [(503, {})]
+        self.server.responses['W2'] = [(404, {})]
+        self.download(['W1', 'W2', 'W3'], max_retries=0)
+        self.assertEqual(self.statuses(), {'W1': '503', 'W2': '404', 'W3': '200'})
+
+        # Only the id that ended with a transient status is tried again
+        self.server.requests = []
+        self.server.responses['W1'] = [(200, {})]
+        self.download(['W1', 'W2', 'W3'], max_retries=0)
+        self.assertEqual(self.server.request_ids(), ['W1'])
+        self.assertEqual(self.statuses(), {'W1': '200', 'W2': '404', 'W3': '200'})
+        self.assertEqual(set(self.downloaded()), {'W1', 'W3'})
+
+
+if __name__ == '__main__':
+    unittest.main()
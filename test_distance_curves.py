@@ -0,0 +1,146 @@
+import random
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from osm_database.jupyter_django_commons.distance_curves import is_member, linear_interpolate, \
+    stacked_cumulative_curves
+
+try:
+    from scipy.interpolate import interp1d
+except ImportError:
+    interp1d = None
+
+
+def old_stacked_curves(subcategories, datapoint_column_name, value_column_name, trim):
+    """
+    The computation Plotter._plot_interpolated did with interp1d before distance_curves, without the plotting.
+    The loop that patched NaNs is left out: it compared arrays of different shapes and the NaNs were zeroed after it
+    """
+    all_x_data = np.array([])
+    subcategory_first_xs = []
+    for subcategory_data in subcategories:
+        x_data = np.array(subcategory_data['df'][datapoint_column_name]).astype(np.float64)
+        all_x_data = np.concatenate((all_x_data, x_data))
+        subcategory_first_xs.append(np.min(x_data))
+    all_x_data = np.unique(all_x_data)
+
+    subcategory_order_by_min_x = np.argsort(subcategory_first_xs)
+    y_data_interpolated_accum = np.zeros(all_x_data.shape)
+    curves = []
+    for ind in subcategory_order_by_min_x:
+        df = subcategories[ind]['df']
+        x_data = np.array(df[datapoint_column_name]).astype(np.float64)
+        y_data = np.array(df[value_column_name]).astype(np.float64)
+        sort_order = np.lexsort((y_data, x_data))
+        x_data = x_data[sort_order]
+        y_data = y_data[sort_order]
+        y_data_accum = np.add.accumulate(y_data)
+
+        if len(x_data) == 1:
+            y_data_interpolated = np.zeros(all_x_data.shape)
+            y_data_interpolated[np.where(all_x_data == x_data[0])] = y_data_accum[0]
+            y_data_interpolated = np.add.accumulate(y_data_interpolated)
+        else:
+            y_interp = interp1d(x_data, y_data_accum, fill_value="extrapolate")
+            y_data_interpolated = y_interp(all_x_data)
+            y_data_interpolated[np.where(y_data_interpolated < 0)] = 0
+            y_data_interpolated[np.where(np.isnan(y_data_interpolated))] = 0
+
+        y_data_interpolated_accum = y_data_interpolated_accum + y_data_interpolated
+        if trim:
+            y_data_interpolated[np.where(all_x_data < x_data[0])] = 0
+            y_data_interpolated[np.where(all_x_data > x_data[-1])] = 0
+
+        points_to_keep = np.where(y_data_interpolated > 0)
+        x_to_plot = all_x_data[points_to_keep]
+        interpolated_indx = np.array([len(np.where(x_data == x)[0]) == 0 for x in x_to_plot], dtype=bool)
+        curves.append(dict(subcategory=subcategories[ind]['subcategory'], x=x_to_plot,
+                           y=y_data_interpolated_accum[points_to_keep], interpolated=interpolated_indx))
+    return curves
+
+
+def make_subcategories(num_subcategories, seed):
+    """
+    Subcategories of random distances and frequencies, some with repeated distances and one with a single point
+    """
+    rng = random.Random(seed)
+    subcategories = []
+    for i in range(num_subcategories):
+        num_points = 1 if i == 2 else rng.randint(2, 40)
+        distances = sorted(rng.sample(range(1, 3000, 10), num_points))
+        # Repeated distances after the first two, where interpolation is still defined
+        distances += rng.sample(distances[1:], min(3, num_points - 1))
+        rng.shuffle(distances)
+        frequencies = [rng.randint(1, 50) for _ in distances]
+        subcategories.append(dict(subcategory='Subcategory {}'.format(i),
+                                  df=pd.DataFrame({'distance': distances, 'frequency': frequencies})))
+    return subcategories
+
+
+class DistanceCurvesTest(unittest.TestCase):
+    def assert_same_curves(self, curves, expected):
+        self.assertEqual([x['subcategory'] for x in curves], [x['subcategory'] for x in expected])
+        for curve, expected_curve in zip(curves, expected):
+            np.testing.assert_array_equal(curve['x'], expected_curve['x'])
+            np.testing.assert_allclose(curve['y'], expected_curve['y'], rtol=1e-12)
+            np.testing.assert_array_equal(curve['interpolated'], expected_curve['interpolated'])
+
+    @unittest.skipIf(interp1d is None, 'scipy is not installed')
+    def test_same_curves_as_interp1d(self):
+        for seed in range(5):
+            subcategories = make_subcategories(8, seed)
+            for trim in [False, True]:
+                self.assert_same_curves(stacked_cumulative_curves(subcategories, 'distance', 'frequency', trim),
+                                        old_stacked_curves(subcategories, 'distance', 'frequency', trim))
+
+    @unittest.skipIf(interp1d is None, 'scipy is not installed')
+    def test_linear_interpolate_same_as_interp1d(self):
+        rng = np.random.RandomState(1)
+        x = np.sort(rng.choice(1000, 50, replace=False)).astype(np.float64)
+        y = np.cumsum(rng.randint(1, 20, 50)).astype(np.float64)
+        grid = np.sort(rng.uniform(-100, 1100, 500))
+        np.testing.assert_allclose(linear_interpolate(x, y, grid), interp1d(x, y, fill_value='extrapolate')(grid))
+
+    def test_stacking_and_trim(self):
+        subcategories = [
+            dict(subcategory='far', df=pd.DataFrame({'distance': [30, 40], 'frequency': [1, 1]})),
+            dict(subcategory='near', df=pd.DataFrame({'distance': [10, 20, 30], 'frequency': [2, 2, 2]})),
+            dict(subcategory='single', df=pd.DataFrame({'distance': [20], 'frequency': [5]})),
+        ]
+        near, single, far = stacked_cumulative_curves(subcategories, 'distance', 'frequency', trim=False)
+        self.assertEqual([near['subcategory'], single['subcategory'], far['subcategory']], ['near', 'single', 'far'])
+        np.testing.assert_array_equal(near['x'], [10, 20, 30, 40])
+        np.testing.assert_array_equal(near['y'], [2, 4, 6, 8])
+        np.testing.assert_array_equal(near['interpolated'], [False, False, False, True])
+        np.testing.assert_array_equal(single['y'], [4 + 5, 6 + 5, 8 + 5])
+        # The far curve extrapolates to zero at 20 and is only kept where it is above zero
+        np.testing.assert_array_equal(far['x'], [30, 40])
+        np.testing.assert_array_equal(far['y'], [6 + 5 + 1, 8 + 5 + 2])
+
+        near, single, far = stacked_cumulative_curves(subcategories, 'distance', 'frequency', trim=True)
+        np.testing.assert_array_equal(near['x'], [10, 20, 30])
+        np.testing.assert_array_equal(single['x'], [20])
+        np.testing.assert_array_equal(far['y'], [6 + 5 + 1, 8 + 5 + 2])
+        self.assertEqual(stacked_cumulative_curves([], 'distance', 'frequency'), [])
+
+    def test_repeated_first_distance_is_dropped(self):
+        """
+        Before the first two points, which share their distance, the curve has no slope and is not drawn
+        """
+        df = pd.DataFrame({'distance': [10, 10, 20], 'frequency': [1, 2, 3]})
+        others = pd.DataFrame({'distance': [5, 10, 20], 'frequency': [1, 1, 1]})
+        curves = stacked_cumulative_curves([dict(subcategory='a', df=others), dict(subcategory='b', df=df)],
+                                           'distance', 'frequency')
+        np.testing.assert_array_equal(curves[1]['x'], [20])
+        np.testing.assert_array_equal(curves[1]['y'], [3 + 6])
+
+    def test_is_member(self):
+        sorted_values = np.array([1., 3., 5.])
+        np.testing.assert_array_equal(is_member(sorted_values, np.array([0., 1., 2., 5., 6.])),
+                                      [False, True, False, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
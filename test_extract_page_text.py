@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", 'osm_database.settings')
+
+django.setup()
+
+from unittest import mock
+
+from django.db import connection
+from django.test import TransactionTestCase
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from scrape.management.commands import extract_page_text, hiki_niupepa_kupu
+from scrape.management.commands.hiki_niupepa_kupu import UrlQuerier, pae_tukutuku, pae_tukutuku_haurua
+from scrape.management.util.page_cache import PageCache
+from scrape.models import Page
+
+old_database_name = None
+
+
+def setUpModule():
+    global old_database_name
+    setup_test_environment()
+    old_database_name = connection.creation.create_test_db(verbosity=0)
+
+
+def tearDownModule():
+    connection.creation.destroy_test_db(old_database_name, verbosity=0)
+    teardown_test_environment()
+
+
+archive_page = '''<html><body><div class="top"><table>
+<tr valign="top"><td valign="top"><a href="/waka"><img/></a></td><td valign="top">Te Waka Maori (1878-1884)</td></tr>
+</table></div></body></html>'''
+
+newspaper_page = '''<html><body><table id="group_top">{}</table></body></html>'''
+issue_row = '<tr valign="top"><td valign="top"><a href="{}"><img/></a></td><td valign="top">{}</td>' \
+            '<td valign="top">{}</td></tr>'
+
+issue_page = '''<html><body><b>Te Waka Maori, page  {number}</b>
+<div class="documenttext"><table><tr><td>{text}</td></tr></table></div>
+<div class="navarrowsbottom"><table><tr><td align="right" valign="top">{next_link}</td></tr></table></div>
+</body></html>'''
+
+# The pages of each issue. A paragraph in capitals without a full stop at the end of a page is carried over to the
+# first paragraph not in capitals of the next page, except at the end of the first page of an issue
+issues = [
+    ('/waka/1', '1880 No. 1', '18800105', [
+        'TE WAKA MAORI\nHe korero tenei mo nga iwi katoa.\nKo te kupu tenei a te Kawana.\nNGA KORERO O TE WIKI',
+        'Kua tae mai te kaipuke ki Poneke.\nHe nui nga tangata i runga.\nKO NGA PANUI',
+        'HE PANUI.\nKa hokona nga whenua a te Mane.\nHei te Turei ka hoki mai ratou.',
+    ]),
+    ('/waka/2', '1880 No. 2', '18800112', [
+        'He hui nui tenei i Otaki.\nE 500 nga tangata i tae mai i te 3 o Hanuere.\nKa mutu te hui',
+    ]),
+    ('/waka/3', '1880 Commentary', '1880', [
+        'He korero whakamarama tenei.',
+    ]),
+]
+
+
+def write_pages(cache):
+    cache.put(pae_tukutuku_haurua, archive_page)
+    cache.put(pae_tukutuku + '/waka', newspaper_page.format(''.join(
+        issue_row.format('{}/1'.format(path), name, date) for path, name, date, _ in issues)))
+    for path, _, _, texts in issues:
+        for i, text in enumerate(texts):
+            next_link = '<a href="{}/{}">next page</a>'.format(path, i + 2) if i + 1 < len(texts) else ''
+            cache.put('{}{}/{}'.format(pae_tukutuku, path, i + 1),
+                      issue_page.format(number=i + 1, text=text, next_link=next_link))
+
+
+def page_rows():
+    return list(Page.objects.order_by('url').values_list(
+        'url', 'page_number', 'raw_text', 'adapted_text', 'maori_word_count', 'ambiguous_word_count',
+        'other_word_count', 'total_word_count', 'percentage_maori'))
+
+
+class ExtractPageTextTest(TransactionTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_same_rows_as_hiki_niupepa_kupu(self):
+        cache = PageCache(self.directory)
+        write_pages(cache)
+
+        # The text extraction of hiki_niupepa_kupu, run from the cache without a browser
+        command = hiki_niupepa_kupu.Command.__new__(hiki_niupepa_kupu.Command)
+        command.cache = cache
+        command.url_querier = UrlQuerier(cache, None)
+        command.progress_cache = dict()
+        command.matua()
+        cache.close()
+
+        rows = page_rows()
+        self.assertEqual([x[:2] for x in rows], [(pae_tukutuku + '/waka/1/1', '1'), (pae_tukutuku + '/waka/1/2', '2'),
+                                                 (pae_tukutuku + '/waka/1/3', '3'), (pae_tukutuku + '/waka/2/1', '1')])
+        # Each page keeps its last paragraph, the one of page 2 being completed on page 3
+        self.assertEqual([x[2] for x in rows], ['NGA KORERO O TE WIKI',
+                                                'KO NGA PANUIKa hokona nga whenua a te Mane.',
+                                                'Hei te Turei ka hoki mai ratou.',
+                                                'Ka mutu te hui'])
+
+        Page.objects.update(raw_text='', adapted_text='', maori_word_count=None, ambiguous_word_count=None,
+                            other_word_count=None, total_word_count=None, percentage_maori=None)
+        with mock.patch.object(extract_page_text, 'cache_pack_dir', self.directory):
+            extract_page_text.Command().handle(processes=2, batch_size=2)
+        self.assertEqual(page_rows(), rows)
@@ -0,0 +1,156 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from scrape.management.util.fetcher import AsyncFetcher
+
+
+class StandInServer:
+    """
+    A local HTTP server. `responses[path]` is a list of (status, headers) to give, one per request, the last one
+    repeating; other paths get a 200. The body of a page lists the links in `links[path]`, one per line.
+    Every request is answered after `delay` seconds.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.links = {}
+        self.delay = 0
+        self.requests = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with stand_in.lock:
+                    stand_in.requests.append((time.monotonic(), self.path))
+                    stand_in.in_flight += 1
+                    stand_in.max_in_flight = max(stand_in.max_in_flight, stand_in.in_flight)
+                    responses = stand_in.responses.get(self.path, [])
+                    status, headers = responses.pop(0) if len(responses) > 1 else (responses or [(200, {})])[0]
+                time.sleep(stand_in.delay)
+                with stand_in.lock:
+                    stand_in.in_flight -= 1
+
+                body = '\n'.join([self.path] + stand_in.links.get(self.path, [])).encode('utf-8')
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base_url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def url(self, path):
+        return self.base_url + path
+
+    def request_paths(self):
+        return [path for _, path in self.requests]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class AsyncFetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandInServer()
+        self.pages = {}
+
+    def tearDown(self):
+        self.server.close()
+
+    def on_page(self, url, content):
+        self.pages[url] = content
+
+    def fetch_all(self, paths, **kwargs):
+        kwargs.setdefault('requests_per_second', None)
+        kwargs.setdefault('backoff_base', 0.01)
+        fetcher = AsyncFetcher(**kwargs)
+        stats = fetcher.fetch_all([self.server.url(x) for x in paths], self.on_page)
+        return fetcher, stats
+
+    def test_retry_with_backoff(self):
+        self.server.responses['/a'] = [(503, {}), (429, {'Retry-After': '1'}), (200, {})]
+        fetcher, stats = self.fetch_all(['/a'])
+
+        self.assertEqual(self.pages, {self.server.url('/a'): '/a'})
+        self.assertEqual(self.server.request_paths(), ['/a'] * 3)
+        times = [t for t, _ in self.server.requests]
+        self.assertGreaterEqual(times[2] - times[1], 1)
+        self.assertLess(times[1] - times[0], 1)
+        self.assertEqual((stats.succeeded, stats.retries, stats.failed), (1, 2, 0))
+
+    def test_max_retries(self):
+        self.server.responses['/a'] = [(500, {})]
+        self.server.responses['/b'] = [(404, {})]
+        fetcher, stats = self.fetch_all(['/a', '/b'], max_retries=2)
+
+        self.assertEqual(self.server.request_paths().count('/a'), 3)
+        # Other errors are not retried
+        self.assertEqual(self.server.request_paths().count('/b'), 1)
+        self.assertIn('Max retrials exceeded', fetcher.failures[self.server.url('/a')])
+        self.assertEqual(fetcher.failures[self.server.url('/b')], 'HTTP 404')
+        self.assertEqual(self.pages, {})
+
+    def test_retry_budget(self):
+        paths = ['/{}'.format(i) for i in range(5)]
+        for path in paths:
+            self.server.responses[path] = [(503, {})]
+        fetcher, stats = self.fetch_all(paths, max_retries=5, retry_budget=3)
+
+        self.assertEqual(len(self.server.requests), 5 + 3)
+        self.assertEqual(stats.retries, 3)
+        self.assertEqual(set(fetcher.failures), {self.server.url(x) for x in paths})
+        self.assertEqual(sum('Retry budget exhausted' in x for x in fetcher.failures.values()), 5)
+
+    def test_max_per_host(self):
+        self.server.delay = 0.1
+        paths = ['/{}'.format(i) for i in range(12)]
+        fetcher, stats = self.fetch_all(paths, max_per_host=3)
+
+        self.assertEqual(len(self.pages), 12)
+        self.assertEqual(self.server.max_in_flight, 3)
+
+    def test_requests_per_second(self):
+        paths = ['/{}'.format(i) for i in range(6)]
+        self.fetch_all(paths, max_per_host=6, requests_per_second=20)
+
+        times = sorted(t for t, _ in self.server.requests)
+        self.assertEqual(len(self.pages), 6)
+        self.assertGreaterEqual(times[-1] - times[0], 5 * 0.05 - 0.02)
+
+    def test_crawl_follows_links(self):
+        """
+        Links are followed from fetched and cached pages alike, each page is fetched once, cached pages are not fetched
+        """
+        url = self.server.url
+        self.server.links['/start'] = [url('/p1'), url('/p2')]
+        self.server.links['/p2'] = [url('/p1'), url('/p3'), url('/start')]
+        cached = {url('/p1'): '\n'.join(['cached p1', url('/p4')])}
+
+        def on_page(page_url, content):
+            self.pages[page_url] = content
+            return content.split('\n')[1:]
+
+        fetcher = AsyncFetcher(requests_per_second=None, backoff_base=0.01)
+        stats = fetcher.crawl([url('/start')], on_page, load_cached=cached.get)
+
+        self.assertEqual(sorted(self.server.request_paths()), ['/p2', '/p3', '/p4', '/start'])
+        self.assertEqual(set(self.pages), {url(x) for x in ['/start', '/p1', '/p2', '/p3', '/p4']})
+        self.assertEqual(self.pages[url('/p1')], cached[url('/p1')])
+        self.assertEqual((stats.succeeded, stats.failed), (4, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import types
+import unittest
+
+from osm_database.jupyter_django_commons.figure_rendering import FigureSpec, spec_digest
+
+drawing_code = '''
+def draw_series(ax, series):
+    ax.plot(series, color={colour!r})
+
+
+def draw(fig, data, options):
+    draw_series(fig.add_subplot(1, 1, 1), data)
+'''
+
+
+def make_draw(colour):
+    """
+    A draw function in a module of its own, calling a helper of its module
+    """
+    module = types.ModuleType('drawing')
+    exec(drawing_code.format(colour=colour), module.__dict__)
+    return module.draw
+
+
+class SpecDigestTest(unittest.TestCase):
+    def test_digest_follows_data_and_code(self):
+        spec = FigureSpec('figure', make_draw('blue'), [1, 2, 3], dict(figsize=(4, 3)))
+        self.assertEqual(spec_digest(spec), spec_digest(FigureSpec('figure', make_draw('blue'), [1, 2, 3],
+                                                                   dict(figsize=(4, 3)))))
+        self.assertNotEqual(spec_digest(spec), spec_digest(spec._replace(data=[1, 2, 4])))
+        self.assertNotEqual(spec_digest(spec), spec_digest(spec._replace(options=dict(figsize=(5, 3)))))
+        # A change in a helper of the draw function
+        self.assertNotEqual(spec_digest(spec), spec_digest(spec._replace(draw=make_draw('red'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from osm_database.management.util.google_cache import PageNotCachedException, ParsedPageTable, page_key
+
+result_page = '''<html><body>
+<div id="result-stats">About {count} results<nobr> (0.31 seconds)</nobr></div>
+<div id="search">
+  <div class="g"><div class="yuRUbf"><a href="https://example.com/{name}">Link</a></div>
+  <div class="IsZvec">Excerpt of {name}</div></div>
+</div>
+<div role="navigation"><table><tr>{links}</tr></table></div>
+</body></html>'''
+
+
+def write_page(html_dir, query, page_name, next_pages):
+    links = ''.join('<td><a aria-label="{}" href="/search?start={}">{}</a></td>'.format(x, i, x)
+                    for i, x in enumerate(next_pages))
+    file_path = os.path.join(html_dir, page_key(query, page_name) + '.html')
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as f:
+        f.write(result_page.format(count=1234, name=page_name.replace(' ', '_'), links=links))
+
+
+class QueryPagesTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.html_dir = os.path.join(self.directory, 'html')
+        os.makedirs(self.html_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def parsed_pages(self):
+        table = ParsedPageTable(os.path.join(self.directory, 'parsed_pages.pkl'))
+        table.update(self.html_dir, processes=1)
+        return table
+
+    def test_follows_next_pages(self):
+        write_page(self.html_dir, 'cafe near park', 'Page 1', ['Page 2', 'Page 3'])
+        write_page(self.html_dir, 'cafe near park', 'Page 2', ['Page 1', 'Page 3'])
+        write_page(self.html_dir, 'cafe near park', 'Page 3', [])
+        pages = self.parsed_pages().query_pages('cafe near park')
+        self.assertEqual([x.name for x in pages], ['Page 1', 'Page 2', 'Page 3'])
+        self.assertEqual([x.result_count for x in pages], [1234] * 3)
+        self.assertEqual(pages[1].items, [('https://example.com/Page_2', 'Excerpt of Page_2')])
+
+        # Pages past max_pages are listed without being read
+        pages = self.parsed_pages().query_pages('cafe near park', max_pages=1)
+        self.assertEqual([(x.name, x.items) for x in pages[1:]], [('Page 2', []), ('Page 3', [])])
+
+    def test_missing_pages_are_reported(self):
+        write_page(self.html_dir, 'cafe near park', 'Page 1', ['Page 2'])
+        table = self.parsed_pages()
+        with self.assertRaises(PageNotCachedException) as context:
+            table.query_pages('cafe near park')
+        self.assertEqual(context.exception.key, 'cafe_near_park/Page_2')
+
+        with self.assertRaises(PageNotCachedException) as context:
+            table.query_pages('cafe behind park')
+        self.assertEqual(context.exception.key, 'cafe_behind_park/Page_1')
+
+
+if __name__ == '__main__':
+    unittest.main()
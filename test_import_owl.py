@@ -0,0 +1,76 @@
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from lxml import etree
+
+from osm_database.management.commands import import_owl
+from osm_database.management.commands.import_owl import OWL, iter_elements, parse_primary_owl
+
+
+def write_owl(filepath, num_classes, num_others):
+    """
+    An OWL/XML ontology of classes each a subclass of the one before, with many elements of other tags in between
+    """
+    with open(filepath, 'w') as f:
+        f.write('<?xml version="1.0"?>\n<Ontology xmlns="http://www.w3.org/2002/07/owl#">\n')
+        for i in range(num_classes):
+            f.write('  <Declaration><Class IRI="#Class{}"/></Declaration>\n'.format(i))
+        for i in range(num_others):
+            f.write('  <!-- property {} -->\n'.format(i))
+            f.write('  <Declaration><ObjectProperty IRI="#property{}"/></Declaration>\n'.format(i))
+            f.write('  <AnnotationAssertion><AnnotationProperty abbreviatedIRI="rdfs:comment"/>'
+                    '<IRI>#property{0}</IRI><Literal>Property {0}</Literal></AnnotationAssertion>\n'.format(i))
+        for i in range(1, num_classes):
+            f.write('  <SubClassOf><Class IRI="#Class{}"/><Class IRI="#Class{}"/></SubClassOf>\n'.format(i, i - 1))
+        f.write('</Ontology>\n')
+
+
+class IterElementsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'ontology.owl')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_primary_owl(self):
+        write_owl(self.filepath, 5, 3)
+        feature_dict = dict(name={}, url={})
+        parse_primary_owl(feature_dict, self.directory, 'ontology.owl')
+        self.assertEqual(set(feature_dict['name']), {'Class{}'.format(i) for i in range(5)})
+        for i in range(1, 5):
+            self.assertEqual({x.name for x in feature_dict['name']['Class{}'.format(i)].parent},
+                             {'Class{}'.format(i - 1)})
+
+    def test_other_elements_are_freed(self):
+        """
+        The elements of the tags not asked for must not be kept in the tree
+        """
+        write_owl(self.filepath, 10, 50000)
+        roots = []
+        iterparse = etree.iterparse
+
+        def recording_iterparse(*args, **kwargs):
+            for event, element in iterparse(*args, **kwargs):
+                if len(roots) == 0:
+                    roots.append(element.getroottree().getroot())
+                yield event, element
+
+        with mock.patch.object(import_owl.etree, 'iterparse', recording_iterparse):
+            max_children = 0
+            tags = []
+            for element in iter_elements(self.filepath, OWL + 'SubClassOf'):
+                tags.append(element.tag)
+                max_children = max(max_children, len(roots[0]))
+
+        # The parser reads ahead by a buffer, so a few elements after the current one are already in the tree, but
+        # not the 100000 elements before the SubClassOf ones
+        self.assertEqual(tags, [OWL + 'SubClassOf'] * 9)
+        self.assertLess(max_children, 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
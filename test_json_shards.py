@@ -0,0 +1,112 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from osm_database.management.commands.pack_json_results import Command as PackJsonResults
+from osm_database.management.util.detail_downloader import DetailDownloader, iter_downloaded
+from osm_database.management.util.json_shards import ShardWriter, is_shard, iter_shard, read_from_shard
+
+
+def make_document(i):
+    rng = random.Random(i)
+    coordinates = [[rng.uniform(174, 175), rng.uniform(-37, -36)] for _ in range(rng.randrange(50))]
+    return {'osm_id': i, 'osm_type': 'W', 'localname': 'Ara {}'.format(i), 'names': {'name:mi': 'Tāmaki'},
+            'geometry': {'type': 'LineString', 'coordinates': coordinates}}
+
+
+class ShardWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read_back(self):
+        writer = ShardWriter(self.directory, max_shard_size=4096)
+        locations = [writer.write(make_document(i)) for i in range(300)]
+        writer.close()
+
+        shards = sorted(os.listdir(self.directory))
+        self.assertGreater(len(shards), 1)
+        self.assertTrue(all(is_shard(x) for x in shards))
+        self.assertEqual(sorted({shard for shard, _, _ in locations}), shards)
+
+        lines = {}
+        for shard in shards:
+            for offset, line in iter_shard(os.path.join(self.directory, shard)):
+                lines[(shard, offset)] = line
+        for i, (shard, offset, length) in enumerate(locations):
+            self.assertEqual(json.loads(lines[(shard, offset)].decode('utf-8')), make_document(i))
+            self.assertEqual(len(lines[(shard, offset)]), length)
+        shard, offset, length = locations[123]
+        self.assertEqual(json.loads(read_from_shard(os.path.join(self.directory, shard), offset, length)),
+                         make_document(123))
+
+    def test_new_writer_starts_a_new_shard(self):
+        writer = ShardWriter(self.directory)
+        first = writer.write(make_document(1))
+        writer.close()
+        writer = ShardWriter(self.directory)
+        second = writer.write(make_document(2))
+        writer.close()
+        self.assertEqual((first[0], second[0]), ('details-00000.jsonl.gz', 'details-00001.jsonl.gz'))
+
+    def test_unfinished_shard_is_read_up_to_last_complete_line(self):
+        """
+        A shard whose writer crashed: the lines returned by write() are readable, a cut last line is not returned
+        """
+        writer = ShardWriter(self.directory)
+        for i in range(20):
+            writer.write(make_document(i))
+        # Copied before the writer is closed, so without the end of the gzip stream, as after a crash
+        with open(os.path.join(self.directory, writer.shard_name), 'rb') as f:
+            data = f.read()
+        writer.close()
+
+        path = os.path.join(self.directory, 'crashed-00000.jsonl.gz')
+        with open(path, 'wb') as f:
+            f.write(data)
+        self.assertEqual([json.loads(line)['osm_id'] for _, line in iter_shard(path)], list(range(20)))
+
+        with open(path, 'wb') as f:
+            f.write(data[:-20])
+        ids = [json.loads(line)['osm_id'] for _, line in iter_shard(path)]
+        self.assertEqual(ids, list(range(len(ids))))
+        self.assertGreaterEqual(len(ids), 15)
+
+
+class PackJsonResultsTest(unittest.TestCase):
+    """
+    Move the `<way id>.json` files that import_osm wrote before the manifest into shards
+    """
+
+    def setUp(self):
+        self.results_dir = tempfile.mkdtemp()
+        for i in range(30):
+            with open(os.path.join(self.results_dir, '{}.json'.format(i)), 'w') as f:
+                json.dump(make_document(i), f, indent=2, sort_keys=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.results_dir)
+
+    def test_same_documents_after_packing(self):
+        DetailDownloader(self.results_dir, legacy_id_prefix='W').close()
+        PackJsonResults().handle(folder=self.results_dir, delete=True)
+
+        self.assertFalse(any(x.endswith('.json') for x in os.listdir(self.results_dir)))
+        documents = {osm_id: json.loads(content.decode('utf-8'))
+                     for osm_id, file, content in iter_downloaded(self.results_dir)}
+        self.assertEqual(documents, {'W{}'.format(i): make_document(i) for i in range(30)})
+
+        downloader = DetailDownloader(self.results_dir, legacy_id_prefix='W')
+        try:
+            self.assertTrue(all(downloader.manifest.is_done('W{}'.format(i)) for i in range(30)))
+        finally:
+            downloader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
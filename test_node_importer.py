@@ -0,0 +1,142 @@
+import os
+import random
+from decimal import Decimal
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", 'osm_database.settings')
+
+django.setup()
+
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from osm_database.management.util.node_importer import NodeImporter, bulk_create_and_get_ids
+from osm_database.management.util.osm_reader import OsmNode
+from osm_database.models import Node, Tag, TagName, TagValue
+
+old_database_name = None
+
+
+def setUpModule():
+    global old_database_name
+    setup_test_environment()
+    old_database_name = connection.creation.create_test_db(verbosity=0)
+
+
+def tearDownModule():
+    connection.creation.destroy_test_db(old_database_name, verbosity=0)
+    teardown_test_environment()
+
+
+def make_nodes(first_id, count, seed):
+    rng = random.Random(seed)
+    nodes = []
+    for osm_id in range(first_id, first_id + count):
+        tags = {}
+        for k in rng.sample(['amenity', 'name', 'shop', 'highway', 'building'], rng.randrange(4)):
+            tags[k] = rng.choice(['cafe', 'yes', 'Queen Street', 'bus_stop', 'Ōtāhuhu'])
+        lat = Decimal('-36.8') + Decimal(rng.randrange(10 ** 7)).scaleb(-9)
+        lon = Decimal('174.7') + Decimal(rng.randrange(10 ** 7)).scaleb(-9)
+        nodes.append(OsmNode(osm_id, lat, lon, tags))
+    return nodes
+
+
+def import_one_by_one(nodes):
+    """
+    The way import_osm imported nodes before NodeImporter
+    """
+    for node in nodes:
+        node_db_obj, _ = Node.objects.get_or_create(osm_id=node.id, lon=node.lon, lat=node.lat)
+        for k, v in node.tags.items():
+            tag_name, _ = TagName.objects.get_or_create(name=k)
+            tag_value, _ = TagValue.objects.get_or_create(value=v)
+            tag, _ = Tag.objects.get_or_create(k=tag_name, v=tag_value)
+            node_db_obj.tags.add(tag)
+        node_db_obj.save()
+
+
+def database_content():
+    """
+    :return: the nodes with their tags, and the tag names, values and pairs, independent of the ids given to them
+    """
+    nodes = {}
+    for node in Node.objects.all():
+        tags = sorted((tag.k.name, tag.v.value) for tag in node.tags.all())
+        nodes[node.osm_id] = (node.lat, node.lon, tags)
+    return (nodes, sorted(TagName.objects.values_list('name', flat=True)),
+            sorted(TagValue.objects.values_list('value', flat=True)),
+            sorted(Tag.objects.values_list('k__name', 'v__value')))
+
+
+def clear_database():
+    Node.tags.through.objects.all().delete()
+    Node.objects.all().delete()
+    Tag.objects.all().delete()
+    TagName.objects.all().delete()
+    TagValue.objects.all().delete()
+
+
+class NodeImporterTest(TestCase):
+    def test_same_rows_as_one_by_one_import(self):
+        first = make_nodes(1, 60, seed=1)
+        # The second file repeats some nodes of the first one, as neighbouring extracts do
+        second = first[40:] + make_nodes(61, 30, seed=2)
+
+        import_one_by_one(first)
+        import_one_by_one(second)
+        expected = database_content()
+        clear_database()
+
+        importer = NodeImporter(batch_size=7)
+        for node in first:
+            importer.add(node)
+        importer.flush()
+        # A later run only loads what is in the database
+        importer = NodeImporter(batch_size=7)
+        for node in second:
+            importer.add(node)
+        importer.flush()
+
+        self.assertEqual(importer.imported_count, 30)
+        self.assertEqual(database_content(), expected)
+
+    def test_bulk_create_and_get_ids(self):
+        TagName.objects.create(name='existing')
+        objs = [TagName(name=name) for name in ['amenity', 'name', 'shop']]
+        ids = bulk_create_and_get_ids(TagName, objs, lambda x: x.name, ['name'], batch_size=2)
+        self.assertEqual(ids, dict(TagName.objects.exclude(name='existing').values_list('name', 'id')))
+        self.assertEqual(bulk_create_and_get_ids(TagName, [], lambda x: x.name, ['name'], batch_size=2), {})
+
+
+class CaseInsensitiveTagNameTest(TestCase):
+    """
+    On MySQL's default collation, tag names that differ only in case are the same row
+    """
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TABLE {}'.format(TagName._meta.db_table))
+            cursor.execute('CREATE TABLE {} (id integer NOT NULL PRIMARY KEY AUTOINCREMENT, '
+                           'name varchar(255) NOT NULL UNIQUE COLLATE NOCASE)'.format(TagName._meta.db_table))
+
+    def test_same_rows_as_one_by_one_import(self):
+        first = [OsmNode(1, Decimal('-36.8'), Decimal('174.7'), {'name': 'Ōtāhuhu', 'Name': 'Otahuhu'}),
+                 OsmNode(2, Decimal('-36.9'), Decimal('174.8'), {'AMENITY': 'cafe'})]
+        second = [OsmNode(3, Decimal('-37.0'), Decimal('174.9'), {'amenity': 'cafe', 'shop': 'yes'})]
+
+        import_one_by_one(first)
+        import_one_by_one(second)
+        expected = database_content()
+        clear_database()
+
+        for nodes in [first, second]:
+            importer = NodeImporter(batch_size=7)
+            for node in nodes:
+                importer.add(node)
+            importer.flush()
+
+        self.assertEqual(TagName.objects.count(), 3)
+        self.assertEqual(database_content(), expected)
+
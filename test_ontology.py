@@ -0,0 +1,178 @@
+import os
+import pickle
+import random
+import shutil
+import tempfile
+import time
+import unittest
+
+import numpy as np
+
+from osm_database.management.util.ontology import Ontology, load_ontology
+
+
+class Feature:
+    """
+    Stands for import_owl.Feature: a name and the list of parent features
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.parent = []
+
+
+def recursive_add_parents(core_features, root_feature, thing, rank):
+    """
+    The walk up the features that extract_feature_properties used before the compiled ontology
+    """
+    if root_feature is None:
+        return
+
+    if len(root_feature.parent) == 1 and thing in root_feature.parent:
+        return
+
+    for parent in root_feature.parent:
+        if parent == root_feature:
+            continue
+        core_features[parent.name] = (parent, rank)
+        recursive_add_parents(core_features, parent, thing, rank + 1)
+
+
+def prune_multualy_exclusive(core_features, multually_exclusive_feature_groups):
+    """
+    The pruning that extract_feature_properties used before the compiled ontology
+    """
+    for group in multually_exclusive_feature_groups:
+        rank_to_features = {}
+        lowest_rank = 9999
+        for feature in group:
+            _, rank = core_features.get(feature.name, (None, None))
+            if rank is not None:
+                if rank not in rank_to_features:
+                    features = []
+                    rank_to_features[rank] = features
+                else:
+                    features = rank_to_features[rank]
+                features.append(feature)
+                lowest_rank = min(lowest_rank, rank)
+        for rank, features in rank_to_features.items():
+            if rank > lowest_rank:
+                for feature in features:
+                    del core_features[feature.name]
+
+
+def make_features(num_features, max_parents, seed):
+    """
+    A random feature graph under Thing, where each feature has parents among the features made before it
+    """
+    rng = random.Random(seed)
+    thing = Feature('Thing')
+    features = [thing]
+    for i in range(1, num_features):
+        feature = Feature('Feature{}'.format(i))
+        num_parents = rng.randint(1, min(max_parents, i))
+        feature.parent = rng.sample(features, num_parents)
+        if rng.random() < 0.05:
+            feature.parent.append(feature)
+        features.append(feature)
+    return {'name': {x.name: x for x in features}, 'url': {}}
+
+
+def padded_ids(ontology, rows):
+    width = max(len(x) for x in rows)
+    return np.array([[ontology.ids[x.name] for x in row] + [-1] * (width - len(row)) for row in rows])
+
+
+class OntologyTest(unittest.TestCase):
+    def test_ancestors_same_as_recursive_walk(self):
+        feature_dict = make_features(120, 3, seed=1)
+        features = list(feature_dict['name'].values())
+        thing = feature_dict['name']['Thing']
+        ontology = Ontology.from_feature_dict(feature_dict)
+
+        rng = random.Random(2)
+        rows = [rng.sample(features, rng.randint(1, 3)) for _ in range(200)]
+        ranks = ontology.ancestor_ranks(padded_ids(ontology, rows))
+        for row, row_ranks in zip(rows, ranks):
+            core_features = {}
+            for feature in row:
+                recursive_add_parents(core_features, feature, thing, 1)
+            self.assertEqual({ontology.names[i] for i in np.flatnonzero(row_ranks)}, set(core_features))
+
+    def test_ranks_are_shortest_distances(self):
+        feature_dict = make_features(80, 3, seed=3)
+        ontology = Ontology.from_feature_dict(feature_dict)
+        thing = feature_dict['name']['Thing']
+        for feature in feature_dict['name'].values():
+            i = ontology.ids[feature.name]
+            expected = {}
+            frontier = [] if feature.parent == [thing] else feature.parent
+            rank = 1
+            while frontier:
+                next_frontier = []
+                for parent in frontier:
+                    if parent is not feature and parent.name not in expected:
+                        expected[parent.name] = rank
+                        if parent.parent != [thing]:
+                            next_frontier.extend(parent.parent)
+                frontier = next_frontier
+                rank += 1
+            self.assertEqual({ontology.names[j]: int(ontology.ranks[i, j]) for j in np.flatnonzero(ontology.ranks[i])},
+                             expected)
+
+    def test_same_columns_as_before_on_a_tree(self):
+        """
+        With one parent per feature there is one path to each ancestor, so ranks and pruning are the same as before
+        """
+        feature_dict = make_features(150, 1, seed=4)
+        features = list(feature_dict['name'].values())
+        thing = feature_dict['name']['Thing']
+        ontology = Ontology.from_feature_dict(feature_dict)
+
+        rng = random.Random(5)
+        groups = [rng.sample(features[1:30], 4), rng.sample(features[30:60], 3)]
+        group_ids = [[ontology.ids[x.name] for x in group] for group in groups]
+        rows = [rng.sample(features, 3) for _ in range(200)]
+        unpruned = ontology.ancestor_ranks(padded_ids(ontology, rows))
+        ranks = ontology.prune_mutually_exclusive(unpruned.copy(), group_ids)
+        self.assertTrue((ranks != unpruned).any())
+        for row, row_ranks in zip(rows, ranks):
+            core_features = {}
+            for feature in row:
+                recursive_add_parents(core_features, feature, thing, 1)
+            prune_multualy_exclusive(core_features, groups)
+            self.assertEqual({ontology.names[i] for i in np.flatnonzero(row_ranks)}, set(core_features))
+
+    def test_load_ontology(self):
+        directory = tempfile.mkdtemp()
+        try:
+            compiled_file = os.path.join(directory, 'feature_ontology.npz')
+            pickle_file = os.path.join(directory, 'feature_dict.pkl')
+            with self.assertRaises(Exception):
+                load_ontology(compiled_file, pickle_file)
+
+            feature_dict = make_features(30, 2, seed=6)
+            with open(pickle_file, 'wb') as f:
+                pickle.dump(feature_dict, f)
+            compiled = load_ontology(compiled_file, pickle_file)
+            self.assertTrue(os.path.isfile(compiled_file))
+
+            loaded = load_ontology(compiled_file, pickle_file)
+            self.assertEqual(loaded.names, compiled.names)
+            np.testing.assert_array_equal(loaded.ranks, compiled.ranks)
+            for i in range(len(loaded)):
+                np.testing.assert_array_equal(loaded.parents_of(i), compiled.parents_of(i))
+
+            # A newer pickle is compiled again
+            feature_dict = make_features(40, 2, seed=7)
+            with open(pickle_file, 'wb') as f:
+                pickle.dump(feature_dict, f)
+            later = time.time() + 10
+            os.utime(pickle_file, (later, later))
+            self.assertEqual(len(load_ontology(compiled_file, pickle_file)), 40)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+from unittest import mock
+
+from lxml import etree
+
+from osm_database.management.util import osm_reader
+from osm_database.management.util.osm_reader import OsmMember, iter_osm
+
+try:
+    from bs4 import BeautifulSoup
+except ImportError:
+    BeautifulSoup = None
+
+
+def write_osm(filepath, num_nodes, num_ways, num_relations):
+    """
+    Write an .osm file with the nodes first, then the ways, then the relations, as in the extracts
+    """
+    with open(filepath, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n')
+        f.write(' <bounds minlat="-37.0" minlon="174.0" maxlat="-36.0" maxlon="175.0"/>\n')
+        for i in range(1, num_nodes + 1):
+            f.write(' <node id="{}" lat="-36.{:07d}" lon="174.{:07d}" version="1">\n'.format(i, i, i * 3))
+            if i % 3 == 0:
+                f.write('  <tag k="name" v="Node {}"/>\n  <tag k="amenity" v="cafe"/>\n'.format(i))
+            f.write(' </node>\n')
+        for i in range(1, num_ways + 1):
+            f.write(' <way id="{}">\n'.format(1000000 + i))
+            for ref in range(i, i + 4):
+                f.write('  <nd ref="{}"/>\n'.format(ref))
+            f.write('  <tag k="highway" v="residential"/>\n </way>\n')
+        for i in range(1, num_relations + 1):
+            f.write(' <relation id="{}">\n'.format(2000000 + i))
+            f.write('  <member type="way" ref="{}" role="outer"/>\n'.format(1000000 + i))
+            f.write('  <member type="node" ref="{}" role=""/>\n'.format(i))
+            f.write('  <tag k="type" v="multipolygon"/>\n </relation>\n')
+        f.write('</osm>\n')
+
+
+class IterOsmTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.directory, 'extract.osm')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_order_and_records(self):
+        write_osm(self.filepath, 6, 2, 1)
+        records = list(iter_osm(self.filepath))
+
+        self.assertEqual([type(r).__name__ for r in records], ['OsmNode'] * 6 + ['OsmWay'] * 2 + ['OsmRelation'])
+        self.assertEqual([r.id for r in records[:6]], [1, 2, 3, 4, 5, 6])
+        self.assertEqual(records[2].lat, Decimal('-36.0000003'))
+        self.assertEqual(records[2].lon, Decimal('174.0000009'))
+        self.assertEqual(records[2].tags, {'name': 'Node 3', 'amenity': 'cafe'})
+        self.assertEqual(records[0].tags, {})
+        self.assertEqual(records[7].node_ids, [2, 3, 4, 5])
+        self.assertEqual(records[7].tags, {'highway': 'residential'})
+        self.assertEqual(records[8].members, [OsmMember('way', 1000001, 'outer'), OsmMember('node', 1, '')])
+
+    def test_kinds_are_filtered_in_document_order(self):
+        write_osm(self.filepath, 50, 10, 3)
+        records = list(iter_osm(self.filepath))
+
+        for kinds in [('node',), ('way',), ('relation',), ('way', 'relation')]:
+            expected = [r for r in records if type(r).__name__.lower()[3:] in kinds]
+            self.assertEqual(list(iter_osm(self.filepath, kinds=kinds)), expected)
+
+    def test_ids_only(self):
+        write_osm(self.filepath, 5, 3, 0)
+        ways = list(iter_osm(self.filepath, kinds=('way',), with_details=False))
+        self.assertEqual([w.id for w in ways], [1000001, 1000002, 1000003])
+        self.assertTrue(all(w.node_ids is None and w.tags is None for w in ways))
+
+    def test_ways_pass_frees_the_nodes(self):
+        """
+        A pass over the ways of a file that is mostly nodes must not keep the nodes in the tree
+        """
+        write_osm(self.filepath, 200000, 20, 0)
+        roots = []
+        iterparse = etree.iterparse
+
+        def recording_iterparse(*args, **kwargs):
+            for event, element in iterparse(*args, **kwargs):
+                if len(roots) == 0:
+                    roots.append(element.getroottree().getroot())
+                yield event, element
+
+        with mock.patch.object(osm_reader.etree, 'iterparse', recording_iterparse):
+            max_children = 0
+            num_ways = 0
+            for way in iter_osm(self.filepath, kinds=('way',), with_details=False):
+                num_ways += 1
+                max_children = max(max_children, len(roots[0]))
+
+        # The parser reads ahead by a buffer, so a few elements after the current one are already in the tree, but
+        # not the 200000 nodes
+        self.assertEqual(num_ways, 20)
+        self.assertLess(max_children, 2000)
+
+    @unittest.skipIf(BeautifulSoup is None, 'bs4 is not installed')
+    def test_same_nodes_as_beautifulsoup(self):
+        """
+        Compare with the BeautifulSoup parsing that import_osm used before
+        """
+        write_osm(self.filepath, 30, 5, 1)
+        with open(self.filepath, 'r') as f:
+            soup = BeautifulSoup(f.read(), 'lxml')
+
+        expected = []
+        for node in soup.select('node'):
+            tags = {tag.attrs['k']: tag.attrs['v'] for tag in node.select('tag')}
+            expected.append((int(node.attrs['id']), Decimal(node.attrs['lat']), Decimal(node.attrs['lon']), tags))
+        expected_way_ids = [int(way.attrs['id']) for way in soup.select('way')]
+
+        self.assertEqual([tuple(n) for n in iter_osm(self.filepath, kinds=('node',))], expected)
+        self.assertEqual([w.id for w in iter_osm(self.filepath, kinds=('way',), with_details=False)],
+                         expected_way_ids)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+
+from scrape.management.util.page_cache import INDEX_ENTRY, PageCache
+
+
+def page(i):
+    return '<html><body><p>Nama {} o te niupepa</p>{}</body></html>'.format(i, 'ā' * (i % 7))
+
+
+class PageCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.pack_file = os.path.join(self.directory, 'pages.pack')
+        self.index_file = os.path.join(self.directory, 'pages.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def fill(self, num_pages):
+        cache = PageCache(self.directory)
+        for i in range(num_pages):
+            cache.put('https://example.com/page/{}'.format(i), page(i))
+        cache.close()
+
+    def test_same_pages_as_zip_cache(self):
+        """
+        Pages read back are the ones the zip cache (one N.zip with a content.html per page) gave
+        """
+        zip_dir = os.path.join(self.directory, 'zip')
+        os.makedirs(zip_dir)
+        url_to_index = {}
+        for i in range(50):
+            url = 'https://example.com/page/{}'.format(i)
+            url_to_index[url] = i
+            with zipfile.ZipFile(os.path.join(zip_dir, '{}.zip'.format(i)), 'w', zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr('content.html', page(i))
+
+        cache = PageCache(self.directory)
+        for url, index in url_to_index.items():
+            with zipfile.ZipFile(os.path.join(zip_dir, '{}.zip'.format(index)), 'r') as zf:
+                cache.put(url, zf.read('content.html').decode('utf-8'))
+        cache.close()
+
+        cache = PageCache(self.directory, readonly=True)
+        for url, index in url_to_index.items():
+            with zipfile.ZipFile(os.path.join(zip_dir, '{}.zip'.format(index)), 'r') as zf:
+                self.assertEqual(cache[url], zf.read('content.html').decode('utf-8'))
+        cache.close()
+
+    def test_get_put_reopen(self):
+        self.fill(20)
+        cache = PageCache(self.directory)
+        self.assertEqual(len(cache), 20)
+        self.assertEqual(cache.get('https://example.com/page/7'), page(7))
+        self.assertIn('https://example.com/page/19', cache)
+        self.assertIsNone(cache.get('https://example.com/missing'))
+        with self.assertRaises(KeyError):
+            cache['https://example.com/missing']
+
+        cache['https://example.com/page/7'] = 'new version'
+        cache.close()
+
+        cache = PageCache(self.directory, readonly=True)
+        self.assertEqual(cache['https://example.com/page/7'], 'new version')
+        with self.assertRaises(Exception):
+            cache.put('https://example.com/page/1', 'read-only')
+        cache.close()
+
+    def test_identical_content_stored_once(self):
+        cache = PageCache(self.directory)
+        content = page(1) * 100
+        cache.put('https://example.com/a', content)
+        size = os.path.getsize(self.pack_file)
+        cache.put('https://example.com/b', content)
+        self.assertLess(os.path.getsize(self.pack_file) - size, 100)
+        self.assertEqual(cache.location('https://example.com/a'), cache.location('https://example.com/b'))
+        self.assertEqual(cache['https://example.com/b'], content)
+        cache.close()
+
+    def test_iter_locations_gives_latest_versions(self):
+        cache = PageCache(self.directory)
+        cache.put('https://example.com/a', 'first')
+        cache.put('https://example.com/b', 'b')
+        cache.put('https://example.com/a', 'second')
+        cache.put('https://example.com/c', 'b')
+        pages = {url: cache.read_at(offset, length) for url, offset, length in cache.iter_locations()}
+        self.assertEqual(pages, {'https://example.com/a': 'second', 'https://example.com/b': 'b',
+                                 'https://example.com/c': 'b'})
+        self.assertEqual(len(list(cache.iter_locations())), 3)
+        cache.close()
+
+    def test_index_behind_pack_is_caught_up(self):
+        """
+        A crash between appending a record to the pack and its entry to the index
+        """
+        self.fill(10)
+        os.truncate(self.index_file, INDEX_ENTRY.size * 7)
+
+        cache = PageCache(self.directory)
+        self.assertEqual(len(cache), 10)
+        for i in range(10):
+            self.assertEqual(cache['https://example.com/page/{}'.format(i)], page(i))
+        cache.close()
+        self.assertEqual(os.path.getsize(self.index_file), INDEX_ENTRY.size * 10)
+
+    def test_partial_index_entry_is_dropped(self):
+        self.fill(5)
+        with open(self.index_file, 'ab') as f:
+            f.write(b'\x01' * (INDEX_ENTRY.size // 2))
+
+        cache = PageCache(self.directory)
+        self.assertEqual(len(cache), 5)
+        cache.put('https://example.com/page/5', page(5))
+        cache.close()
+
+        cache = PageCache(self.directory, readonly=True)
+        for i in range(6):
+            self.assertEqual(cache['https://example.com/page/{}'.format(i)], page(i))
+        cache.close()
+
+    def test_truncated_record_is_discarded(self):
+        """
+        A crash in the middle of appending a record: the earlier pages are kept and new ones can be added
+        """
+        self.fill(8)
+        pack_size = os.path.getsize(self.pack_file)
+        os.truncate(self.index_file, INDEX_ENTRY.size * 7)
+        os.truncate(self.pack_file, pack_size - 5)
+
+        cache = PageCache(self.directory)
+        self.assertEqual(len(cache), 7)
+        self.assertNotIn('https://example.com/page/7', cache)
+        cache.put('https://example.com/page/7', page(7))
+        cache.close()
+
+        cache = PageCache(self.directory, readonly=True)
+        for i in range(8):
+            self.assertEqual(cache['https://example.com/page/{}'.format(i)], page(i))
+        cache.close()
+
+
+if __name__ == '__main__':
+    unittest.main()